@@ -1,7 +1,13 @@
+import os
+import time
+import uuid
+
 import streamlit as st
-import pandas as pd
-import joblib
-from geopy.geocoders import Nominatim
+
+# artifacts.py itself is cheap to import; the registry loads nothing until
+# a page asks for the artifacts.
+from artifacts import get_artifacts, get_registry
+from telemetry import get_telemetry, observe, serve_metrics_from_env, set_session, span
 
 # -----------------------------------------------------------------------
 # GPS bridge — history of fixes
@@ -35,16 +41,56 @@ from geopy.geocoders import Nominatim
 # channel for component-to-Python data flow. No DOM hacking, no
 # synthetic events, no URL round-trip.
 # -----------------------------------------------------------------------
-import streamlit.components.v1 as components  # kept (unused) — harmless
-from streamlit_js_eval import get_geolocation  # NEW: official component bridge
+# (streamlit_js_eval is imported on the Predict page, where it is used.)
+
+# -----------------------------------------------------------------------
+# Lazy imports
+#
+# Every page used to pay for pandas, joblib, geopy, streamlit_js_eval,
+# folium and streamlit_folium plus loading every artifact before the
+# sidebar had even picked a page, so Home / Model Info / About cost as
+# much as Predict on a cold container.  Heavy modules are now imported by
+# the page that uses them and the artifacts are loaded on first use.
+# Python caches imports per process, so this only moves cost to the
+# first page that needs it; `python page_budget.py` measures cold start
+# and each page's first render against a budget.
+# -----------------------------------------------------------------------
+def load_folium():
+    """(folium, st_folium), or None if the map packages are missing."""
+    try:
+        import folium
+        from streamlit_folium import st_folium
+        return folium, st_folium
+    except Exception:
+        return None
 
-# Optional map preview
-try:
-    import folium
-    from streamlit_folium import st_folium
-    FOLIUM_AVAILABLE = True
-except Exception:
-    FOLIUM_AVAILABLE = False
+
+def load_artifacts():
+    # The pickles and the dataset are loaded once per process by the shared
+    # registry (see artifacts.py) and hot-swapped when a retrain replaces the
+    # files, so a rerun here costs a dictionary lookup instead of an unpickle.
+    artifacts = get_artifacts()
+
+    for name, path, err in artifacts.errors:
+        if name == "dataset":
+            st.error(f"Could not load {os.path.basename(path)}: {err}")
+        else:
+            st.error(f"Could not load {name} from {path}: {err}")
+    return artifacts
+
+
+# ===============================
+# Telemetry
+# ===============================
+# Every span taken during this rerun (artifact load, geocoding, encode,
+# predict, map render; see telemetry.py) is tagged with the session id
+# and rerun number.  GWP_METRICS_PORT serves the histograms to
+# Prometheus; ?debug=1 or GWP_DEBUG_PANEL=1 shows them in the sidebar.
+if "session_id" not in st.session_state:
+    st.session_state["session_id"] = uuid.uuid4().hex[:12]
+st.session_state["rerun"] = st.session_state.get("rerun", 0) + 1
+set_session(st.session_state["session_id"], st.session_state["rerun"])
+serve_metrics_from_env()
 
 
 # ===============================
@@ -91,89 +137,30 @@ label { font-size:20px !important; font-weight:800 !important; color:#f5c77a !im
     unsafe_allow_html=True,
 )
 
-# ===============================
-# Load Artifacts
-# ===============================
-def safe_load(path, name):
-    try:
-        return joblib.load(path)
-    except Exception as e:
-        st.error(f"Could not load {name} from {path}: {e}")
-        return None
 
+@st.fragment(run_every=0.5)
+def address_pending():
+    # Polls the background lookup without rerunning the whole page; when
+    # what the status line should say changes (the timeout note, then the
+    # address whenever it arrives) one full rerun shows it, and once the
+    # answer is final this fragment is no longer rendered.
+    lookup = st.session_state.get("geo_address")
+    if lookup is None or lookup.done or lookup.poll() != st.session_state.get("geo_address_shown"):
+        st.rerun()
+    st.caption("🔎 Looking up the address…")
 
-def getLocDetails(lat,long):
-# Initialize Nominatim API
-    geolocator = Nominatim(user_agent="geoapi_exercise")
-    
-    # Coordinates (Latitude, Longitude)
-    # coords = "25.594095, 85.137566"
-    # coords = "-19.447881,29.813125"
-    coords = f"{lat},{long}"
-    # Get location information
-    location = geolocator.reverse(coords)
-    
-    # Access the address dictionary
-    address = location.raw['address']
-    
-    # Safely extract country
-    country = address.get('country', '')
-    state = address.get('state', '')
-    city = address.get('city', '')
-    
-    return f"Country: {country}, Province: {state}, City: {city}"
-
-
-# print(address)
-
-
-model = safe_load("svm_model.pkl", "model")
-scaler = safe_load("scaler.pkl", "scaler")
-encoder = safe_load("encoder.pkl", "encoder")
-selected_features = safe_load("selected_features.pkl", "selected_features")
-
-# ===============================
-# Load Dataset (for feature options)
-# ===============================
-data = None
-full_features = []
-default_values = {}
-
-try:
-    data = pd.read_csv("augmented_data.csv")
-
-    # If your CSV has a different order/names, edit these lines:
-    data.columns = [
-        "Decision",
-        "Soil.Texture",
-        "Soil.Colour",
-        "Geological.Features",
-        "Elevation",
-        "Natural.vegitation..tree..vigour",
-        "Natural.vegitation..tree..height",
-        "Drainage.Density",
-    ]
-
-    full_features = [c for c in data.columns if c != "Decision"]
-
-    for col in full_features:
-        try:
-            default_values[col] = data[col].mode(dropna=True).iloc[0]
-        except Exception:
-            default_values[col] = ""
-except Exception as e:
-    st.error(f"Could not load augmented_data.csv: {e}")
-    data = pd.DataFrame()
-    full_features = []
-    default_values = {}
 
 # ===============================
 # Sidebar
 # ===============================
 st.sidebar.title("🌍 Groundwater Potential Mapping")
 page = st.sidebar.radio(
-    "Navigation", ["Home", "Predict", "Model Info", "Feature Guide", "About"]
+    "Navigation", ["Home", "Predict", "Bulk Predict", "Model Info", "Feature Guide", "About"]
 )
+# Known once a page has loaded the artifacts in this process; Home and
+# About do not load them just for this line.
+if get_registry().version:
+    st.sidebar.caption(f"Model version: {get_registry().version}")
 
 
 # ===============================
@@ -207,6 +194,17 @@ elif page == "Predict":
     st.title("🔮 Predict Groundwater Potential")
     st.write("### Select values for the predictors:")
 
+    from geocoding import AddressLookup
+    from prediction import predict_one
+    from streamlit_js_eval import get_geolocation  # official component bridge
+
+    artifacts = load_artifacts()
+    selected_features = artifacts.selected_features
+    # Predictor names, levels and defaults come from feature_schema.json
+    # (see feature_schema.py), not from the training CSV.
+    schema = artifacts.schema
+    default_values = artifacts.default_values
+
     # session state (safe approach; no experimental_rerun, no key= in geolocation)
 
     if "detected_latlon" not in st.session_state:
@@ -259,12 +257,14 @@ elif page == "Predict":
         if st.button("📍 Detect My Location"):
             st.session_state["geo_request_id"] += 1
             st.session_state["geo_active"] = True
+            st.session_state["geo_started"] = time.perf_counter()
             st.session_state["detected_latlon"] = None
 
     with geo_col2:
         if st.button("↻ Re-detect"):
             st.session_state["geo_request_id"] += 1
             st.session_state["geo_active"] = True
+            st.session_state["geo_started"] = time.perf_counter()
             st.session_state["detected_latlon"] = None
 
     # Only render the geolocation component while a request is active.
@@ -282,6 +282,10 @@ elif page == "Predict":
 
             st.session_state["detected_latlon"] = (detected_lat, detected_lon)
             st.session_state["geo_active"] = False
+            # Click to coordinates, including the browser prompt
+            started = st.session_state.pop("geo_started", None)
+            if started is not None:
+                observe("geolocation", time.perf_counter() - started)
 
             # ✅ Coordinates are now in Python — print to the streamlit
             # server console as the user explicitly requested.
@@ -295,9 +299,18 @@ elif page == "Predict":
     # Status line shown to the user in the app itself.
     latlon = st.session_state.get("detected_latlon", None)
     if latlon:
-        val = getLocDetails(latlon[0], latlon[1])
-        st.success(f"📌 Location detected: Longitude: {latlon[0]:.6f}, Latitude: {latlon[1]:.6f}  " + val)
+        # Reverse geocoding runs in the background (see AddressLookup);
+        # the rest of the page renders now and the address fills in later.
+        lookup = st.session_state.get("geo_address")
+        if lookup is None or lookup.latlon != tuple(latlon):
+            lookup = AddressLookup(latlon[0], latlon[1])
+            st.session_state["geo_address"] = lookup
+        val = lookup.poll()
+        st.session_state["geo_address_shown"] = val
+        st.success(f"📌 Location detected: Longitude: {latlon[0]:.6f}, Latitude: {latlon[1]:.6f}  " + (val or ""))
         # st.success(val)
+        if not lookup.done:
+            address_pending()
     elif st.session_state["geo_active"]:
         st.info("⏳ Waiting for the browser… please allow location access when it prompts you.")
     else:
@@ -305,50 +318,54 @@ elif page == "Predict":
 
     # latlon is already set above; the Folium map block below reads it.
 
-    # ---- Map Preview with a clearly visible marker ----
-    if FOLIUM_AVAILABLE:
-        # Zimbabwe-ish fallback if GPS missing
-        base_location = latlon if latlon else (-19.0, 29.0)
-
-        m = folium.Map(location=base_location, zoom_start=14, tiles="OpenStreetMap")
-
-        if latlon:
-            lat, lon = latlon
-
-            # Big circle marker (high visibility)
-            folium.CircleMarker(
-                location=[lat, lon],
-                radius=16,
-                color="#00ffea",
-                fill=True,
-                fill_color="#00ffea",
-                fill_opacity=0.95,
-                popup="You are here",
-            ).add_to(m)
-
-            # Text label marker using DivIcon
-            folium.map.Marker(
-                [lat, lon],
-                icon=folium.DivIcon(
-                    html=f"""
-                    <div style="
-                        font-size:14px;
-                        font-weight:900;
-                        color:#000;
-                        background:#00ffea;
-                        padding:6px 10px;
-                        border-radius:10px;
-                        box-shadow: 0 0 14px rgba(0,255,234,0.6);
-                        border:2px solid #ffffff;
-                    ">
-                    YOU
-                    </div>
-                    """
-                ),
-            ).add_to(m)
-
-        st_folium(m, width=700, height=380)
+    # Surveyed points and earlier predictions around the fix (see
+    # spatial_index.py), drawn on the map and summarised with the result;
+    # this session's own predictions ({location: record time}) are not
+    # context and are left out.
+    own_predictions = st.session_state.setdefault("own_predictions", {})
+    nearby = None
+    if latlon:
+        try:
+            from spatial_index import context, get_spatial_index
+
+            with span("spatial_query"):
+                nearby = context(get_spatial_index(), latlon[0], latlon[1],
+                                 exclude=own_predictions.values())
+        except Exception as e:
+            print(f"[spatial_index] {e}", flush=True)
+
+    # Interpolated P(High) around the fix from the same points (see
+    # interpolation.py); recomputed only when the points or method change.
+    surface = None
+    if nearby is not None and st.toggle("🗺️ Potential surface", key="surface_mode"):
+        method = st.radio("Interpolation", ["idw", "kriging"], horizontal=True,
+                          key="surface_method",
+                          format_func={"idw": "Inverse distance", "kriging": "Ordinary kriging"}.get)
+        index = get_spatial_index()
+        key = (tuple(latlon), method, len(index), len(own_predictions))
+        cached = st.session_state.get("surface")
+        if cached is not None and cached[0] == key:
+            surface = cached[1]
+        else:
+            from interpolation import local_surface
+
+            with span("interpolation"):
+                surface = local_surface(index, latlon[0], latlon[1], method=method,
+                                        exclude=own_predictions.values())
+            st.session_state["surface"] = (key, surface)
+        if surface is None:
+            st.caption("Not enough surveyed points or other visitors' predictions nearby "
+                       "for a surface yet.")
 
+    # ---- Map Preview with a clearly visible marker ----
+    # Same location, same bytes (see predict_map.py): changing a
+    # predictor no longer re-sends the map.
+    mapping = load_folium()
+    if mapping is not None:
+        from predict_map import show_predict_map
+
+        with span("folium_render"):
+            show_predict_map(mapping[1], latlon, nearby, surface)
     else:
         st.info("Map preview disabled (install folium + streamlit-folium if you want).")
 
@@ -359,15 +376,15 @@ elif page == "Predict":
 
     if selected_features is None:
         st.error("Selected features are not loaded. Check selected_features.pkl.")
-    elif data is None or data.empty:
-        st.error("Dataset not loaded correctly. Check augmented_data.csv.")
+    elif schema is None:
+        st.error("Feature schema not loaded. Check feature_schema.json.")
     else:
         user_inputs = {}
 
         for feature in selected_features:
-            # If feature exists in your dataset, use select options
-            if feature in data.columns:
-                options = sorted(data[feature].dropna().unique().tolist())
+            # If feature exists in the schema, use its levels as options
+            options = schema.options(feature)
+            if options:
                 user_inputs[feature] = st.selectbox(f"🔸 {feature}", options, key=f"feat_{feature}")
             else:
                 # Otherwise allow manual entry (string)
@@ -379,31 +396,13 @@ elif page == "Predict":
 
         if st.button("✨ Predict Potential"):
             try:
-                if model is None or scaler is None or encoder is None:
-                    st.error("Model/scaler/encoder not loaded. Check pickle files.")
+                if not artifacts.has_model:
+                    st.error("Model not loaded. Check model.gwpb or the pickle files.")
                 else:
-                    # Build full input for ALL features used by the pipeline
-                    full_input = dict(default_values)
-                    full_input.update(user_inputs)
-
-                    # Ensure all full_features exist
-                    for col in full_features:
-                        if col not in full_input:
-                            full_input[col] = default_values.get(col, "")
-
-                    # Order columns exactly
-                    input_df = pd.DataFrame([full_input])[full_features]
-
-                    # Encode + scale + select
-                    encoded = encoder.transform(input_df)
-                    encoded_df = pd.DataFrame(encoded, columns=full_features)
-
-                    selected_df = encoded_df[selected_features]
-                    scaled = scaler.transform(selected_df)
-
-                    # Predict
-                    pred = model.predict(scaled)[0]
-                    probs = model.predict_proba(scaled)[0]
+                    # Table lookup over the precomputed feature space (see
+                    # lookup_table.py); falls back to the encoder -> scaler
+                    # -> SVC pipeline for values the table does not cover.
+                    pred, probs = predict_one(artifacts, user_inputs)
 
                     st.markdown("---")
                     if pred == 1:
@@ -414,10 +413,133 @@ elif page == "Predict":
                     col1, col2 = st.columns(2)
                     col1.metric("High Potential Confidence", f"{probs[1]*100:.2f}%")
                     col2.metric("Low Potential Confidence", f"{probs[0]*100:.2f}%")
+                    st.session_state["has_prediction"] = True
+
+                    if nearby is not None:
+                        obs_km = nearby["observation_km"]
+                        if nearby["observed_labelled"]:
+                            st.info(
+                                f"📍 {nearby['observed_high']} of the {nearby['observed_labelled']} nearest "
+                                f"surveyed points are High Potential (nearest {obs_km[0]:.1f} km, "
+                                f"furthest {obs_km[-1]:.1f} km)."
+                            )
+                        else:
+                            st.info("📍 No surveyed points in the index yet.")
+                        n_pred = len(nearby["predictions"])
+                        if n_pred:
+                            st.caption(
+                                f"{n_pred} earlier predictions within {nearby['radius_km']:g} km, "
+                                f"{nearby['predicted_high']} of them High Potential."
+                            )
+                        # Log this one for the next visitor nearby, once per
+                        # location however often this session clicks
+                        if tuple(latlon) not in own_predictions:
+                            own_predictions[tuple(latlon)] = get_spatial_index().add_prediction(
+                                latlon[0], latlon[1], pred, probs[1])
 
             except Exception as e:
                 st.error(f"System Error: {e}")
 
+        # What-if sweep: every single and pairwise change of the current
+        # inputs scored in one batch (see sensitivity.py), instead of
+        # flipping one selectbox per rerun.
+        if st.session_state.get("has_prediction") and artifacts.has_model:
+            if st.toggle("🔬 Sensitivity analysis", key="sensitivity_mode"):
+                try:
+                    from sensitivity import DELTA_COLUMN, feature_influence, sweep
+
+                    include_pairs = st.checkbox("Include pairs of changes", value=True)
+                    (base_label, base_high), variations = sweep(
+                        artifacts, user_inputs, pairs=include_pairs
+                    )
+                    flips = variations[variations["Flips"]]
+                    st.write(
+                        f"Current inputs: **{'High' if base_label == 1 else 'Low'} Potential** "
+                        f"(P(High) {base_high*100:.1f}%). {len(variations)} variations scored, "
+                        f"**{len(flips)}** change the outcome."
+                    )
+                    st.write("Largest probability change from one feature alone:")
+                    st.bar_chart(feature_influence(variations))
+                    if len(flips):
+                        st.write("Changes that flip the outcome:")
+                        st.dataframe(flips.drop(columns=["Flips"]), hide_index=True,
+                                     use_container_width=True)
+                    with st.expander("All variations"):
+                        st.dataframe(variations.style.format({DELTA_COLUMN: "{:+.3f}"}),
+                                     hide_index=True, use_container_width=True)
+                except Exception as e:
+                    st.error(f"Sensitivity analysis failed: {e}")
+
+    st.markdown("</div>", unsafe_allow_html=True)
+
+
+# ===============================
+# BULK PREDICT
+# ===============================
+elif page == "Bulk Predict":
+    st.markdown("<div class='card'>", unsafe_allow_html=True)
+    st.title("🗺️ Bulk Predict Surveyed Points")
+    st.write(
+        "Upload a CSV with **Latitude**, **Longitude** and the predictor columns. "
+        "All rows are scored in one call and nearby points share one address lookup."
+    )
+
+    points_file = st.file_uploader("Survey points (CSV)", type=["csv"], key="bulk_points")
+    do_geocode = st.checkbox("Look up addresses", value=True)
+
+    if points_file is not None and st.button("🚀 Score points"):
+        try:
+            import pandas as pd
+
+            from bulk_scoring import score_points
+
+            artifacts = load_artifacts()
+            bar = st.progress(0.0, text="Scoring…")
+
+            def _geocode_progress(done, total):
+                bar.progress(done / total, text=f"Resolved {done:,}/{total:,} distinct locations")
+
+            with span("csv_parse"):
+                points = pd.read_csv(points_file)
+            scored, unknown = score_points(
+                artifacts, points, geocode=do_geocode, progress=_geocode_progress,
+            )
+            if "Decision" in points.columns:
+                # Surveyed outcomes become ground truth for the Predict
+                # page's nearby context (see spatial_index.py)
+                from spatial_index import get_spatial_index, observations_from_frame
+
+                added = get_spatial_index().add(observations_from_frame(points))
+                st.caption(f"Added {added:,} surveyed points to the spatial index.")
+            bar.progress(1.0, text=f"Scored {len(scored):,} points")
+            st.session_state["bulk_scored"] = scored
+            st.session_state["bulk_unknown"] = unknown
+            st.session_state["bulk_run"] = uuid.uuid4().hex
+        except Exception as e:
+            st.error(f"System Error: {e}")
+
+    scored = st.session_state.get("bulk_scored")
+    if scored is not None:
+        if st.session_state.get("bulk_unknown"):
+            st.warning(f"{st.session_state['bulk_unknown']:,} points contain values the model was not trained on.")
+        counts = scored["Prediction"].value_counts()
+        col1, col2 = st.columns(2)
+        col1.metric("High Potential points", f"{counts.get('High Potential', 0):,}")
+        col2.metric("Low Potential points", f"{counts.get('Low Potential', 0):,}")
+
+        mapping = load_folium()
+        if mapping is not None:
+            from bulk_scoring import points_map
+            from predict_map import stable_ids
+
+            # Same ids for the whole scoring run, so reruns re-send nothing
+            points = stable_ids(points_map(scored), st.session_state.get("bulk_run"))
+            st_folium = mapping[1]
+            st_folium(points, key="bulk_map", width=900, height=500, returned_objects=[])
+        st.dataframe(scored, use_container_width=True)
+        st.download_button("Download results", scored.to_csv(index=False),
+                           file_name="scored_points.csv", mime="text/csv")
+
     st.markdown("</div>", unsafe_allow_html=True)
 
 
@@ -435,6 +557,19 @@ elif page == "Model Info":
 **Encoding:** OrdinalEncoder
 """
     )
+    artifacts = load_artifacts()
+    selected_features = artifacts.selected_features
+    st.write(f"**Active model version:** `{artifacts.version}`")
+    if artifacts.bundle is not None:
+        st.write(f"**Kernel:** `{artifacts.bundle.manifest['model']['kernel']}` "
+                 f"({len(artifacts.bundle.arrays['support_vectors'])} support vectors)")
+    if artifacts.has_model:
+        from prediction_cache import get_prediction_memo
+
+        memo = get_prediction_memo().stats()
+        hit_rate = f"{memo['hit_rate']:.0%}" if memo["hit_rate"] is not None else "–"
+        st.write(f"**Prediction cache:** {memo['entries']:,} of {memo['max_entries']:,} entries, "
+                 f"{memo['hits']:,} hits / {memo['misses']:,} misses ({hit_rate})")
 
     st.subheader("Selected Predictors:")
     if selected_features:
@@ -453,20 +588,25 @@ elif page == "Feature Guide":
     st.markdown("<div class='card'>", unsafe_allow_html=True)
     st.title("📘 Feature Guide")
 
-    if data is not None and not data.empty:
-        for col in full_features:
+    schema = load_artifacts().schema
+
+    if schema is not None:
+        for col in schema.features:
             st.subheader(col)
-            if col in data.columns:
-                try:
-                    vals = sorted(data[col].dropna().unique().tolist())
-                    st.write("Possible values:")
-                    st.write(vals)
-                except Exception as e:
-                    st.write(f"Could not list values: {e}")
+            vals = schema.options(col)
+            if vals:
+                st.write("Possible values:")
+                st.write(vals)
+                counts = schema.frequencies.get(col, {})
+                total = sum(counts.values())
+                if total:
+                    st.caption("Share of surveyed sites: " + ", ".join(
+                        f"{v} {counts.get(str(v), 0) / total:.0%}" for v in vals
+                    ))
             else:
-                st.write(f"Column '{col}' not found in loaded dataset.")
+                st.write(f"Column '{col}' not found in the feature schema.")
     else:
-        st.warning("Dataset not available. Check augmented_data.csv.")
+        st.warning("Feature schema not available. Check feature_schema.json.")
 
     st.markdown("</div>", unsafe_allow_html=True)
 
@@ -490,3 +630,32 @@ BY BENSON MAJAWA
 """
     )
     st.markdown("</div>", unsafe_allow_html=True)
+
+
+# ===============================
+# Debug panel
+# ===============================
+# Drawn last so it includes the spans of this rerun.
+if st.query_params.get("debug") == "1" or os.environ.get("GWP_DEBUG_PANEL") == "1":
+    telemetry = get_telemetry()
+    session_id = st.session_state["session_id"]
+    with st.sidebar.expander("⏱️ Stage timings", expanded=True):
+        st.caption(f"Session `{session_id}`, rerun {st.session_state['rerun']}")
+        summary = telemetry.summary()
+        if summary:
+            st.write("**This process**")
+            st.dataframe(
+                [{"stage": k, "n": v["count"], "mean ms": round(v["mean_ms"], 3),
+                  "p95 ms": round(v["p95_ms"], 3)} for k, v in summary.items()],
+                hide_index=True, use_container_width=True,
+            )
+            st.write("**This session, latest first**")
+            st.dataframe(
+                [{"rerun": s["rerun"], "stage": s["stage"], "ms": round(s["ms"], 3)}
+                 for s in telemetry.spans(session=session_id, limit=50)],
+                hide_index=True, use_container_width=True,
+            )
+            st.download_button("Prometheus text", telemetry.prometheus_text(),
+                               file_name="metrics.txt", mime="text/plain")
+        else:
+            st.caption("No spans recorded yet.")
@@ -0,0 +1,343 @@
+import hashlib
+import os
+import threading
+import time
+
+from telemetry import span
+
+# -----------------------------------------------------------------------
+# Process-wide artifact registry
+#
+# Streamlit re-executes app.py from the top on every widget interaction,
+# so loading the pickles and the CSV at module level meant every click,
+# in every session, paid for four joblib.load() calls and a read_csv().
+# Python modules, on the other hand, are imported once per process, so a
+# registry held in this module is shared by every session of the worker.
+#
+# The registry stats the artifact files (cheap) at most once every
+# `check_interval` seconds.  When a file's mtime/size changes it waits
+# for the files to settle (a retrain writes them one after another),
+# loads a complete new ArtifactSet off to the side and then swaps the
+# reference in one assignment.  Readers always see either the old set or
+# the new set, never a mix.  If the new files fail to load, the previous
+# good set stays active and the error is kept in `last_error`.
+#
+# When a model bundle (model.gwpb, see model_bundle.py) is present it is
+# loaded instead of the pickles: the model then runs on the compiled
+# kernel straight from the memory-mapped arrays and model / scaler /
+# encoder stay None.  The pickles remain a fallback for older deployments.
+#
+# Likewise the feature schema (feature_schema.json, see feature_schema.py)
+# replaces the CSV: predictor names, levels and defaults come from it and
+# `data` stays empty.  The CSV is only read when there is no schema.
+# -----------------------------------------------------------------------
+
+BASE_DIR = os.environ.get(
+    "GWP_ARTIFACT_DIR", os.path.dirname(os.path.abspath(__file__))
+)
+
+ARTIFACT_FILES = {
+    "model": "svm_model.pkl",
+    "scaler": "scaler.pkl",
+    "encoder": "encoder.pkl",
+    "selected_features": "selected_features.pkl",
+}
+
+BUNDLE_FILE = "model.gwpb"
+
+SCHEMA_FILE = "feature_schema.json"
+
+DATA_FILE = "augmented_data.csv"
+
+# If your CSV has a different order/names, edit these lines:
+DATA_COLUMNS = [
+    "Decision",
+    "Soil.Texture",
+    "Soil.Colour",
+    "Geological.Features",
+    "Elevation",
+    "Natural.vegitation..tree..vigour",
+    "Natural.vegitation..tree..height",
+    "Drainage.Density",
+]
+
+
+class ArtifactSet:
+    """One consistent generation of model, preprocessing and dataset."""
+
+    def __init__(self, version, model, scaler, encoder, selected_features,
+                 data, full_features, default_values, errors, paths, bundle=None,
+                 schema=None):
+        self.version = version
+        self.model = model
+        self.scaler = scaler
+        self.encoder = encoder
+        self.selected_features = selected_features
+        self.data = data
+        self.full_features = full_features
+        self.default_values = default_values
+        self.errors = errors  # list of (name, path, exception)
+        self.paths = paths
+        self.bundle = bundle
+        self.schema = schema
+        self.loaded_at = time.time()
+        self._derived = {}
+        self._derived_lock = threading.RLock()
+
+    @property
+    def ok(self):
+        return not self.errors
+
+    @property
+    def has_model(self):
+        if self.bundle is not None:
+            return True
+        return None not in (self.model, self.scaler, self.encoder)
+
+    def cached(self, name, builder):
+        # Objects computed from the artifacts (lookup tables, compiled
+        # kernels, caches, ...) live on the set that produced them, so a
+        # reload invalidates them simply by replacing the set.
+        try:
+            return self._derived[name]
+        except KeyError:
+            pass
+        with self._derived_lock:
+            if name not in self._derived:
+                self._derived[name] = builder(self)
+            return self._derived[name]
+
+
+def _fingerprint(paths):
+    fp = []
+    for path in paths:
+        try:
+            st = os.stat(path)
+            fp.append((path, st.st_mtime_ns, st.st_size))
+        except OSError:
+            fp.append((path, None, None))
+    return tuple(fp)
+
+
+def load_dataset(path):
+    import pandas as pd
+
+    with span("csv_parse"):
+        data = pd.read_csv(path)
+    data.columns = DATA_COLUMNS
+
+    full_features = [c for c in data.columns if c != "Decision"]
+
+    default_values = {}
+    for col in full_features:
+        try:
+            default_values[col] = data[col].mode(dropna=True).iloc[0]
+        except Exception:
+            default_values[col] = ""
+
+    return data, full_features, default_values
+
+
+def load_inputs(paths, errors):
+    """Feature schema plus (data, full_features, default_values), from the
+    schema file when there is one, otherwise derived from the CSV.  data
+    is None unless the CSV was read, so the schema path never imports
+    pandas."""
+    from feature_schema import build_schema, load_schema
+
+    if os.path.exists(paths["schema"]):
+        try:
+            schema = load_schema(paths["schema"])
+            return schema, None, schema.features, dict(schema.defaults)
+        except Exception as e:
+            errors.append(("schema", paths["schema"], e))
+            return None, None, [], {}
+
+    try:
+        data, full_features, default_values = load_dataset(paths["data"])
+        return build_schema(data, full_features), data, full_features, default_values
+    except Exception as e:
+        errors.append(("dataset", paths["data"], e))
+        return None, None, [], {}
+
+
+def _load_bundle_set(paths):
+    from model_bundle import load_bundle
+
+    errors = []
+    try:
+        bundle = load_bundle(paths["bundle"])
+    except Exception as e:
+        errors.append(("bundle", paths["bundle"], e))
+        bundle = None
+
+    schema, data, full_features, default_values = load_inputs(paths, errors)
+
+    return ArtifactSet(
+        version=bundle.version if bundle is not None else None,
+        model=None,
+        scaler=None,
+        encoder=None,
+        selected_features=bundle.selected_features if bundle is not None else None,
+        data=data,
+        full_features=full_features,
+        default_values=default_values,
+        errors=errors,
+        paths=paths,
+        bundle=bundle,
+        schema=schema,
+    )
+
+
+def load_artifact_set(base_dir=BASE_DIR):
+    pickle_paths = {name: os.path.join(base_dir, f) for name, f in ARTIFACT_FILES.items()}
+    paths = {
+        "data": os.path.join(base_dir, DATA_FILE),
+        "schema": os.path.join(base_dir, SCHEMA_FILE),
+    }
+
+    bundle_path = os.path.join(base_dir, BUNDLE_FILE)
+    if os.path.exists(bundle_path):
+        return _load_bundle_set(dict(paths, bundle=bundle_path))
+
+    import joblib
+
+    loaded = {}
+    errors = []
+    digest = hashlib.sha256()
+
+    for name, path in pickle_paths.items():
+        try:
+            with open(path, "rb") as fh:
+                digest.update(fh.read())
+            loaded[name] = joblib.load(path)
+        except Exception as e:
+            errors.append((name, path, e))
+            loaded[name] = None
+
+    schema, data, full_features, default_values = load_inputs(paths, errors)
+
+    return ArtifactSet(
+        version=digest.hexdigest()[:12],
+        model=loaded["model"],
+        scaler=loaded["scaler"],
+        encoder=loaded["encoder"],
+        selected_features=loaded["selected_features"],
+        data=data,
+        full_features=full_features,
+        default_values=default_values,
+        errors=errors,
+        paths=dict(paths, **pickle_paths),
+        schema=schema,
+    )
+
+
+class ArtifactRegistry:
+    def __init__(self, base_dir=BASE_DIR, loader=load_artifact_set,
+                 check_interval=2.0, settle_seconds=1.0):
+        self.base_dir = base_dir
+        self.loader = loader
+        self.check_interval = check_interval
+        self.settle_seconds = settle_seconds
+        self.last_error = None
+        self.reload_count = 0
+        self._active = None
+        self._fingerprint = None
+        self._last_check = 0.0
+        self._lock = threading.Lock()
+        self._listeners = []
+
+    def _watched_paths(self):
+        names = list(ARTIFACT_FILES.values()) + [BUNDLE_FILE, SCHEMA_FILE, DATA_FILE]
+        return [os.path.join(self.base_dir, n) for n in names]
+
+    @property
+    def version(self):
+        active = self._active
+        return active.version if active is not None else None
+
+    def on_reload(self, callback):
+        """Register callback(new_set, old_set), called after each swap."""
+        self._listeners.append(callback)
+
+    def current(self):
+        active = self._active
+        if active is None:
+            with self._lock:
+                if self._active is None:
+                    self._load(_fingerprint(self._watched_paths()))
+                return self._active
+
+        now = time.monotonic()
+        if now - self._last_check < self.check_interval:
+            return active
+
+        # Only one thread does the stat/reload; everybody else keeps
+        # serving the active set instead of queueing behind the loader.
+        if not self._lock.acquire(blocking=False):
+            return active
+        try:
+            self._last_check = now
+            fp = _fingerprint(self._watched_paths())
+            if fp != self._fingerprint and self._settled(fp):
+                self._load(fp)
+            return self._active
+        finally:
+            self._lock.release()
+
+    def reload(self):
+        """Force a reload regardless of the file fingerprints."""
+        with self._lock:
+            self._load(_fingerprint(self._watched_paths()))
+            return self._active
+
+    def _settled(self, fp):
+        newest = max((m for _, m, _ in fp if m is not None), default=0)
+        return time.time_ns() - newest >= self.settle_seconds * 1e9
+
+    def _load(self, fp):
+        with span("artifact_load"):
+            new_set = self.loader(self.base_dir)
+
+        # A writer may have touched the files while we were reading them;
+        # in that case leave the fingerprint stale so the next check retries.
+        if _fingerprint(self._watched_paths()) != fp:
+            if self._active is None:
+                self._active = new_set
+            return
+
+        old_set = self._active
+        if old_set is not None and not new_set.ok:
+            # Keep serving the last good generation.
+            self.last_error = new_set.errors
+            self._fingerprint = fp
+            return
+
+        self._active = new_set
+        self._fingerprint = fp
+        self._last_check = time.monotonic()
+        self.last_error = None if new_set.ok else new_set.errors
+        if old_set is not None:
+            self.reload_count += 1
+            for callback in list(self._listeners):
+                try:
+                    callback(new_set, old_set)
+                except Exception as e:
+                    print(f"[artifacts] reload listener failed: {e}", flush=True)
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_registry():
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = ArtifactRegistry()
+    return _registry
+
+
+def get_artifacts():
+    return get_registry().current()
@@ -0,0 +1,431 @@
+import argparse
+import io
+import multiprocessing
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from artifacts import ArtifactRegistry, BASE_DIR, get_artifacts
+from columnar import is_columnar
+
+# -----------------------------------------------------------------------
+# Streaming batch scoring
+#
+# script2.py used to read the whole upload with pd.read_csv and keep the
+# raw frame plus encoded / selected / scaled copies alive at once, so
+# memory grew with the file.  Here the input is read in bounded chunks,
+# chunks are scored across a process pool and written out in input order
+# as soon as they are ready.  At most `2 * workers` chunks are in flight,
+# so peak memory depends on the chunk size, not on the file size.
+#
+# For a file on disk the parent only cuts the file into byte ranges on
+# line boundaries; each worker parses, scores and serialises its own
+# range.  Uploads (file-like objects) are parsed in the parent.
+#
+# Every pool worker loads the artifacts once (pool initializer) and
+# scores with the lookup table / compiled kernel.  In-process scoring
+# (workers=0) uses the caller's artifacts - by default the app's shared
+# get_artifacts() - so its table / kernel, already built and cached for
+# that generation, is reused instead of reloaded per call.  Rows with a level the model
+# was not trained on are written with an empty prediction instead of
+# failing the whole run; they are counted in the returned stats.
+#
+# Arrow IPC / Parquet inputs with dictionary-encoded predictors
+# (columnar.py) skip the CSV parse and the string encoding: each record
+# batch is one task, its codes are read straight from the dictionary
+# indices, and pool workers memory-map the file themselves instead of
+# being sent rows.
+#
+# Headless use:
+#     python batch_scoring.py survey.csv predictions.parquet --workers 8
+#     python batch_scoring.py survey.arrow predictions.parquet --workers 8
+# -----------------------------------------------------------------------
+
+DEFAULT_CHUNKSIZE = 100_000
+DEFAULT_CHUNK_BYTES = 16 * 2**20
+
+PREDICTION_COLUMN = "Prediction"
+PROBABILITY_COLUMN = "High.Potential.Probability"
+
+
+# ===============================
+# Scoring
+# ===============================
+def score_chunk(artifacts, chunk):
+    from inference import get_compiled_pipeline
+    from lookup_table import get_lookup_table
+    from prediction import LABELS, pipeline_predict
+
+    n = len(chunk)
+    labels = np.full(n, None, dtype=object)
+    probs = np.full(n, np.nan)
+
+    table = get_lookup_table(artifacts)
+    compiled = None if table is not None else get_compiled_pipeline(artifacts)
+
+    if table is not None:
+        codes = table.encode(chunk)
+        valid = codes >= 0
+        preds = table.labels[codes[valid]]
+        high = table.probs[codes[valid], 1]
+    elif compiled is not None:
+        codes = compiled.encode(chunk)
+        valid = (codes >= 0).all(axis=1)
+        preds, p = compiled.predict_with_proba_codes(codes[valid])
+        high = p[:, 1]
+    else:
+        valid = np.ones(n, dtype=bool)
+        preds, p = pipeline_predict(artifacts, chunk)
+        high = p[:, 1]
+
+    labels[valid] = np.where(preds == 1, LABELS[1], LABELS[0])
+    probs[valid] = high
+
+    out = chunk.copy()
+    out[PREDICTION_COLUMN] = labels
+    out[PROBABILITY_COLUMN] = probs
+    return out, int(n - valid.sum())
+
+
+def score_batch(artifacts, batch):
+    """score_chunk() for a pyarrow RecordBatch / Table from columnar.py:
+    codes come from the dictionary indices, not from the strings."""
+    from columnar import codes_matrix
+    from inference import get_compiled_pipeline
+    from lookup_table import get_lookup_table
+    from prediction import LABELS
+
+    table = get_lookup_table(artifacts)
+    compiled = None if table is not None else get_compiled_pipeline(artifacts)
+    if table is None and compiled is None:
+        return score_chunk(artifacts, batch.to_pandas())
+
+    levels = table.levels if table is not None else compiled.levels
+    codes = codes_matrix(batch, artifacts.selected_features, levels)
+    valid = (codes >= 0).all(axis=1)
+    if table is not None:
+        cells = codes[valid] @ table.strides
+        preds = table.labels[cells]
+        high = table.probs[cells, 1]
+    else:
+        preds, p = compiled.predict_with_proba_codes(codes[valid])
+        high = p[:, 1]
+
+    n = batch.num_rows
+    labels = np.full(n, None, dtype=object)
+    probs = np.full(n, np.nan)
+    labels[valid] = np.where(preds == 1, LABELS[1], LABELS[0])
+    probs[valid] = high
+
+    out = batch.to_pandas()
+    out[PREDICTION_COLUMN] = labels
+    out[PROBABILITY_COLUMN] = probs
+    return out, int(n - valid.sum())
+
+
+_worker_artifacts = None
+_worker_dataset = None
+
+
+def _score_frame(artifacts, chunk, fmt):
+    frame, unknown = score_chunk(artifacts, chunk)
+    return SINKS[fmt].prepare(frame), len(frame), unknown
+
+
+def _score_batch(artifacts, batch, fmt):
+    frame, unknown = score_batch(artifacts, batch)
+    return SINKS[fmt].prepare(frame), len(frame), unknown
+
+
+# Pool workers only (spawned processes): the initializer loads the
+# artifacts once per process into _worker_artifacts.
+def _init_worker(artifact_dir):
+    global _worker_artifacts
+    _worker_artifacts = ArtifactRegistry(base_dir=artifact_dir).current()
+
+
+def _score_frame_in_worker(chunk, fmt):
+    return _score_frame(_worker_artifacts, chunk, fmt)
+
+
+def _score_batch_in_worker(batch, fmt):
+    return _score_batch(_worker_artifacts, batch, fmt)
+
+
+def _score_columnar_in_worker(path, i, fmt):
+    # Each worker maps the file once and reads its batch from the page
+    # cache; only the batch number crosses the process boundary.
+    global _worker_dataset
+    from columnar import open_dataset
+
+    if _worker_dataset is None or _worker_dataset.name != path:
+        _worker_dataset = open_dataset(path)
+    return _score_batch_in_worker(_worker_dataset.batch(i), fmt)
+
+
+def _score_range_in_worker(path, start, end, columns, fmt):
+    # The worker parses its own byte range, so CSV parsing - usually the
+    # most expensive step - runs on every core, not just the parent.
+    with open(path, "rb") as fh:
+        fh.seek(start)
+        raw = fh.read(end - start)
+    chunk = pd.read_csv(io.BytesIO(raw), header=None, names=columns)
+    result = _score_frame_in_worker(chunk, fmt)
+    return result + (end,)
+
+
+# ===============================
+# Output sinks
+# ===============================
+# prepare() runs in the worker and turns a scored frame into something
+# cheap to ship back and append (CSV text / an Arrow table); the parent
+# only concatenates.
+class CsvSink:
+    def __init__(self, path):
+        self.path = path
+        self._fh = None
+
+    @staticmethod
+    def prepare(frame):
+        return list(frame.columns), frame.to_csv(index=False, header=False)
+
+    def write_prepared(self, prepared):
+        columns, text = prepared
+        if self._fh is None:
+            self._fh = open(self.path, "w", newline="")
+            self._fh.write(pd.DataFrame(columns=columns).to_csv(index=False))
+        self._fh.write(text)
+
+    def write(self, frame):
+        self.write_prepared(self.prepare(frame))
+
+    def close(self):
+        if self._fh is None:  # nothing was written; still leave a valid file
+            self._fh = open(self.path, "w")
+        self._fh.close()
+
+
+class ParquetSink:
+    def __init__(self, path):
+        self.path = path
+        self._writer = None
+        self._schema = None
+
+    @staticmethod
+    def prepare(frame):
+        import pyarrow as pa
+
+        return pa.Table.from_pandas(frame, preserve_index=False)
+
+    def write_prepared(self, table):
+        import pyarrow.parquet as pq
+
+        if self._writer is None:
+            self._schema = table.schema
+            self._writer = pq.ParquetWriter(self.path, self._schema)
+        elif table.schema != self._schema:
+            table = table.cast(self._schema)
+        self._writer.write_table(table)
+
+    def write(self, frame):
+        self.write_prepared(self.prepare(frame))
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+
+
+SINKS = {"csv": CsvSink, "parquet": ParquetSink}
+
+
+def output_format(path, fmt=None):
+    fmt = fmt or ("parquet" if str(path).endswith((".parquet", ".pq")) else "csv")
+    if fmt not in SINKS:
+        raise ValueError(f"Unknown output format: {fmt}")
+    return fmt
+
+
+# ===============================
+# Driver
+# ===============================
+def byte_ranges(path, chunk_bytes=DEFAULT_CHUNK_BYTES):
+    """Split a CSV into (start, end) byte ranges on line boundaries, after
+    the header.  Assumes no quoted field contains a newline, which holds
+    for the flat survey exports this is meant for."""
+    size = os.path.getsize(path)
+    with open(path, "rb") as fh:
+        fh.readline()
+        pos = fh.tell()
+        while pos < size:
+            fh.seek(min(pos + chunk_bytes, size))
+            fh.readline()
+            end = fh.tell()
+            yield pos, end
+            pos = end
+
+
+def _run(pool_or_none, tasks, sink, stats, progress, workers):
+    # Keep at most 2 * workers chunks in flight and write them back in
+    # input order; this is what keeps peak memory flat.
+    def _emit(result):
+        prepared, rows, unknown = result[:3]
+        sink.write_prepared(prepared)
+        stats["rows"] += rows
+        stats["unknown_rows"] += unknown
+        stats["chunks"] += 1
+        if progress is not None:
+            progress(stats["rows"], result[3] if len(result) > 3 else None)
+
+    if pool_or_none is None:
+        for fn, args in tasks:
+            _emit(fn(*args))
+        return
+
+    pending = deque()
+    for fn, args in tasks:
+        pending.append(pool_or_none.submit(fn, *args))
+        if len(pending) >= 2 * workers:
+            _emit(pending.popleft().result())
+    while pending:
+        _emit(pending.popleft().result())
+
+
+def _score_columnar(source, pool, artifacts, sink, stats, progress, workers, fmt):
+    from columnar import open_dataset
+
+    with open_dataset(source) as dataset:
+        total = dataset.num_batches or 1
+        if pool is None:
+            tasks = ((_score_batch, (artifacts, batch, fmt)) for batch in dataset.batches())
+        elif isinstance(source, (str, os.PathLike)):
+            tasks = ((_score_columnar_in_worker, (dataset.name, i, fmt))
+                     for i in range(dataset.num_batches))
+        else:
+            tasks = ((_score_batch_in_worker, (batch, fmt)) for batch in dataset.batches())
+        done = [0]
+
+        def _report(rows, _):
+            done[0] += 1
+            progress(rows, min(done[0] / total, 1.0))
+        _run(pool, tasks, sink, stats, _report if progress is not None else None, workers)
+
+
+def score_file(source, output, fmt=None, chunksize=DEFAULT_CHUNKSIZE,
+               chunk_bytes=DEFAULT_CHUNK_BYTES, workers=None,
+               artifact_dir=BASE_DIR, progress=None, artifacts=None):
+    """Score a CSV path or file-like object into a CSV/Parquet file.
+    Arrow IPC / Parquet inputs (by suffix, see columnar.py) are scored one
+    record batch at a time; `chunksize` and `chunk_bytes` do not apply.
+
+    workers=0 scores in this process (no pool start-up cost, useful for
+    small uploads) with `artifacts`, by default get_artifacts() (or the
+    current set in `artifact_dir` when that is not the app's); otherwise
+    a pool of `workers` processes is used (default: all cores), each
+    loading from `artifact_dir`.  progress(rows_done, fraction) is called after
+    each chunk is written; fraction is None when the input size is unknown.
+    """
+    fmt = output_format(output, fmt)
+    sink = SINKS[fmt](output)
+    stats = {"rows": 0, "unknown_rows": 0, "chunks": 0}
+    start = time.perf_counter()
+    is_path = isinstance(source, (str, os.PathLike))
+
+    if workers == 0:
+        if artifacts is None:
+            artifacts = (get_artifacts() if os.path.abspath(artifact_dir) == os.path.abspath(BASE_DIR)
+                         else ArtifactRegistry(base_dir=artifact_dir).current())
+        pool = None
+    else:
+        workers = workers or os.cpu_count() or 1
+        # spawn, not fork: the caller may be a threaded Streamlit server
+        pool = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(artifact_dir,),
+        )
+
+    try:
+        if is_columnar(source):
+            _score_columnar(source, pool, artifacts, sink, stats, progress, workers, fmt)
+        elif is_path and pool is not None:
+            size = os.path.getsize(source) or 1
+            columns = list(pd.read_csv(source, nrows=0).columns)
+            tasks = (
+                (_score_range_in_worker, (os.fspath(source), a, b, columns, fmt))
+                for a, b in byte_ranges(source, chunk_bytes)
+            )
+            report = None
+            if progress is not None:
+                report = lambda rows, end: progress(rows, min(end / size, 1.0))
+            _run(pool, tasks, sink, stats, report, workers)
+        else:
+            fh = open(source, "rb") if is_path else source
+            total = os.path.getsize(source) if is_path else getattr(source, "size", None)
+            try:
+                chunks = pd.read_csv(fh, chunksize=chunksize)
+                if pool is None:
+                    tasks = ((_score_frame, (artifacts, chunk, fmt)) for chunk in chunks)
+                else:
+                    tasks = ((_score_frame_in_worker, (chunk, fmt)) for chunk in chunks)
+                report = None
+                if progress is not None:
+                    report = lambda rows, _: progress(
+                        rows, min(fh.tell() / total, 1.0) if total else None
+                    )
+                _run(pool, tasks, sink, stats, report, workers)
+            finally:
+                if is_path:
+                    fh.close()
+    finally:
+        if pool is not None:
+            pool.shutdown()
+        sink.close()
+
+    stats["seconds"] = time.perf_counter() - start
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stream-score a survey CSV with the deployed model.")
+    parser.add_argument("input", help="CSV (or .arrow / .parquet, see columnar.py) with predictor columns")
+    parser.add_argument("output", help="output .csv or .parquet")
+    parser.add_argument("--format", choices=sorted(SINKS), default=None)
+    parser.add_argument("--chunksize", type=int, default=DEFAULT_CHUNKSIZE,
+                        help="rows per chunk when scoring in-process")
+    parser.add_argument("--chunk-mb", type=float, default=DEFAULT_CHUNK_BYTES / 2**20,
+                        help="input megabytes per worker task")
+    parser.add_argument("--workers", type=int, default=None, help="0 = score in-process")
+    parser.add_argument("--artifact-dir", default=BASE_DIR)
+    parser.add_argument("--quiet", action="store_true")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+
+    def _progress(rows, fraction):
+        rate = rows / max(time.perf_counter() - start, 1e-9)
+        pct = f"{fraction * 100:5.1f}%  " if fraction is not None else ""
+        sys.stderr.write(f"\r[batch] {pct}{rows:,} rows  {rate:,.0f} rows/s")
+        sys.stderr.flush()
+
+    stats = score_file(args.input, args.output, fmt=args.format,
+                       chunksize=args.chunksize,
+                       chunk_bytes=int(args.chunk_mb * 2**20),
+                       workers=args.workers, artifact_dir=args.artifact_dir,
+                       progress=None if args.quiet else _progress)
+    if not args.quiet:
+        sys.stderr.write("\n")
+    print(
+        f"scored {stats['rows']:,} rows in {stats['chunks']} chunks, "
+        f"{stats['seconds']:.1f} s ({stats['unknown_rows']:,} rows with unknown levels)"
+        f" -> {args.output}"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,265 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+# -----------------------------------------------------------------------
+# Benchmark suite
+#
+# Times the paths users and deployments actually hit, and appends every
+# run to a JSON-lines history so a change can be compared with earlier
+# commits:
+#
+#   artifact_load      load_artifact_set() in-process, and import + load
+#                      in a fresh interpreter (cold start)
+#   predict_one        single-row predict through app.py's path
+#                      (prediction.predict_one)
+#   batch_<n>          script2.py's path (batch_scoring.score_file) over
+#                      a synthetic CSV of n rows, in-process and pooled
+#   training           training.train() from scratch (no stage cache):
+#                      encode, feature selection, CV search, refit
+#   app_<page>         warm rerun of each app.py page under Streamlit's
+#                      headless AppTest
+#
+# Each result is a flat dict of metrics; names ending in _s / _ms / _us
+# are durations (lower is better), names ending in _per_s are rates
+# (higher is better).  compare() checks the run against the latest
+# history entry from the same machine and flags anything more than
+# --threshold worse.
+#
+#     python benchmarks.py                       # everything, 1k/100k/1M
+#     python benchmarks.py --quick               # skip 1M rows and training
+#     python benchmarks.py --only predict_one --only app
+# -----------------------------------------------------------------------
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_HISTORY = os.path.join(HERE, "benchmark_history.jsonl")
+BATCH_SIZES = {"1k": 1_000, "100k": 100_000, "1m": 1_000_000}
+DEFAULT_THRESHOLD = 0.20
+
+
+def timed(fn, repeat=5, number=1):
+    """Median and best seconds per call over `repeat` rounds of `number`."""
+    rounds = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        for _ in range(number):
+            fn()
+        rounds.append((time.perf_counter() - t0) / number)
+    return float(np.median(rounds)), float(min(rounds))
+
+
+def synthetic_frame(artifacts, rows, seed=0):
+    import pandas as pd
+
+    rng = np.random.default_rng(seed)
+    schema = artifacts.schema
+    return pd.DataFrame({
+        f: np.asarray(schema.levels[f], dtype=object)[rng.integers(0, len(schema.levels[f]), rows)]
+        for f in schema.features
+    })
+
+
+# ===============================
+# Benchmarks
+# ===============================
+def bench_artifact_load(ctx):
+    from artifacts import load_artifact_set
+
+    median, best = timed(lambda: load_artifact_set(ctx["artifact_dir"]), repeat=5)
+    code = ("import time; t = time.perf_counter(); "
+            "from artifacts import load_artifact_set; "
+            "from inference import get_compiled_pipeline; "
+            f"a = load_artifact_set({ctx['artifact_dir']!r}); get_compiled_pipeline(a); "
+            "print(time.perf_counter() - t)")
+    cold = []
+    for _ in range(3):
+        out = subprocess.run([sys.executable, "-W", "ignore", "-c", code], cwd=HERE,
+                             capture_output=True, text=True, check=True)
+        cold.append(float(out.stdout.split()[-1]))
+    return {"warm_ms": median * 1e3, "warm_best_ms": best * 1e3,
+            "cold_ms": float(np.median(cold)) * 1e3}
+
+
+def bench_predict_one(ctx):
+    from prediction import predict_one
+
+    artifacts = ctx["artifacts"]
+    rows = synthetic_frame(artifacts, 256, seed=1).to_dict("records")
+    predict_one(artifacts, rows[0])  # builds the lookup table / kernel
+    it = iter(range(10**9))
+    median, best = timed(lambda: predict_one(artifacts, rows[next(it) % len(rows)]),
+                         repeat=7, number=500)
+    return {"median_us": median * 1e6, "best_us": best * 1e6}
+
+
+def _bench_batch(ctx, size):
+    from batch_scoring import score_file
+
+    path = os.path.join(ctx["tmp"], f"batch_{size}.csv")
+    if not os.path.exists(path):
+        synthetic_frame(ctx["artifacts"], size, seed=2).to_csv(path, index=False)
+    out = os.path.join(ctx["tmp"], "scored.csv")
+    result = {}
+    for label, workers in (("inprocess", 0), ("pool", None)):
+        stats = score_file(path, out, workers=workers, artifact_dir=ctx["artifact_dir"],
+                           artifacts=ctx["artifacts"])
+        result[f"{label}_s"] = stats["seconds"]
+        result[f"{label}_rows_per_s"] = stats["rows"] / max(stats["seconds"], 1e-9)
+    return result
+
+
+def bench_training(ctx):
+    from training import train
+
+    out_dir = os.path.join(ctx["tmp"], "training")
+    report = train(output_dir=out_dir, use_cache=False)
+    result = {f"{stage}_s": secs for stage, secs in report["seconds"].items()}
+    result["cv_accuracy"] = report["search"]["best_cv_accuracy"]
+    return result
+
+
+def bench_app(ctx):
+    from streamlit.testing.v1 import AppTest
+
+    from page_budget import PAGES
+
+    at = AppTest.from_file(os.path.join(HERE, "app.py"), default_timeout=120)
+    at.run()
+    result = {}
+    for page in PAGES:
+        at.sidebar.radio[0].set_value(page).run()
+        if at.exception:
+            raise RuntimeError(f"{page}: {at.exception[0].value}")
+        median, _ = timed(at.run, repeat=5)
+        result[f"{page.lower().replace(' ', '_')}_rerun_ms"] = median * 1e3
+    return result
+
+
+def benchmarks(quick=False):
+    suite = {
+        "artifact_load": bench_artifact_load,
+        "predict_one": bench_predict_one,
+    }
+    for name, size in BATCH_SIZES.items():
+        if quick and size > 100_000:
+            continue
+        suite[f"batch_{name}"] = lambda ctx, size=size: _bench_batch(ctx, size)
+    if not quick:
+        suite["training"] = bench_training
+    suite["app"] = bench_app
+    return suite
+
+
+# ===============================
+# History
+# ===============================
+def git_commit():
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=HERE,
+                             capture_output=True, text=True, check=True)
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"],
+                               cwd=HERE, capture_output=True, text=True).stdout.strip()
+        return out.stdout.strip() + ("-dirty" if dirty else "")
+    except Exception:
+        return None
+
+
+def machine():
+    return {"python": platform.python_version(), "platform": platform.platform(),
+            "cpus": os.cpu_count(), "node": platform.node()}
+
+
+def load_history(path):
+    if not os.path.exists(path):
+        return []
+    with open(path) as fh:
+        return [json.loads(line) for line in fh if line.strip()]
+
+
+def compare(run, history, threshold=DEFAULT_THRESHOLD):
+    """[(bench, metric, previous, current, relative change)] for metrics
+    that got worse by more than `threshold` since the latest run on the
+    same machine."""
+    previous = next((h for h in reversed(history) if h["machine"] == run["machine"]), None)
+    if previous is None:
+        return [], None
+    regressions = []
+    for bench, metrics in run["results"].items():
+        before = previous["results"].get(bench, {})
+        for metric, value in metrics.items():
+            old = before.get(metric)
+            if not isinstance(old, (int, float)) or not old:
+                continue
+            if metric.endswith(("_s", "_ms", "_us")):
+                change = value / old - 1.0
+            elif metric.endswith("_per_s"):
+                change = old / max(value, 1e-12) - 1.0
+            else:
+                continue
+            if change > threshold:
+                regressions.append((bench, metric, old, value, change))
+    return regressions, previous
+
+
+def main():
+    from artifacts import ArtifactRegistry, BASE_DIR
+
+    parser = argparse.ArgumentParser(description="Run the benchmark suite and record it in the history.")
+    parser.add_argument("--only", action="append", default=None,
+                        help="run benchmarks whose name starts with this (repeatable)")
+    parser.add_argument("--quick", action="store_true", help="skip the 1M-row batch and training")
+    parser.add_argument("--artifact-dir", default=BASE_DIR)
+    parser.add_argument("--history", default=DEFAULT_HISTORY)
+    parser.add_argument("--no-record", action="store_true", help="do not append to the history")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="relative slowdown reported as a regression")
+    args = parser.parse_args()
+
+    suite = benchmarks(quick=args.quick)
+    if args.only:
+        suite = {k: v for k, v in suite.items() if any(k.startswith(o) for o in args.only)}
+
+    run = {"created": time.strftime("%Y-%m-%dT%H:%M:%S%z"), "commit": git_commit(),
+           "machine": machine(), "results": {}, "errors": {}}
+    with tempfile.TemporaryDirectory() as tmp:
+        ctx = {"artifact_dir": args.artifact_dir, "tmp": tmp,
+               "artifacts": ArtifactRegistry(base_dir=args.artifact_dir).current()}
+        run["model_version"] = ctx["artifacts"].version
+        for name, fn in suite.items():
+            sys.stderr.write(f"[bench] {name}…\n")
+            try:
+                run["results"][name] = fn(ctx)
+            except Exception as e:
+                run["errors"][name] = f"{type(e).__name__}: {e}"
+
+    for name, metrics in run["results"].items():
+        shown = "  ".join(f"{k}={v:,.3f}" if isinstance(v, float) else f"{k}={v}"
+                          for k, v in metrics.items())
+        print(f"{name:18s} {shown}")
+    for name, err in run["errors"].items():
+        print(f"{name:18s} FAILED: {err}")
+
+    history = load_history(args.history)
+    regressions, previous = compare(run, history, args.threshold)
+    if previous is not None:
+        print(f"\ncompared with {previous['commit']} ({previous['created']}):")
+        for bench, metric, old, new, change in regressions:
+            print(f"  REGRESSION {bench}.{metric}: {old:,.3f} -> {new:,.3f} ({change:+.0%})")
+        if not regressions:
+            print(f"  no metric worse by more than {args.threshold:.0%}")
+
+    if not args.no_record:
+        with open(args.history, "a") as fh:
+            fh.write(json.dumps(run) + "\n")
+    sys.exit(1 if regressions or run["errors"] else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from batch_scoring import PREDICTION_COLUMN, PROBABILITY_COLUMN, score_chunk
+
+# -----------------------------------------------------------------------
+# Bulk scoring of surveyed coordinates
+#
+# Survey teams return thousands of borehole candidates, each with a GPS
+# position and the predictor attributes.  Instead of one GPS fix and one
+# prediction per click:
+#
+# * all rows are scored in one vectorized call (batch_scoring.score_chunk);
+# * reverse geocoding is de-duplicated by geohash cell - the same cell the
+#   geocoder cache is keyed on - so nearby points cost one lookup;
+# * the distinct cells are resolved concurrently with a bounded pool (the
+#   geocoder's rate limiter still applies to the network backend);
+# * the result is drawn as a single clustered Folium layer.
+# -----------------------------------------------------------------------
+
+ADDRESS_COLUMN = "Address"
+DEFAULT_GEOCODE_WORKERS = 8
+
+_LAT_NAMES = ("latitude", "lat", "y")
+_LON_NAMES = ("longitude", "lon", "lng", "long", "x")
+
+
+def coordinate_columns(frame):
+    lower = {c.lower(): c for c in frame.columns}
+    lat = next((lower[n] for n in _LAT_NAMES if n in lower), None)
+    lon = next((lower[n] for n in _LON_NAMES if n in lower), None)
+    if lat is None or lon is None:
+        raise ValueError("Need latitude and longitude columns (e.g. 'Latitude', 'Longitude').")
+    return lat, lon
+
+
+def geocode_points(lats, lons, geocoder=None, max_workers=DEFAULT_GEOCODE_WORKERS,
+                   progress=None):
+    """Address text per point; one lookup per distinct geohash cell."""
+    from geocoding import format_address, get_geocoder
+
+    geocoder = geocoder or get_geocoder()
+    keys = [geocoder.key(lat, lon) for lat, lon in zip(lats, lons)]
+    first = {}
+    for i, key in enumerate(keys):
+        first.setdefault(key, i)
+
+    def _lookup(i):
+        try:
+            return format_address(geocoder.reverse(lats[i], lons[i]))
+        except Exception as e:
+            return f"Address unavailable ({e.__class__.__name__})"
+
+    resolved = {}
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="bulk-geocode") as pool:
+        futures = {key: pool.submit(_lookup, i) for key, i in first.items()}
+        for done, (key, future) in enumerate(futures.items(), 1):
+            resolved[key] = future.result()
+            if progress is not None:
+                progress(done, len(futures))
+
+    return [resolved[key] for key in keys]
+
+
+def score_points(artifacts, frame, geocode=True, geocoder=None,
+                 max_workers=DEFAULT_GEOCODE_WORKERS, progress=None):
+    lat_col, lon_col = coordinate_columns(frame)
+    frame = frame.dropna(subset=[lat_col, lon_col]).reset_index(drop=True)
+
+    scored, unknown = score_chunk(artifacts, frame)
+    if geocode:
+        scored[ADDRESS_COLUMN] = geocode_points(
+            scored[lat_col].to_numpy(dtype=float),
+            scored[lon_col].to_numpy(dtype=float),
+            geocoder=geocoder,
+            max_workers=max_workers,
+            progress=progress,
+        )
+    return scored, unknown
+
+
+def points_map(scored, zoom_start=7):
+    """One Folium map with every point in a single client-side cluster
+    layer (FastMarkerCluster builds markers in the browser from a plain
+    array, so thousands of points stay one small payload)."""
+    import folium
+    from folium.plugins import FastMarkerCluster
+
+    from tile_cache import tile_layer
+
+    lat_col, lon_col = coordinate_columns(scored)
+    lats = scored[lat_col].to_numpy(dtype=float)
+    lons = scored[lon_col].to_numpy(dtype=float)
+    center = (float(np.mean(lats)), float(np.mean(lons))) if len(lats) else (-19.0, 29.0)
+
+    tiles, attr = tile_layer()
+    m = folium.Map(location=center, zoom_start=zoom_start, tiles=tiles, attr=attr)
+
+    probs = scored[PROBABILITY_COLUMN].to_numpy(dtype=float)
+    labels = scored[PREDICTION_COLUMN].fillna("Unknown").astype(str).to_numpy()
+    addresses = (scored[ADDRESS_COLUMN].astype(str).to_numpy()
+                 if ADDRESS_COLUMN in scored.columns else np.full(len(scored), ""))
+    data = [
+        [float(la), float(lo), lab, None if np.isnan(p) else round(float(p) * 100, 1), addr]
+        for la, lo, lab, p, addr in zip(lats, lons, labels, probs, addresses)
+    ]
+
+    callback = """
+    function (row) {
+        var colour = row[2] === "High Potential" ? "#00ffea"
+                   : row[2] === "Low Potential" ? "#ff4b4b" : "#999999";
+        var marker = L.circleMarker(new L.LatLng(row[0], row[1]), {
+            radius: 8, color: colour, fillColor: colour, fillOpacity: 0.9
+        });
+        var conf = row[3] === null ? "" : "<br>High potential: " + row[3] + "%";
+        marker.bindPopup("<b>" + row[2] + "</b>" + conf + "<br>" + row[4]);
+        return marker;
+    }
+    """
+    FastMarkerCluster(data, callback=callback, name="Scored points").add_to(m)
+    return m
+
+
+def main():
+    from artifacts import ArtifactRegistry, BASE_DIR
+
+    parser = argparse.ArgumentParser(description="Score and reverse-geocode a file of surveyed points.")
+    parser.add_argument("input", help="CSV with latitude, longitude and predictor columns")
+    parser.add_argument("output", help="scored CSV")
+    parser.add_argument("--map", help="also write a clustered Folium map to this .html file")
+    parser.add_argument("--no-geocode", action="store_true")
+    parser.add_argument("--workers", type=int, default=DEFAULT_GEOCODE_WORKERS)
+    parser.add_argument("--artifact-dir", default=BASE_DIR)
+    args = parser.parse_args()
+
+    artifacts = ArtifactRegistry(base_dir=args.artifact_dir).current()
+    scored, unknown = score_points(artifacts, pd.read_csv(args.input),
+                                   geocode=not args.no_geocode, max_workers=args.workers)
+    scored.to_csv(args.output, index=False)
+    if args.map:
+        points_map(scored).save(args.map)
+    print(f"scored {len(scored):,} points ({unknown:,} with unknown levels) -> {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,481 @@
+import argparse
+import hashlib
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+# -----------------------------------------------------------------------
+# Columnar datasets with dictionary-encoded predictors
+#
+# Training and batch scoring both start from pd.read_csv on string
+# columns and then turn the strings into level codes (OrdinalEncoder /
+# CompiledPipeline.encode), so every load parses and hashes every string
+# again.  convert() writes a survey once as an Arrow IPC file (or
+# Parquet) in which each predictor is a dictionary column:
+#
+#     indices     int8 / int16 per row, null for a missing value
+#     dictionary  the level strings
+#
+# and the dictionary is laid out like the model's levels for that
+# feature (bundle levels = the encoder's categories): the model's levels
+# first, in the model's order, then any level the model does not know.
+# An index below len(levels) is then the encoder's code for that row, so
+# encoding a column is reading its index buffer - zero-copy out of a
+# memory-mapped Arrow file - and levels the model was not trained on are
+# recognised with one comparison.  A dictionary laid out any other way
+# (a file written against an older model, Parquet written elsewhere) is
+# remapped with a lookup table of one entry per dictionary value, never
+# per row.  See dictionary_codes().
+#
+# Arrow IPC files are opened with pa.memory_map: record batches are
+# views of the page cache, so a dataset far larger than RAM can be
+# scored batch by batch and the pool workers each map the same file
+# instead of being sent its rows.  Parquet is supported for interchange
+# (it has to be decompressed and decoded, so it is not zero-copy).
+#
+#     python columnar.py convert survey.csv survey.arrow
+#     python columnar.py convert augmented_data.csv train.arrow --levels data
+#     python columnar.py info survey.arrow
+#     python columnar.py bench --rows 2000000
+#
+# batch_scoring.score_file() and training.load_training_data() accept
+# these files wherever they accept a CSV.
+# -----------------------------------------------------------------------
+
+FORMAT = "gwp-columnar"
+FORMAT_VERSION = 1
+METADATA_KEY = b"gwp"
+
+ARROW_SUFFIXES = (".arrow", ".feather", ".ipc")
+PARQUET_SUFFIXES = (".parquet", ".pq")
+
+DEFAULT_CHUNKSIZE = 1_000_000
+
+
+def _name(source):
+    return str(source if isinstance(source, (str, os.PathLike)) else getattr(source, "name", ""))
+
+
+def is_columnar(source):
+    """True if `source` (a path or an upload with a .name) is an Arrow IPC
+    or Parquet file by its suffix."""
+    return _name(source).lower().endswith(ARROW_SUFFIXES + PARQUET_SUFFIXES)
+
+
+# ===============================
+# Levels
+# ===============================
+def model_levels(artifacts):
+    """{feature: levels} the deployed model encodes every predictor with."""
+    if artifacts.bundle is not None:
+        return {f: [str(v) for v in lv] for f, lv in artifacts.bundle.levels.items()}
+    if artifacts.encoder is not None:
+        return {
+            f: [str(v) for v in cats]
+            for f, cats in zip(artifacts.encoder.feature_names_in_, artifacts.encoder.categories_)
+        }
+    return {f: [str(v) for v in lv] for f, lv in artifacts.schema.levels.items()}
+
+
+def scan_levels(source, columns, chunksize=DEFAULT_CHUNKSIZE):
+    """Sorted distinct non-missing values of `columns` in a CSV (one pass;
+    what OrdinalEncoder would fit)."""
+    seen = {c: set() for c in columns}
+    for chunk in pd.read_csv(source, usecols=list(columns), dtype=str, chunksize=chunksize):
+        for c in columns:
+            seen[c].update(chunk[c].dropna().unique())
+    return {c: sorted(v) for c, v in seen.items()}
+
+
+def _index_type(n):
+    import pyarrow as pa
+
+    return pa.int8() if n <= 127 else pa.int16() if n <= 32767 else pa.int32()
+
+
+def dictionary_column(values, levels):
+    """pa.DictionaryArray of `values` with dictionary `levels`; values not
+    in `levels` (and missing values) become nulls."""
+    return codes_column(pd.Categorical(values, categories=levels).codes, levels)
+
+
+def codes_column(codes, levels):
+    """pa.DictionaryArray with indices `codes` (negative = null) into
+    dictionary `levels`."""
+    import pyarrow as pa
+
+    codes = np.asarray(codes)
+    index_type = _index_type(len(levels))
+    indices = pa.array(codes.astype(index_type.to_pandas_dtype(), copy=False),
+                       type=index_type, mask=codes < 0)
+    return pa.DictionaryArray.from_arrays(indices, pa.array([str(v) for v in levels], type=pa.string()))
+
+
+# ===============================
+# Writing
+# ===============================
+class DatasetWriter:
+    """Record batches -> `path`: an Arrow IPC or Parquet file (with the
+    gwp metadata), or CSV for a .csv path.  Written to a temporary file
+    that close() moves into place; leaving the block on an error discards
+    it."""
+
+    def __init__(self, path, metadata=None):
+        self.path = os.fspath(path)
+        self.metadata = dict(metadata or {})
+        self.rows = 0
+        self.batches = 0
+        lower = self.path.lower()
+        self.kind = ("parquet" if lower.endswith(PARQUET_SUFFIXES)
+                     else "csv" if lower.endswith(".csv") else "arrow")
+        self._tmp = f"{self.path}.{os.getpid()}.tmp"
+        self._writer = None
+        self._schema = None
+        self._meta = None
+
+    def _open(self, schema):
+        import pyarrow as pa
+        import pyarrow.csv as csv
+        import pyarrow.ipc as ipc
+        import pyarrow.parquet as pq
+
+        self._schema = schema
+        meta = {"format": FORMAT, "format_version": FORMAT_VERSION,
+                "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+                "dictionary_columns": [f.name for f in schema if pa.types.is_dictionary(f.type)]}
+        meta.update(self.metadata)
+        self._meta = {METADATA_KEY: json.dumps(meta)}
+        if self.kind == "csv":
+            self._writer = csv.CSVWriter(self._tmp, schema)
+        elif self.kind == "parquet":
+            self._writer = pq.ParquetWriter(self._tmp, schema.with_metadata(self._meta))
+        else:
+            self._writer = ipc.new_file(self._tmp, schema.with_metadata(self._meta))
+
+    def write(self, batch):
+        import pyarrow as pa
+
+        if self._writer is None:
+            self._open(batch.schema)
+        elif batch.schema != self._schema:
+            # e.g. a column that was all-missing in an earlier chunk
+            batch = batch.cast(self._schema)
+        if self.kind == "parquet":
+            self._writer.write_table(pa.Table.from_batches([batch.replace_schema_metadata(self._meta)]))
+        elif self.kind == "csv":
+            self._writer.write_batch(batch)
+        else:
+            self._writer.write_batch(batch.replace_schema_metadata(self._meta))
+        self.rows += batch.num_rows
+        self.batches += 1
+
+    def close(self):
+        if self._writer is None:
+            raise ValueError(f"nothing was written to {self.path}")
+        self._writer.close()
+        self._writer = None
+        os.replace(self._tmp, self.path)
+
+    def abort(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        if os.path.exists(self._tmp):
+            os.remove(self._tmp)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.close()
+        self.abort()
+        return False
+
+
+def convert(source, path, levels, chunksize=DEFAULT_CHUNKSIZE, metadata=None):
+    """Write CSV `source` to `path` (.arrow/.feather/.ipc or .parquet),
+    dictionary-encoding the columns in `levels` ({column: dictionary});
+    the other columns are kept as read.  Returns {"rows", "batches",
+    "unknown": {column: values not in the dictionary}}."""
+    import pyarrow as pa
+
+    unknown = {c: 0 for c in levels}
+    dtypes = {c: str for c in levels}
+    with DatasetWriter(path, metadata) as writer:
+        for chunk in pd.read_csv(source, dtype=dtypes, chunksize=chunksize):
+            arrays, fields = [], []
+            for c in chunk.columns:
+                if c in levels:
+                    arr = dictionary_column(chunk[c], levels[c])
+                    unknown[c] += int(arr.null_count - chunk[c].isna().sum())
+                else:
+                    arr = pa.array(chunk[c], from_pandas=True)
+                arrays.append(arr)
+                fields.append(pa.field(c, arr.type))
+            writer.write(pa.RecordBatch.from_arrays(arrays, schema=pa.schema(fields)))
+        if not writer.rows:
+            raise ValueError(f"{_name(source)} has no rows")
+    return {"rows": writer.rows, "batches": writer.batches, "unknown": unknown}
+
+
+def convert_for_model(source, path, artifacts, chunksize=DEFAULT_CHUNKSIZE):
+    """convert() with dictionaries aligned to the deployed model: its levels
+    first, then (sorted) levels in the data it does not know."""
+    aligned = model_levels(artifacts)
+    header = list(pd.read_csv(source, nrows=0).columns)
+    columns = [c for c in header if c in aligned]
+    extra = scan_levels(source, columns, chunksize)
+    levels = {}
+    for c in columns:
+        known = set(aligned[c])
+        levels[c] = list(aligned[c]) + [v for v in extra[c] if v not in known]
+    return convert(source, path, levels, chunksize,
+                   metadata={"model_version": artifacts.version, "aligned_with": "model"})
+
+
+# ===============================
+# Reading
+# ===============================
+class ColumnarDataset:
+    """Record-batch access to an Arrow IPC (memory-mapped) or Parquet file,
+    or to the bytes of an uploaded one."""
+
+    def __init__(self, source):
+        import pyarrow as pa
+        import pyarrow.ipc as ipc
+        import pyarrow.parquet as pq
+
+        self.name = _name(source)
+        self.parquet = self.name.lower().endswith(PARQUET_SUFFIXES)
+        if isinstance(source, (str, os.PathLike)):
+            self._source = pa.memory_map(os.fspath(source)) if not self.parquet else None
+        else:
+            data = source.getvalue() if hasattr(source, "getvalue") else source.read()
+            self._source = pa.BufferReader(pa.py_buffer(data))
+        if self.parquet:
+            self._file = pq.ParquetFile(self._source or os.fspath(source), memory_map=True)
+            self.schema = self._file.schema_arrow
+            self.num_batches = self._file.num_row_groups
+            self.num_rows = self._file.metadata.num_rows
+        else:
+            self._file = ipc.open_file(self._source)
+            self.schema = self._file.schema
+            self.num_batches = self._file.num_record_batches
+            self.num_rows = sum(self._file.get_batch(i).num_rows for i in range(self.num_batches))
+
+    @property
+    def columns(self):
+        return list(self.schema.names)
+
+    @property
+    def metadata(self):
+        raw = (self.schema.metadata or {}).get(METADATA_KEY)
+        return json.loads(raw) if raw else {}
+
+    def batch(self, i, columns=None):
+        """Record batch `i` (a pa.Table for Parquet: one row group)."""
+        if self.parquet:
+            return self._file.read_row_group(i, columns=columns)
+        batch = self._file.get_batch(i)
+        return batch.select(columns) if columns is not None else batch
+
+    def batches(self, columns=None):
+        for i in range(self.num_batches):
+            yield self.batch(i, columns)
+
+    def read(self, columns=None):
+        """The whole dataset as a pa.Table (views of the mapped file for
+        Arrow IPC)."""
+        if self.parquet:
+            return self._file.read(columns=columns)
+        table = self._file.read_all()
+        return table.select(columns) if columns is not None else table
+
+    def close(self):
+        if self._source is not None:
+            self._source.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+
+def open_dataset(source):
+    return ColumnarDataset(source)
+
+
+def file_sha256(path, block=16 * 2**20):
+    digest = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for buf in iter(lambda: fh.read(block), b""):
+            digest.update(buf)
+    return digest.hexdigest()
+
+
+# ===============================
+# Codes
+# ===============================
+def _chunk_codes(arr, index, levels):
+    import pyarrow as pa
+    import pyarrow.compute as pc
+
+    if not pa.types.is_dictionary(arr.type):
+        # A plain string column: encode it like CompiledPipeline.encode
+        inverse, uniques = pd.factorize(arr.to_numpy(zero_copy_only=False))
+        lut = np.fromiter((index.get(v, -1) for v in uniques), np.int64, count=len(uniques))
+        return np.append(lut, -1)[inverse]
+
+    dictionary = arr.dictionary.to_pylist()
+    indices = arr.indices
+    if indices.null_count:
+        indices = pc.fill_null(indices, -1)
+    idx = indices.to_numpy(zero_copy_only=False)
+    n = len(levels)
+    if dictionary[:n] == levels:
+        # Laid out like the model (convert_for_model): the indices are the
+        # codes; anything past the model's levels is unknown.
+        if len(dictionary) == n:
+            return idx
+        return np.where(idx < n, idx, -1)
+    lut = np.fromiter((index.get(v, -1) for v in dictionary), np.int64, count=len(dictionary))
+    return np.append(lut, -1)[idx]
+
+
+def dictionary_codes(column, levels):
+    """Codes of `column` (a dictionary/string Array or ChunkedArray) in
+    `levels`; -1 marks missing values and values not in `levels`."""
+    import pyarrow as pa
+
+    levels = [str(v) for v in levels]
+    index = {v: i for i, v in enumerate(levels)}
+    chunks = column.chunks if isinstance(column, pa.ChunkedArray) else [column]
+    if not chunks:
+        return np.empty(0, dtype=np.int64)
+    parts = [_chunk_codes(c, index, levels) for c in chunks]
+    return parts[0] if len(parts) == 1 else np.concatenate(parts)
+
+
+def codes_matrix(batch, features, levels):
+    """Level codes of `features` in `batch`, shape (rows, features); -1
+    marks unknown or missing values (and every row when a column is
+    absent)."""
+    codes = np.empty((batch.num_rows, len(features)), dtype=np.int64)
+    names = set(batch.schema.names)
+    for i, (f, lv) in enumerate(zip(features, levels)):
+        if f in names:
+            codes[:, i] = dictionary_codes(batch.column(f), lv)
+        else:
+            codes[:, i] = -1
+    return codes
+
+
+# ===============================
+# CLI
+# ===============================
+def _bench(args):
+    import tempfile
+
+    from artifacts import ArtifactRegistry
+    from benchmarks import synthetic_frame
+    from inference import get_compiled_pipeline
+
+    artifacts = ArtifactRegistry(base_dir=args.artifact_dir).current()
+    compiled = get_compiled_pipeline(artifacts)
+    features = artifacts.selected_features
+    levels = [list(map(str, lv)) for lv in compiled.levels]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        csv_path = os.path.join(tmp, "bench.csv")
+        arrow_path = os.path.join(tmp, "bench.arrow")
+        synthetic_frame(artifacts, args.rows, seed=0).to_csv(csv_path, index=False)
+
+        t0 = time.perf_counter()
+        stats = convert_for_model(csv_path, arrow_path, artifacts)
+        t_convert = time.perf_counter() - t0
+        print(f"convert  {stats['rows']:,} rows in {t_convert:.2f}s "
+              f"({os.path.getsize(csv_path) / 2**20:.0f} MB csv -> "
+              f"{os.path.getsize(arrow_path) / 2**20:.0f} MB arrow)")
+
+        t0 = time.perf_counter()
+        frame = pd.read_csv(csv_path)
+        t_parse = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        csv_codes = compiled.encode(frame)
+        t_encode = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        with open_dataset(arrow_path) as ds:
+            arrow_codes = np.concatenate([codes_matrix(b, features, levels) for b in ds.batches()])
+        t_arrow = time.perf_counter() - t0
+
+        same = np.array_equal(csv_codes, arrow_codes)
+        print(f"csv      read_csv {t_parse:.3f}s + encode {t_encode:.3f}s = {t_parse + t_encode:.3f}s")
+        print(f"arrow    map + codes {t_arrow:.3f}s  ({(t_parse + t_encode) / t_arrow:.0f}x)  "
+              f"codes identical: {same}")
+
+
+def main():
+    from artifacts import ArtifactRegistry, BASE_DIR
+
+    parser = argparse.ArgumentParser(description="Dictionary-encoded Arrow/Parquet survey datasets.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("convert", help="convert a CSV")
+    p.add_argument("input")
+    p.add_argument("output", help=".arrow/.feather/.ipc (memory-mappable) or .parquet")
+    p.add_argument("--levels", choices=["model", "data"], default="model",
+                   help="model: dictionaries aligned with the deployed model; "
+                        "data: sorted levels of the file (for training)")
+    p.add_argument("--chunksize", type=int, default=DEFAULT_CHUNKSIZE)
+    p.add_argument("--artifact-dir", default=BASE_DIR)
+
+    p = sub.add_parser("info", help="describe a columnar dataset")
+    p.add_argument("path")
+
+    p = sub.add_parser("bench", help="CSV parse + encode vs memory-mapped codes")
+    p.add_argument("--rows", type=int, default=1_000_000)
+    p.add_argument("--artifact-dir", default=BASE_DIR)
+    args = parser.parse_args()
+
+    if args.command == "bench":
+        _bench(args)
+        return
+
+    if args.command == "info":
+        with open_dataset(args.path) as ds:
+            print(f"{ds.name}: {ds.num_rows:,} rows in {ds.num_batches} batches")
+            print(json.dumps(ds.metadata, indent=1))
+            for field in ds.schema:
+                extra = ""
+                if hasattr(field.type, "value_type") and ds.num_batches:
+                    col = ds.batch(0, [field.name]).column(0)
+                    col = col.chunk(0) if ds.parquet else col
+                    extra = f"  {col.dictionary.to_pylist()}"
+                print(f"  {field.name:36s} {field.type}{extra}")
+        return
+
+    t0 = time.perf_counter()
+    if args.levels == "model":
+        artifacts = ArtifactRegistry(base_dir=args.artifact_dir).current()
+        stats = convert_for_model(args.input, args.output, artifacts, args.chunksize)
+    else:
+        header = list(pd.read_csv(args.input, nrows=0).columns)
+        stats = convert(args.input, args.output,
+                        scan_levels(args.input, header, args.chunksize), args.chunksize,
+                        metadata={"aligned_with": "data"})
+    unknown = {c: n for c, n in stats["unknown"].items() if n}
+    print(f"{stats['rows']:,} rows in {stats['batches']} batches, "
+          f"{time.perf_counter() - t0:.1f}s -> {args.output}")
+    if unknown:
+        print(f"values missing from the dictionaries (stored as nulls): {unknown}")
+
+
+if __name__ == "__main__":
+    main()
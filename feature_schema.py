@@ -0,0 +1,131 @@
+import argparse
+import hashlib
+import json
+import os
+import time
+
+# -----------------------------------------------------------------------
+# Feature schema manifest
+#
+# The Predict and Feature Guide pages only ever needed four things from
+# augmented_data.csv: the ordered predictor names, the levels of each
+# predictor (for the selectboxes), a default per predictor (the mode) and
+# how common each level is.  The app used to read the whole CSV at
+# startup and re-run sorted(unique()) for every selectbox on every rerun.
+#
+# The trainer now writes those facts to feature_schema.json next to the
+# model bundle:
+#
+#   {
+#     "format": "gwp-feature-schema", "format_version": 1,
+#     "features": [...],              ordered as the encoder saw them
+#     "selected_features": [...],     when known (written by training.py)
+#     "levels": {feature: [...]},     sorted, as the selectboxes list them
+#     "defaults": {feature: value},   mode, ties broken like Series.mode
+#     "frequencies": {feature: {level: count}},
+#     "rows": n, "data_sha256": "..."
+#   }
+#
+# The artifact registry loads the schema instead of the CSV when it is
+# present, so startup and reruns do not depend on the dataset size and
+# the dataset does not have to be deployed.  Without a schema file the
+# registry still reads the CSV and derives the same schema from it.
+#
+#     python feature_schema.py                 # write it from the CSV
+# -----------------------------------------------------------------------
+
+FORMAT_VERSION = 1
+
+
+class FeatureSchema:
+    def __init__(self, manifest):
+        self.manifest = manifest
+        self.features = list(manifest["features"])
+        self.selected_features = manifest.get("selected_features")
+        self.levels = {f: list(v) for f, v in manifest["levels"].items()}
+        self.defaults = dict(manifest["defaults"])
+        self.frequencies = {f: dict(v) for f, v in manifest["frequencies"].items()}
+        self.rows = manifest.get("rows")
+
+    def options(self, feature):
+        """Levels to offer for `feature`, or None if it is not in the schema."""
+        return self.levels.get(feature)
+
+
+def _plain(value):
+    # NumPy scalars -> JSON-serialisable Python values
+    return value.item() if hasattr(value, "item") else value
+
+
+def build_schema(data, features, selected_features=None, data_sha256=None):
+    """Schema of the predictor columns `features` of DataFrame `data`."""
+    levels, defaults, frequencies = {}, {}, {}
+    for col in features:
+        counts = data[col].value_counts(dropna=True)
+        levels[col] = sorted(_plain(v) for v in counts.index)
+        frequencies[col] = {str(_plain(k)): int(v) for k, v in counts.items()}
+        mode = data[col].mode(dropna=True)
+        defaults[col] = _plain(mode.iloc[0]) if len(mode) else ""
+
+    manifest = {
+        "format": "gwp-feature-schema",
+        "format_version": FORMAT_VERSION,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "features": list(features),
+        "levels": levels,
+        "defaults": defaults,
+        "frequencies": frequencies,
+        "rows": int(len(data)),
+    }
+    if selected_features is not None:
+        manifest["selected_features"] = list(selected_features)
+    if data_sha256 is not None:
+        manifest["data_sha256"] = data_sha256
+    return FeatureSchema(manifest)
+
+
+def write_schema(path, schema):
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w") as fh:
+        json.dump(schema.manifest, fh, indent=1)
+    os.replace(tmp, path)
+
+
+def load_schema(path):
+    with open(path) as fh:
+        manifest = json.load(fh)
+    if manifest.get("format") != "gwp-feature-schema":
+        raise ValueError(f"{path} is not a feature schema")
+    if manifest.get("format_version", 0) > FORMAT_VERSION:
+        raise ValueError(
+            f"{path} has schema format {manifest['format_version']}; "
+            f"this code reads up to {FORMAT_VERSION}"
+        )
+    return FeatureSchema(manifest)
+
+
+def main():
+    from artifacts import BASE_DIR, DATA_FILE, SCHEMA_FILE, load_dataset
+
+    parser = argparse.ArgumentParser(description="Write the feature schema manifest from the training CSV.")
+    parser.add_argument("--data", default=os.path.join(BASE_DIR, DATA_FILE))
+    parser.add_argument("--output", default=os.path.join(BASE_DIR, SCHEMA_FILE))
+    args = parser.parse_args()
+
+    with open(args.data, "rb") as fh:
+        data_sha256 = hashlib.sha256(fh.read()).hexdigest()
+    data, full_features, _ = load_dataset(args.data)
+
+    # Record the deployed model's selection alongside, when there is one
+    from artifacts import ArtifactRegistry
+
+    artifact_dir = os.path.dirname(os.path.abspath(args.output))
+    selected = ArtifactRegistry(base_dir=artifact_dir).current().selected_features
+
+    schema = build_schema(data, full_features, selected, data_sha256)
+    write_schema(args.output, schema)
+    print(f"wrote {args.output}: {len(schema.features)} features, {schema.rows} rows")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,379 @@
+import contextvars
+import json
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from telemetry import span
+
+# -----------------------------------------------------------------------
+# Reverse geocoding with a persistent, spatially quantized cache
+#
+# getLocDetails() used to build a new Nominatim client and make a
+# blocking reverse() call on every rerun of the Predict page.  Here:
+#
+# * coordinates are quantized to a geohash cell (precision 7 is roughly
+#   150 m x 150 m) and the cell is the cache key, so GPS jitter and
+#   repeated reruns at the same spot hit the cache;
+# * the cache is a small SQLite file shared by every session and every
+#   worker process, with a TTL and least-recently-used eviction;
+# * one geocoder client is reused and calls are spaced by a client-side
+#   rate limiter (Nominatim's usage policy is one request per second);
+# * the backend is pluggable: NominatimBackend for the public service or
+#   OfflineBackend, a point-in-polygon lookup over local admin-boundary
+#   GeoJSON, which needs no network at all.
+#
+# Configuration (environment):
+#   GWP_GEOCODER             "nominatim" (default) or "offline"
+#   GWP_GEOCODER_BOUNDARIES  GeoJSON of admin polygons for "offline"
+#   GWP_GEOCODE_CACHE        cache file (default: .geocode_cache.sqlite)
+#   GWP_GEOCODE_TTL          seconds a cached address stays valid
+# -----------------------------------------------------------------------
+
+DEFAULT_PRECISION = 7
+DEFAULT_TTL = 30 * 24 * 3600
+DEFAULT_MAX_ENTRIES = 100_000
+DEFAULT_CACHE_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), ".geocode_cache.sqlite"
+)
+
+_GEOHASH_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+
+def geohash(lat, lon, precision=DEFAULT_PRECISION):
+    lat_lo, lat_hi = -90.0, 90.0
+    lon_lo, lon_hi = -180.0, 180.0
+    chars = []
+    bits = 0
+    ch = 0
+    even = True
+    while len(chars) < precision:
+        if even:
+            mid = (lon_lo + lon_hi) / 2
+            if lon >= mid:
+                ch = (ch << 1) | 1
+                lon_lo = mid
+            else:
+                ch <<= 1
+                lon_hi = mid
+        else:
+            mid = (lat_lo + lat_hi) / 2
+            if lat >= mid:
+                ch = (ch << 1) | 1
+                lat_lo = mid
+            else:
+                ch <<= 1
+                lat_hi = mid
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(_GEOHASH_BASE32[ch])
+            bits = 0
+            ch = 0
+    return "".join(chars)
+
+
+def format_address(address):
+    # Same wording the Predict page has always shown
+    country = address.get("country", "")
+    state = address.get("state", "")
+    city = address.get("city", "")
+    return f"Country: {country}, Province: {state}, City: {city}"
+
+
+# ===============================
+# Persistent cache
+# ===============================
+class GeocodeCache:
+    def __init__(self, path=DEFAULT_CACHE_PATH, ttl=DEFAULT_TTL,
+                 max_entries=DEFAULT_MAX_ENTRIES):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS geocode ("
+            " key TEXT PRIMARY KEY, value TEXT NOT NULL,"
+            " created REAL NOT NULL, accessed REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS geocode_accessed ON geocode(accessed)")
+        self._conn.commit()
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, created FROM geocode WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or now - row[1] > self.ttl:
+                if row is not None:
+                    self._conn.execute("DELETE FROM geocode WHERE key = ?", (key,))
+                    self._conn.commit()
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE geocode SET accessed = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+            return json.loads(row[0])
+
+    def put(self, key, value):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO geocode (key, value, created, accessed)"
+                " VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value), now, now),
+            )
+            # LRU eviction: drop the least recently read rows over the cap
+            self._conn.execute(
+                "DELETE FROM geocode WHERE key IN ("
+                " SELECT key FROM geocode ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+            self._conn.commit()
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM geocode").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class RateLimiter:
+    """Space calls at least `min_interval` seconds apart across threads."""
+
+    def __init__(self, min_interval):
+        self.min_interval = min_interval
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            delay = self._next - now
+            self._next = max(now, self._next) + self.min_interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+# ===============================
+# Backends
+# ===============================
+class NominatimBackend:
+    name = "nominatim"
+
+    def __init__(self, user_agent="geoapi_exercise", timeout=5, min_interval=1.0):
+        self.user_agent = user_agent
+        self.timeout = timeout
+        self.limiter = RateLimiter(min_interval)
+        self._client = None
+        self._lock = threading.Lock()
+
+    def _geolocator(self):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    from geopy.geocoders import Nominatim
+
+                    self._client = Nominatim(user_agent=self.user_agent, timeout=self.timeout)
+        return self._client
+
+    def reverse(self, lat, lon):
+        self.limiter.wait()
+        location = self._geolocator().reverse(f"{lat},{lon}")
+        if location is None:
+            return {}
+        address = location.raw.get("address", {})
+        return {k: address.get(k, "") for k in ("country", "state", "city")}
+
+
+class OfflineBackend:
+    """Point-in-polygon lookup over a GeoJSON FeatureCollection of admin
+    areas.  Each feature's properties should carry "country", "state"
+    and/or "city"; when several polygons contain the point, the smallest
+    one wins (a district inside its province)."""
+
+    name = "offline"
+
+    def __init__(self, boundaries_path):
+        with open(boundaries_path) as fh:
+            collection = json.load(fh)
+
+        self._rings = []  # (feature index, exterior, holes)
+        self._props = []
+        bboxes, areas = [], []
+        for feature in collection.get("features", []):
+            geom = feature.get("geometry") or {}
+            if geom.get("type") == "Polygon":
+                polygons = [geom["coordinates"]]
+            elif geom.get("type") == "MultiPolygon":
+                polygons = geom["coordinates"]
+            else:
+                continue
+            idx = len(self._props)
+            self._props.append(feature.get("properties") or {})
+            area = 0.0
+            for poly in polygons:
+                rings = [np.asarray(r, dtype=np.float64)[:, :2] for r in poly]
+                ext = rings[0]
+                self._rings.append((idx, ext, rings[1:]))
+                bboxes.append((ext[:, 0].min(), ext[:, 1].min(), ext[:, 0].max(), ext[:, 1].max()))
+                x, y = ext[:, 0], ext[:, 1]
+                area += 0.5 * abs(np.dot(x, np.roll(y, 1)) - np.dot(y, np.roll(x, 1)))
+            areas.append(area)
+        self._bboxes = np.array(bboxes, dtype=np.float64).reshape(-1, 4)
+        self._areas = np.array(areas, dtype=np.float64)
+
+    @staticmethod
+    def _contains(ring, x, y):
+        # Even-odd ray casting, vectorised over the ring's edges
+        xi, yi = ring[:, 0], ring[:, 1]
+        xj, yj = np.roll(xi, 1), np.roll(yi, 1)
+        crosses = (yi > y) != (yj > y)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            x_at = (xj - xi) * (y - yi) / (yj - yi) + xi
+        return bool(np.count_nonzero(crosses & (x < x_at)) % 2)
+
+    def reverse(self, lat, lon):
+        x, y = lon, lat
+        b = self._bboxes
+        candidates = np.flatnonzero((b[:, 0] <= x) & (x <= b[:, 2]) & (b[:, 1] <= y) & (y <= b[:, 3]))
+        best = None
+        for i in candidates:
+            idx, ext, holes = self._rings[i]
+            if self._contains(ext, x, y) and not any(self._contains(h, x, y) for h in holes):
+                if best is None or self._areas[idx] < self._areas[best]:
+                    best = idx
+        if best is None:
+            return {}
+        props = self._props[best]
+        return {k: props.get(k, "") or "" for k in ("country", "state", "city")}
+
+
+# ===============================
+# Front end
+# ===============================
+class ReverseGeocoder:
+    def __init__(self, backend, cache=None, precision=DEFAULT_PRECISION):
+        self.backend = backend
+        self.cache = cache
+        self.precision = precision
+
+    def key(self, lat, lon):
+        return f"{self.backend.name}:{geohash(lat, lon, self.precision)}"
+
+    def reverse(self, lat, lon):
+        """Address dict for the cell containing (lat, lon)."""
+        with span("reverse_geocode"):
+            key = self.key(lat, lon)
+            if self.cache is not None:
+                cached = self.cache.get(key)
+                if cached is not None:
+                    return cached
+            address = self.backend.reverse(lat, lon)
+            if self.cache is not None:
+                self.cache.put(key, address)
+            return address
+
+    def cached(self, lat, lon):
+        """Cached address for (lat, lon), or None; never calls the backend."""
+        if self.cache is None:
+            return None
+        return self.cache.get(self.key(lat, lon))
+
+    def describe(self, lat, lon):
+        return format_address(self.reverse(lat, lon))
+
+
+# ===============================
+# Background lookups
+# ===============================
+# The Predict page must not wait on the network.  A lookup is answered
+# from the cache on the spot when possible; otherwise it runs on this
+# small pool and the page polls it.  A lookup that exceeds its timeout is
+# reported as timed out but left running and still polled, so its answer
+# is shown (and lands in the cache) whenever it does arrive.
+DEFAULT_LOOKUP_TIMEOUT = 8.0
+
+_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="geocode")
+
+
+class AddressLookup:
+    def __init__(self, lat, lon, geocoder=None, timeout=DEFAULT_LOOKUP_TIMEOUT):
+        geocoder = geocoder or get_geocoder()
+        self.latlon = (lat, lon)
+        self.timeout = timeout
+        self.started = time.monotonic()
+        self.text = None
+        self.future = None
+
+        cached = geocoder.cached(lat, lon)
+        if cached is not None:
+            self.text = format_address(cached)
+        else:
+            # copy_context: the span is tagged with the caller's session
+            self.future = _executor.submit(contextvars.copy_context().run,
+                                           geocoder.reverse, lat, lon)
+
+    @property
+    def done(self):
+        """True once poll() has the final answer (address or failure)."""
+        return self.text is not None
+
+    def poll(self):
+        """Address text once known (or a short failure note); None while
+        the lookup is still running, or a timed-out note past the timeout
+        (not final: a later poll returns the answer once it arrives)."""
+        if self.text is not None:
+            return self.text
+        if self.future.done():
+            try:
+                self.text = format_address(self.future.result())
+            except Exception as e:
+                self.text = f"Address unavailable ({e.__class__.__name__})"
+            return self.text
+        if time.monotonic() - self.started > self.timeout:
+            return "Address lookup timed out"
+        return None
+
+
+def geocoder_from_env():
+    kind = os.environ.get("GWP_GEOCODER", "nominatim")
+    if kind == "offline":
+        path = os.environ.get("GWP_GEOCODER_BOUNDARIES")
+        if not path:
+            raise RuntimeError("GWP_GEOCODER=offline needs GWP_GEOCODER_BOUNDARIES")
+        backend = OfflineBackend(path)
+    elif kind == "nominatim":
+        backend = NominatimBackend()
+    else:
+        raise ValueError(f"Unknown GWP_GEOCODER: {kind}")
+
+    cache = GeocodeCache(
+        os.environ.get("GWP_GEOCODE_CACHE", DEFAULT_CACHE_PATH),
+        ttl=float(os.environ.get("GWP_GEOCODE_TTL", DEFAULT_TTL)),
+    )
+    return ReverseGeocoder(backend, cache)
+
+
+_geocoder = None
+_geocoder_lock = threading.Lock()
+
+
+def get_geocoder():
+    global _geocoder
+    if _geocoder is None:
+        with _geocoder_lock:
+            if _geocoder is None:
+                _geocoder = geocoder_from_env()
+    return _geocoder
@@ -0,0 +1,516 @@
+import argparse
+import json
+import os
+import sys
+import time
+
+import joblib
+import numpy as np
+import pandas as pd
+
+from artifacts import BASE_DIR, BUNDLE_FILE, DATA_FILE
+
+# -----------------------------------------------------------------------
+# Incremental learning between full rebuilds
+#
+# Adding labelled survey points used to mean re-running the whole
+# training pipeline, and an RBF SVC refit grows superlinearly with the
+# rows.  This keeps a second classifier next to the deployed one that can
+# take new observations in time proportional to the batch:
+#
+#   codes      the deployed bundle's encoder levels and selected features
+#              (frozen until the next full rebuild)
+#   features   a Nystroem map with the deployed SVC's own kernel and
+#              parameters.  The inputs are categorical, so the basis can
+#              be every cell of the input space (864 for the shipped
+#              model) and the map is then exact for any input, not an
+#              approximation; larger spaces use a random sample of cells.
+#   model      SGDClassifier(loss="log_loss") updated with partial_fit
+#              (logistic loss, so it has predict_proba)
+#
+# The state (map, linear model, holdout rows and a history of updates)
+# is one joblib file.  `init` fits it on the rows the deployed SVC was
+# trained on - the same stratified split training.py uses - and keeps
+# that split's holdout.  Each `update` validates a batch, moves a share
+# of it into the holdout, runs a few partial_fit passes over the rest,
+# optionally appends the batch to the training CSV, and scores both
+# models on the holdout:
+#
+#   incremental_accuracy   the updated linear model
+#   svc_accuracy           the deployed bundle (never refit here)
+#   svc_new_accuracy       the deployed bundle on holdout rows that came
+#                          from updates, i.e. data it has never seen
+#
+# A full rebuild (python training.py) is recommended once the
+# incremental model beats the deployed SVC on the holdout, or the SVC
+# scores worse on new rows than on the original holdout, by more than
+# --tolerance *and* by more than the holdout's noise.  The holdout is
+# small (51 rows from the shipped CSV, where one row is ~2%), so a raw
+# accuracy gap alone flags differences of a row or two:
+#
+#   incremental vs SVC     same rows, so only the rows where the two
+#                          disagree count: an exact McNemar test on those
+#                          discordant rows (one-sided, binomial at 1/2)
+#   SVC new vs original    two different row sets: a one-sided Fisher
+#                          exact test on the SVC's errors in each
+#
+# and either needs p < --significance.  A batch with a level the encoder does not know cannot be
+# learnt incrementally at all and is rejected with the same advice.
+#
+#     python incremental.py init
+#     python incremental.py update new_points.csv --append
+#     python incremental.py status --refit-svc
+#     python incremental.py bench
+# -----------------------------------------------------------------------
+
+STATE_FILE = "incremental_state.joblib"
+MAX_BASIS = 2000
+DEFAULT_EPOCHS_INIT = 30
+DEFAULT_EPOCHS_UPDATE = 5
+DEFAULT_HOLDOUT_FRACTION = 0.2
+DEFAULT_TOLERANCE = 0.02
+DEFAULT_SIGNIFICANCE = 0.05
+DEFAULT_ALPHA = 1e-4
+
+
+class IncrementalModel:
+    def __init__(self, bundle, alpha=DEFAULT_ALPHA, max_basis=MAX_BASIS, random_state=42):
+        from sklearn.kernel_approximation import Nystroem
+        from sklearn.linear_model import SGDClassifier
+
+        compiled = bundle.compiled()
+        self.base_version = bundle.version
+        self.features = list(compiled.features)
+        self.levels = [np.asarray(lv, dtype=object) for lv in compiled.levels]
+        self.classes = np.asarray(compiled.classes)
+        self.random_state = random_state
+        self._compiled = compiled
+
+        cells = int(np.prod(compiled.radix, dtype=np.int64))
+        rng = np.random.default_rng(random_state)
+        flat = (np.arange(cells) if cells <= max_basis
+                else rng.choice(cells, size=max_basis, replace=False))
+        basis = np.stack(np.unravel_index(flat, compiled.radix), axis=1)
+        kernel_params = {"gamma": compiled.gamma}
+        if compiled.kernel in ("poly", "sigmoid"):
+            kernel_params["coef0"] = compiled.coef0
+        if compiled.kernel == "poly":
+            kernel_params["degree"] = compiled.degree
+        self.feature_map = Nystroem(kernel=compiled.kernel, n_components=len(flat),
+                                    random_state=random_state, **kernel_params)
+        self.feature_map.fit(compiled.scaled(basis))
+        self.exact = cells <= max_basis
+        self._phi = None
+
+        self.model = SGDClassifier(loss="log_loss", alpha=alpha, random_state=random_state)
+        self.rows_seen = 0
+        self.updates = 0
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        # Rebuilt from the bundle on load
+        state.pop("_compiled", None)
+        state["_phi"] = None
+        return state
+
+    def attach(self, bundle):
+        if bundle.version != self.base_version:
+            raise ValueError(
+                f"state was built on bundle {self.base_version}, deployed bundle is "
+                f"{bundle.version}; run `incremental.py init` after a rebuild"
+            )
+        self._compiled = bundle.compiled()
+        return self
+
+    def codes(self, frame):
+        """Level codes of `frame`; ValueError naming any unknown level."""
+        missing = [f for f in self.features if f not in frame.columns]
+        if missing:
+            raise ValueError(f"batch is missing predictor columns: {missing}")
+        codes = self._compiled.encode(frame)
+        bad = codes < 0
+        if bad.any():
+            unknown = sorted({
+                (self.features[j], str(frame[self.features[j]].iloc[i]))
+                for i, j in np.argwhere(bad)
+            })
+            raise ValueError(
+                "batch has levels the deployed encoder does not know "
+                f"{unknown}; these need a full rebuild (python training.py)"
+            )
+        return codes
+
+    def transform(self, codes):
+        if self.exact:
+            # Every cell's feature row computed once, then a gather: an
+            # update costs O(batch) row copies, not a kernel evaluation
+            # against the whole basis
+            if self._phi is None:
+                radix = self._compiled.radix
+                cells = np.stack(np.unravel_index(np.arange(np.prod(radix)), radix), axis=1)
+                self._phi = self.feature_map.transform(self._compiled.scaled(cells))
+            return self._phi[np.ravel_multi_index(codes.T, self._compiled.radix)]
+        return self.feature_map.transform(self._compiled.scaled(codes))
+
+    def partial_fit(self, codes, y, epochs=1, rng=None):
+        rng = rng or np.random.default_rng(self.random_state + self.updates)
+        Phi = self.transform(codes)
+        for _ in range(epochs):
+            order = rng.permutation(len(y))
+            self.model.partial_fit(Phi[order], y[order], classes=self.classes)
+        self.rows_seen += len(y)
+        self.updates += 1
+
+    def predict(self, codes):
+        return self.model.predict(self.transform(codes))
+
+    def predict_proba(self, codes):
+        return self.model.predict_proba(self.transform(codes))
+
+    def svc_predict(self, codes):
+        return self._compiled.predict_codes(codes)
+
+
+# ===============================
+# State
+# ===============================
+def load_batch(path):
+    from training import load_training_data
+
+    X, y, _ = load_training_data(path)
+    return X, y
+
+
+def _split_holdout(n, fraction, rng):
+    k = int(round(n * fraction))
+    order = rng.permutation(n)
+    mask = np.zeros(n, dtype=bool)
+    mask[order[:k]] = True
+    return mask
+
+
+def _accuracy(model, codes, y):
+    if len(y) == 0:
+        return None
+    return float(np.mean(model.predict(codes) == y))
+
+
+def _svc_accuracy(model, codes, y):
+    if len(y) == 0:
+        return None
+    return float(np.mean(model.svc_predict(codes) == y))
+
+
+def _mcnemar_greater(wins, losses):
+    """Exact one-sided McNemar p-value that the first model is better,
+    from the discordant rows only (wins: first right, second wrong)."""
+    from scipy.stats import binomtest
+
+    if wins + losses == 0:
+        return 1.0
+    return float(binomtest(wins, wins + losses, 0.5, alternative="greater").pvalue)
+
+
+def _fisher_worse(errors_new, rows_new, errors_base, rows_base):
+    """One-sided Fisher exact p-value that the error rate on the new rows
+    is higher than on the original ones."""
+    from scipy.stats import fisher_exact
+
+    if rows_new == 0 or rows_base == 0:
+        return 1.0
+    table = [[errors_new, rows_new - errors_new], [errors_base, rows_base - errors_base]]
+    return float(fisher_exact(table, alternative="greater")[1])
+
+
+def evaluate(state, tolerance=DEFAULT_TOLERANCE, significance=DEFAULT_SIGNIFICANCE):
+    model = state["model"]
+    codes, y, source = state["holdout_codes"], state["holdout_y"], state["holdout_source"]
+    new = source > 0
+    result = {
+        "holdout_rows": int(len(y)),
+        "holdout_new_rows": int(new.sum()),
+        "incremental_accuracy": _accuracy(model, codes, y),
+        "svc_accuracy": _svc_accuracy(model, codes, y),
+        "svc_base_accuracy": _svc_accuracy(model, codes[~new], y[~new]),
+        "svc_new_accuracy": _svc_accuracy(model, codes[new], y[new]),
+    }
+    inc_right = model.predict(codes) == y
+    svc_right = model.svc_predict(codes) == y
+    wins, losses = int((inc_right & ~svc_right).sum()), int((~inc_right & svc_right).sum())
+    result["discordant_rows"] = {"incremental_only": wins, "svc_only": losses}
+    result["incremental_vs_svc_p"] = _mcnemar_greater(wins, losses)
+    result["svc_new_vs_base_p"] = _fisher_worse(int((~svc_right[new]).sum()), int(new.sum()),
+                                                int((~svc_right[~new]).sum()), int((~new).sum()))
+    reasons = []
+    if (result["incremental_accuracy"] - result["svc_accuracy"] > tolerance
+            and result["incremental_vs_svc_p"] < significance):
+        reasons.append("the incremental model beats the deployed SVC on the holdout")
+    if (result["svc_new_accuracy"] is not None
+            and result["svc_base_accuracy"] - result["svc_new_accuracy"] > tolerance
+            and result["svc_new_vs_base_p"] < significance):
+        reasons.append("the deployed SVC is less accurate on new rows than on the original holdout")
+    result["rebuild_recommended"] = bool(reasons)
+    result["reasons"] = reasons
+    return result
+
+
+def init_state(data_path=None, bundle_path=None, epochs=DEFAULT_EPOCHS_INIT,
+               alpha=DEFAULT_ALPHA, random_state=42):
+    from sklearn.model_selection import train_test_split
+
+    from model_bundle import load_bundle
+    from training import TEST_SIZE
+
+    data_path = data_path or os.path.join(BASE_DIR, DATA_FILE)
+    bundle = load_bundle(bundle_path or os.path.join(BASE_DIR, BUNDLE_FILE))
+    X, y = load_batch(data_path)
+
+    model = IncrementalModel(bundle, alpha=alpha, random_state=random_state)
+    codes = model.codes(X)
+    # The split training.py makes, so the holdout is unseen by the SVC too
+    idx_train, idx_test = train_test_split(
+        np.arange(len(y)), test_size=TEST_SIZE, random_state=random_state, stratify=y
+    )
+    t0 = time.perf_counter()
+    model.partial_fit(codes[idx_train], y[idx_train], epochs=epochs)
+    seconds = time.perf_counter() - t0
+
+    state = {
+        "model": model,
+        "data_path": os.path.abspath(data_path),
+        "holdout_codes": codes[idx_test],
+        "holdout_y": y[idx_test],
+        "holdout_source": np.zeros(len(idx_test), dtype=np.int64),  # 0 = original split
+        # CSV rows in the holdout, left out of --refit-svc
+        "holdout_csv_rows": sorted(int(i) for i in idx_test),
+        "history": [],
+    }
+    state["history"].append({"event": "init", "rows": int(len(idx_train)),
+                             "seconds": seconds, **evaluate(state)})
+    return state
+
+
+def update_state(state, X, y, epochs=DEFAULT_EPOCHS_UPDATE,
+                 holdout_fraction=DEFAULT_HOLDOUT_FRACTION, tolerance=DEFAULT_TOLERANCE,
+                 significance=DEFAULT_SIGNIFICANCE, csv_offset=None):
+    """Learn one batch.  csv_offset: row number the batch will start at
+    in the training CSV when it is appended there, else None."""
+    model = state["model"]
+    codes = model.codes(X)
+    batch_no = len(state["history"])
+    rng = np.random.default_rng(model.random_state + batch_no)
+    held = _split_holdout(len(y), holdout_fraction, rng)
+
+    t0 = time.perf_counter()
+    if (~held).any():
+        model.partial_fit(codes[~held], y[~held], epochs=epochs, rng=rng)
+    seconds = time.perf_counter() - t0
+
+    state["holdout_codes"] = np.vstack([state["holdout_codes"], codes[held]])
+    state["holdout_y"] = np.concatenate([state["holdout_y"], y[held]])
+    state["holdout_source"] = np.concatenate(
+        [state["holdout_source"], np.full(int(held.sum()), batch_no, dtype=np.int64)]
+    )
+    if csv_offset is not None:
+        state["holdout_csv_rows"].extend(int(csv_offset + i) for i in np.flatnonzero(held))
+    entry = {"event": "update", "rows": int((~held).sum()), "holdout_added": int(held.sum()),
+             "seconds": seconds, **evaluate(state, tolerance, significance)}
+    state["history"].append(entry)
+    return entry
+
+
+def save_state(state, path):
+    tmp = f"{path}.new"
+    joblib.dump(state, tmp)
+    os.replace(tmp, path)
+
+
+def load_state(path, bundle_path=None):
+    from model_bundle import load_bundle
+
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"{path} not found; run `incremental.py init` first")
+    state = joblib.load(path)
+    state["model"].attach(load_bundle(bundle_path or os.path.join(BASE_DIR, BUNDLE_FILE)))
+    return state
+
+
+def refit_svc_comparison(state, data_path, bundle):
+    """Refit an SVC on every training row (the CSV minus the holdout) with
+    the deployed parameters and score it on the holdout: what a full
+    rebuild without a new search would give, and what it costs."""
+    from sklearn.svm import SVC
+
+    model = state["model"]
+    X, y = load_batch(data_path)
+    codes = model.codes(X)
+    keep = np.ones(len(y), dtype=bool)
+    keep[[i for i in state["holdout_csv_rows"] if i < len(y)]] = False
+    compiled = model._compiled
+    params = {k.replace("svc__", ""): v
+              for k, v in (bundle.manifest.get("metadata", {}).get("params") or {}).items()}
+    params.setdefault("kernel", compiled.kernel)
+    params.setdefault("gamma", compiled.gamma)
+    t0 = time.perf_counter()
+    svc = SVC(**params).fit(compiled.scaled(codes[keep]), y[keep])
+    seconds = time.perf_counter() - t0
+    pred = svc.predict(compiled.scaled(state["holdout_codes"]))
+    return {"rows": int(keep.sum()), "seconds": seconds,
+            "accuracy": float(np.mean(pred == state["holdout_y"]))}
+
+
+def _print_evaluation(entry):
+    def _pct(v):
+        return "   –  " if v is None else f"{v:6.1%}"
+
+    print(f"holdout {entry['holdout_rows']} rows ({entry['holdout_new_rows']} from updates)")
+    print(f"  incremental model      {_pct(entry['incremental_accuracy'])}")
+    print(f"  deployed SVC           {_pct(entry['svc_accuracy'])}")
+    print(f"    on original holdout  {_pct(entry['svc_base_accuracy'])}")
+    print(f"    on new rows          {_pct(entry['svc_new_accuracy'])}")
+    discordant = entry["discordant_rows"]
+    print(f"  rows only one gets right: incremental {discordant['incremental_only']}, "
+          f"SVC {discordant['svc_only']} (McNemar p={entry['incremental_vs_svc_p']:.3f})")
+    if entry["holdout_new_rows"]:
+        print(f"  SVC worse on new rows: Fisher p={entry['svc_new_vs_base_p']:.3f}")
+    if entry["rebuild_recommended"]:
+        for reason in entry["reasons"]:
+            print(f"REBUILD RECOMMENDED: {reason} (python training.py)")
+    else:
+        print("no rebuild needed yet")
+
+
+# ===============================
+# Benchmark
+# ===============================
+def bench(data_path, batches, epochs, repeat=1, random_state=42):
+    """Replay the training CSV (tiled `repeat` times, to see how the two
+    scale) as a base set plus `batches` arriving batches, comparing an
+    incremental update with a full SVC refit."""
+    from sklearn.model_selection import train_test_split
+    from sklearn.svm import SVC
+
+    from model_bundle import load_bundle
+
+    bundle = load_bundle(os.path.join(BASE_DIR, BUNDLE_FILE))
+    X, y = load_batch(data_path)
+    model = IncrementalModel(bundle, random_state=random_state)
+    codes = np.tile(model.codes(X), (repeat, 1))
+    y = np.tile(y, repeat)
+    compiled = model._compiled
+
+    idx_train, idx_test = train_test_split(np.arange(len(y)), test_size=0.2,
+                                           random_state=random_state, stratify=y)
+    parts = np.array_split(np.random.default_rng(random_state).permutation(idx_train), batches + 1)
+    model.partial_fit(codes[parts[0]], y[parts[0]], epochs=DEFAULT_EPOCHS_INIT)
+    seen = list(parts[0])
+
+    print(f"{'rows':>6} {'update ms':>10} {'refit ms':>10} {'incremental':>12} {'SVC refit':>10}")
+    for part in parts[1:]:
+        t0 = time.perf_counter()
+        model.partial_fit(codes[part], y[part], epochs=epochs)
+        t_inc = time.perf_counter() - t0
+        seen.extend(part)
+        t0 = time.perf_counter()
+        svc = SVC(kernel=compiled.kernel, gamma=compiled.gamma).fit(
+            compiled.scaled(codes[seen]), y[seen])
+        t_svc = time.perf_counter() - t0
+        acc_inc = np.mean(model.predict(codes[idx_test]) == y[idx_test])
+        acc_svc = np.mean(svc.predict(compiled.scaled(codes[idx_test])) == y[idx_test])
+        print(f"{len(seen):6d} {t_inc * 1e3:10.2f} {t_svc * 1e3:10.2f} {acc_inc:12.1%} {acc_svc:10.1%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Incremental updates between full rebuilds.")
+    parser.add_argument("--state", default=os.path.join(BASE_DIR, STATE_FILE))
+    parser.add_argument("--bundle", default=None, help=f"deployed bundle (default: {BUNDLE_FILE})")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("init", help="fit the incremental model on the deployed SVC's training rows")
+    p.add_argument("--data", default=None, help=f"training CSV (default: {DATA_FILE})")
+    p.add_argument("--epochs", type=int, default=DEFAULT_EPOCHS_INIT)
+    p.add_argument("--alpha", type=float, default=DEFAULT_ALPHA)
+
+    p = sub.add_parser("update", help="learn a batch of labelled observations")
+    p.add_argument("batch", help="CSV with the training CSV's columns")
+    p.add_argument("--epochs", type=int, default=DEFAULT_EPOCHS_UPDATE)
+    p.add_argument("--holdout-fraction", type=float, default=DEFAULT_HOLDOUT_FRACTION)
+    p.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    p.add_argument("--significance", type=float, default=DEFAULT_SIGNIFICANCE,
+                   help="p-value a gap must beat to count as more than holdout noise")
+    p.add_argument("--append", action="store_true",
+                   help="also append the batch to the training CSV for the next rebuild")
+
+    p = sub.add_parser("status", help="holdout comparison and update history")
+    p.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    p.add_argument("--significance", type=float, default=DEFAULT_SIGNIFICANCE,
+                   help="p-value a gap must beat to count as more than holdout noise")
+    p.add_argument("--refit-svc", action="store_true",
+                   help="also refit an SVC on all training rows for comparison")
+    p.add_argument("--json", action="store_true")
+
+    p = sub.add_parser("bench", help="replay the CSV in batches: update vs full refit")
+    p.add_argument("--data", default=None)
+    p.add_argument("--batches", type=int, default=5)
+    p.add_argument("--epochs", type=int, default=DEFAULT_EPOCHS_UPDATE)
+    p.add_argument("--repeat", type=int, default=1, help="tile the CSV this many times")
+    args = parser.parse_args()
+
+    if args.command == "bench":
+        bench(args.data or os.path.join(BASE_DIR, DATA_FILE), args.batches, args.epochs,
+              repeat=args.repeat)
+        return
+
+    if args.command == "init":
+        state = init_state(args.data, args.bundle, epochs=args.epochs, alpha=args.alpha)
+        save_state(state, args.state)
+        entry = state["history"][-1]
+        print(f"initialised on {entry['rows']} rows in {entry['seconds'] * 1e3:.1f} ms "
+              f"({'exact' if state['model'].exact else 'sampled'} kernel map, "
+              f"{state['model'].feature_map.n_components} components) -> {args.state}")
+        _print_evaluation(entry)
+        return
+
+    state = load_state(args.state, args.bundle)
+
+    if args.command == "update":
+        X, y = load_batch(args.batch)
+        csv_offset = len(load_batch(state["data_path"])[1]) if args.append else None
+        try:
+            entry = update_state(state, X, y, epochs=args.epochs,
+                                 holdout_fraction=args.holdout_fraction, tolerance=args.tolerance,
+                                 significance=args.significance, csv_offset=csv_offset)
+        except ValueError as e:
+            sys.exit(f"[incremental] {e}")
+        save_state(state, args.state)
+        if args.append:
+            # Same layout as the training CSV, for the next full rebuild
+            batch = pd.read_csv(args.batch)
+            batch.to_csv(state["data_path"], mode="a", header=False, index=False)
+        print(f"learnt {entry['rows']} rows in {entry['seconds'] * 1e3:.1f} ms, "
+              f"{entry['holdout_added']} added to the holdout"
+              + (f"; appended to {state['data_path']}" if args.append else ""))
+        _print_evaluation(entry)
+        return
+
+    entry = evaluate(state, args.tolerance, args.significance)
+    if args.refit_svc:
+        from model_bundle import load_bundle
+
+        entry["svc_refit"] = refit_svc_comparison(
+            state, state["data_path"], load_bundle(args.bundle or os.path.join(BASE_DIR, BUNDLE_FILE))
+        )
+    if args.json:
+        print(json.dumps({"evaluation": entry, "history": state["history"]}, indent=2, default=str))
+        return
+    model = state["model"]
+    print(f"base bundle {model.base_version}; {model.rows_seen} rows learnt over "
+          f"{model.updates} fits")
+    _print_evaluation(entry)
+    if args.refit_svc:
+        r = entry["svc_refit"]
+        print(f"  full SVC refit         {r['accuracy']:6.1%}  ({r['rows']} rows, {r['seconds'] * 1e3:.1f} ms)")
+
+
+if __name__ == "__main__":
+    main()
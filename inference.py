@@ -0,0 +1,418 @@
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from telemetry import span
+
+# -----------------------------------------------------------------------
+# Compiled inference kernel
+#
+# The app path builds a one-row DataFrame, runs OrdinalEncoder over all
+# seven predictors, reindexes to the selected columns, runs StandardScaler
+# and then SVC.predict and SVC.predict_proba (each of which evaluates the
+# kernel again).  CompiledPipeline pulls the fitted numbers out of those
+# three estimators once and evaluates raw category strings straight to
+# labels and probabilities with plain NumPy:
+#
+#   strings --factorize--> level codes --gather--> scaled features
+#   --BLAS--> kernel against the support vectors --dot--> decision value
+#   --Platt + libsvm pairwise coupling--> probabilities
+#
+# The decision value is computed once and shared by the label and the
+# probabilities.  Batches are processed in fixed-size chunks so the
+# (rows x support vectors) kernel matrix stays bounded.
+#
+# Only fitted attributes are read; nothing here imports sklearn, so the
+# kernel can be constructed from plain arrays as well as from estimators.
+# -----------------------------------------------------------------------
+
+DEFAULT_CHUNK_SIZE = 65536
+
+# Batches up to this size are encoded with plain dict probes; larger ones
+# are factorized first
+SMALL_BATCH_ROWS = 64
+
+# Batches larger than this are de-duplicated before the kernel is evaluated
+DEDUPE_MIN_ROWS = 4096
+
+# libsvm clamps pairwise probabilities to [MIN_PROB, 1 - MIN_PROB]
+MIN_PROB = 1e-7
+
+
+class CompiledPipeline:
+    def __init__(self, features, levels, mean, scale, support_vectors,
+                 dual_coef, intercept, classes, kernel="rbf", gamma=1.0,
+                 coef0=0.0, degree=3, prob_a=None, prob_b=None,
+                 chunk_size=DEFAULT_CHUNK_SIZE):
+        self.features = list(features)
+        self.levels = [np.asarray(lv, dtype=object) for lv in levels]
+        self.classes = np.asarray(classes)
+        if len(self.classes) != 2:
+            raise ValueError("CompiledPipeline supports binary SVC models only")
+        if kernel not in ("rbf", "linear", "poly", "sigmoid"):
+            raise ValueError(f"Unsupported SVC kernel: {kernel}")
+
+        self.mean = np.asarray(mean, dtype=np.float64)
+        self.scale = np.asarray(scale, dtype=np.float64)
+        self.support_vectors = np.ascontiguousarray(support_vectors, dtype=np.float64)
+        self.dual_coef = np.asarray(dual_coef, dtype=np.float64).ravel()
+        self.intercept = float(np.asarray(intercept).ravel()[0])
+        self.kernel = kernel
+        self.gamma = float(gamma)
+        self.coef0 = float(coef0)
+        self.degree = int(degree)
+        self.prob_a = None if prob_a is None else float(np.asarray(prob_a).ravel()[0])
+        self.prob_b = None if prob_b is None else float(np.asarray(prob_b).ravel()[0])
+        self.chunk_size = int(chunk_size)
+
+        # Scaled value of every level of every feature: the encoder code is
+        # the level index, so scaling can be folded into a gather.
+        self.level_values = [
+            (np.arange(len(lv), dtype=np.float64) - m) / s
+            for lv, m, s in zip(self.levels, self.mean, self.scale)
+        ]
+        self._index = [{v: i for i, v in enumerate(lv)} for lv in self.levels]
+        self.radix = tuple(len(lv) for lv in self.levels)
+        self._sv_sq = np.einsum("ij,ij->i", self.support_vectors, self.support_vectors)
+
+    @property
+    def has_proba(self):
+        return self.prob_a is not None
+
+    @classmethod
+    def from_estimators(cls, encoder, scaler, model, selected_features, **kwargs):
+        encoder_features = list(encoder.feature_names_in_)
+        levels = [encoder.categories_[encoder_features.index(f)] for f in selected_features]
+        scale = scaler.scale_ if scaler.scale_ is not None else np.ones(len(selected_features))
+        mean = scaler.mean_ if scaler.mean_ is not None else np.zeros(len(selected_features))
+        prob_a = getattr(model, "probA_", None)
+        prob_b = getattr(model, "probB_", None)
+        if prob_a is not None and len(prob_a) == 0:
+            prob_a = prob_b = None
+        return cls(
+            selected_features,
+            levels,
+            mean,
+            scale,
+            model.support_vectors_,
+            model.dual_coef_,
+            model.intercept_,
+            model.classes_,
+            kernel=model.kernel,
+            gamma=model._gamma,
+            coef0=model.coef0,
+            degree=model.degree,
+            prob_a=prob_a,
+            prob_b=prob_b,
+            **kwargs,
+        )
+
+    # -------------------------------------------------------------------
+    # strings -> codes
+    # -------------------------------------------------------------------
+    def _columns(self, X):
+        # Accepts a dict of scalars (one row), a dict/DataFrame of columns,
+        # or a 2-D array whose columns are already in feature order.
+        if isinstance(X, dict):
+            return [np.atleast_1d(np.asarray(X[f], dtype=object)) for f in self.features]
+        if hasattr(X, "columns"):
+            return [X[f] for f in self.features]
+        X = np.asarray(X, dtype=object)
+        if X.ndim == 1:
+            X = X[None, :]
+        return [X[:, i] for i in range(len(self.features))]
+
+    def encode(self, X):
+        """Level codes, shape (n_rows, n_features); -1 marks unknown values."""
+        cols = self._columns(X)
+        codes = np.empty((len(cols[0]), len(cols)), dtype=np.int64)
+        if codes.shape[0] <= SMALL_BATCH_ROWS:
+            for i, (col, index) in enumerate(zip(cols, self._index)):
+                codes[:, i] = [index.get(v, -1) for v in col]
+            return codes
+        for i, (col, index) in enumerate(zip(cols, self._index)):
+            # Factorize the column (hash-based, C speed), probe the level
+            # dict once per distinct value, then gather.  Missing values
+            # factorize to -1, which indexes the trailing -1 of the lut.
+            inverse, uniques = pd.factorize(col)
+            lut = np.fromiter((index.get(v, -1) for v in uniques), np.int64, count=len(uniques))
+            codes[:, i] = np.append(lut, -1)[inverse]
+        return codes
+
+    def _checked_codes(self, X):
+        codes = self.encode(X)
+        bad = codes < 0
+        if bad.any():
+            row, col = np.argwhere(bad)[0]
+            value = self._columns(X)[col][row]
+            raise ValueError(
+                f"Found unknown categories [{value!r}] in column "
+                f"'{self.features[col]}' during transform"
+            )
+        return codes
+
+    # -------------------------------------------------------------------
+    # codes -> decision value -> label / probability
+    # -------------------------------------------------------------------
+    def scaled(self, codes):
+        Z = np.empty(codes.shape, dtype=np.float64)
+        for i, values in enumerate(self.level_values):
+            Z[:, i] = values[codes[:, i]]
+        return Z
+
+    def _kernel(self, Z):
+        dots = Z @ self.support_vectors.T
+        if self.kernel == "linear":
+            return dots
+        if self.kernel == "poly":
+            return (self.gamma * dots + self.coef0) ** self.degree
+        if self.kernel == "sigmoid":
+            return np.tanh(self.gamma * dots + self.coef0)
+        sq = np.einsum("ij,ij->i", Z, Z)
+        d2 = sq[:, None] + self._sv_sq[None, :] - 2.0 * dots
+        np.maximum(d2, 0.0, out=d2)
+        d2 *= -self.gamma
+        return np.exp(d2, out=d2)
+
+    def _distinct(self, codes):
+        # Categorical inputs repeat: a large batch has at most prod(radix)
+        # distinct rows.  Scoring each distinct row once and gathering
+        # turns a million-row batch into a few hundred kernel rows plus an
+        # O(n) index.  Returns (rows to score, inverse index or None).
+        if codes.shape[0] > DEDUPE_MIN_ROWS:
+            flat = np.ravel_multi_index(codes.T, self.radix)
+            uniq, inverse = np.unique(flat, return_inverse=True)
+            if len(uniq) * 2 < codes.shape[0]:
+                return np.stack(np.unravel_index(uniq, self.radix), axis=1), inverse
+        return codes, None
+
+    def _decision(self, codes):
+        out = np.empty(codes.shape[0], dtype=np.float64)
+        for start in range(0, codes.shape[0], self.chunk_size):
+            stop = start + self.chunk_size
+            K = self._kernel(self.scaled(codes[start:stop]))
+            out[start:stop] = K @ self.dual_coef + self.intercept
+        return out
+
+    def _proba_from_decision(self, dec):
+        if not self.has_proba:
+            raise AttributeError("model was trained without probability=True")
+
+        # libsvm evaluates Platt scaling on its internal decision value,
+        # which has the opposite sign of sklearn's binary decision_function,
+        # then runs its pairwise-coupling solver (with its own stopping
+        # tolerance) even for two classes.  Reproduce both so the output
+        # matches predict_proba rather than the textbook sigmoid.
+        f = -dec * self.prob_a + self.prob_b
+        e = np.exp(-np.abs(f))
+        r = np.where(f >= 0, e / (1.0 + e), 1.0 / (1.0 + e))
+        r = np.clip(r, MIN_PROB, 1.0 - MIN_PROB)
+        return _couple_two_class(r)
+
+    def decision_from_codes(self, codes):
+        rows, inverse = self._distinct(codes)
+        dec = self._decision(rows)
+        return dec if inverse is None else dec[inverse]
+
+    def predict_codes(self, codes):
+        dec = self.decision_from_codes(codes)
+        return np.where(dec > 0, self.classes[1], self.classes[0])
+
+    def predict_proba_codes(self, codes):
+        return self.predict_with_proba_codes(codes)[1]
+
+    def predict_with_proba_codes(self, codes):
+        rows, inverse = self._distinct(codes)
+        dec = self._decision(rows)
+        labels = np.where(dec > 0, self.classes[1], self.classes[0])
+        probs = self._proba_from_decision(dec) if self.has_proba else None
+        if inverse is not None:
+            labels = labels[inverse]
+            probs = None if probs is None else probs[inverse]
+        return labels, probs
+
+    def decision_function(self, X):
+        return self.decision_from_codes(self._checked_codes(X))
+
+    def predict(self, X):
+        return self.predict_codes(self._checked_codes(X))
+
+    def predict_proba(self, X):
+        return self.predict_proba_codes(self._checked_codes(X))
+
+    def predict_with_proba(self, X):
+        with span("encode"):
+            codes = self._checked_codes(X)
+        with span("predict"):
+            return self.predict_with_proba_codes(codes)
+
+    def predict_one(self, inputs):
+        labels, probs = self.predict_with_proba(inputs)
+        return labels[0], probs[0]
+
+
+def _couple_two_class(r, max_iter=100):
+    # libsvm multiclass_probability() specialised to k=2, vectorised over
+    # rows.  r is the pairwise estimate P(class 0 | class 0 or 1).
+    k = 2
+    eps = 0.005 / k
+    n = r.shape[0]
+    q00 = (1.0 - r) ** 2
+    q11 = r ** 2
+    q01 = -(1.0 - r) * r
+    p = np.full((n, 2), 1.0 / k)
+    active = np.ones(n, dtype=bool)
+
+    for _ in range(max_iter):
+        idx = np.flatnonzero(active)
+        if idx.size == 0:
+            break
+        p0, p1 = p[idx, 0], p[idx, 1]
+        a, b, c = q00[idx], q01[idx], q11[idx]
+        qp0 = a * p0 + b * p1
+        qp1 = b * p0 + c * p1
+        pqp = p0 * qp0 + p1 * qp1
+
+        done = np.maximum(np.abs(qp0 - pqp), np.abs(qp1 - pqp)) < eps
+        active[idx[done]] = False
+        keep = ~done
+        idx = idx[keep]
+        p0, p1 = p0[keep], p1[keep]
+        a, b, c = a[keep], b[keep], c[keep]
+        qp0, qp1, pqp = qp0[keep], qp1[keep], pqp[keep]
+
+        # t = 0
+        diff = (-qp0 + pqp) / a
+        p0 = p0 + diff
+        pqp = (pqp + diff * (diff * a + 2 * qp0)) / (1 + diff) / (1 + diff)
+        qp0 = (qp0 + diff * a) / (1 + diff)
+        qp1 = (qp1 + diff * b) / (1 + diff)
+        p0 = p0 / (1 + diff)
+        p1 = p1 / (1 + diff)
+
+        # t = 1
+        diff = (-qp1 + pqp) / c
+        p1 = p1 + diff
+        p0 = p0 / (1 + diff)
+        p1 = p1 / (1 + diff)
+
+        p[idx, 0] = p0
+        p[idx, 1] = p1
+
+    return p
+
+
+def get_compiled_pipeline(artifacts):
+    """Compiled kernel for this artifact generation, checked against the
+    sklearn pipeline on the training rows or, without them, on sampled
+    inputs (or read from the model bundle); None if unavailable."""
+
+    def _build(artifacts):
+        if not artifacts.ok:
+            return None
+        if artifacts.bundle is not None:
+            # Checked against the estimators when the bundle was written
+            return artifacts.bundle.compiled()
+        try:
+            compiled = CompiledPipeline.from_estimators(
+                artifacts.encoder, artifacts.scaler, artifacts.model,
+                artifacts.selected_features,
+            )
+            if artifacts.data is not None and not artifacts.data.empty:
+                verify_compiled_pipeline(compiled, artifacts, artifacts.data)
+            else:
+                verify_compiled_pipeline(compiled, artifacts, sample_inputs(compiled))
+            return compiled
+        except Exception as e:
+            print(f"[inference] compiled kernel disabled for {artifacts.version}: {e}", flush=True)
+            return None
+
+    return artifacts.cached("compiled_pipeline", _build)
+
+
+def sample_inputs(compiled, rows=512, seed=0):
+    """Random level combinations of the compiled features, for verifying
+    against the pipeline when the training rows are not deployed."""
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        f: lv[rng.integers(0, len(lv), rows)]
+        for f, lv in zip(compiled.features, compiled.levels)
+    })
+
+
+def verify_compiled_pipeline(compiled, artifacts, frame, atol=1e-6):
+    from prediction import pipeline_predict
+
+    preds, probs = pipeline_predict(artifacts, frame)
+    labels, cprobs = compiled.predict_with_proba(frame)
+    if not np.array_equal(labels, preds):
+        raise AssertionError("compiled kernel labels disagree with the model")
+    if cprobs is not None and not np.allclose(cprobs, probs, atol=atol):
+        raise AssertionError("compiled kernel probabilities disagree with the model")
+
+
+def main():
+    import os
+    import time
+
+    import joblib
+    import pandas as pd
+
+    from artifacts import ARTIFACT_FILES, ArtifactRegistry, ArtifactSet, BASE_DIR
+    from prediction import complete_inputs, pipeline_predict
+
+    parser = argparse.ArgumentParser(description="Verify and time the compiled inference kernel.")
+    parser.add_argument("--artifact-dir", default=BASE_DIR)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    artifacts = ArtifactRegistry(base_dir=args.artifact_dir).current()
+    # The kernel the app serves (the bundle's when model.gwpb is present)
+    compiled = get_compiled_pipeline(artifacts)
+    if compiled is None:
+        raise SystemExit(f"no compiled kernel for {args.artifact_dir}: {artifacts.errors}")
+
+    # The sklearn reference always comes from the pickles; a bundle-backed
+    # generation has no estimators loaded
+    loaded = {name: joblib.load(os.path.join(args.artifact_dir, f))
+              for name, f in ARTIFACT_FILES.items()}
+    artifacts = ArtifactSet(
+        artifacts.version, loaded["model"], loaded["scaler"], loaded["encoder"],
+        loaded["selected_features"], artifacts.data, artifacts.full_features,
+        artifacts.default_values, [], artifacts.paths, schema=artifacts.schema,
+    )
+
+    rng = np.random.default_rng(0)
+    batch = pd.DataFrame({
+        f: lv[rng.integers(0, len(lv), args.rows)]
+        for f, lv in zip(compiled.features, compiled.levels)
+    })
+
+    sample = batch.head(20_000)
+    preds, probs = pipeline_predict(artifacts, sample)
+    labels, cprobs = compiled.predict_with_proba(sample)
+    print(f"label agreement:   {np.mean(labels == preds) * 100:.4f}% of {len(sample)} rows")
+    print(f"max |proba diff|:  {np.abs(cprobs - probs).max():.2e}")
+
+    row = complete_inputs(artifacts, artifacts.default_values)
+    n = 200
+    t0 = time.perf_counter()
+    for _ in range(n):
+        pipeline_predict(artifacts, pd.DataFrame([row]))
+    t1 = time.perf_counter()
+    for _ in range(n):
+        compiled.predict_one(row)
+    t2 = time.perf_counter()
+    print(f"single row:        sklearn {(t1 - t0) / n * 1e3:.3f} ms   compiled {(t2 - t1) / n * 1e3:.3f} ms")
+
+    t0 = time.perf_counter()
+    pipeline_predict(artifacts, batch)
+    t1 = time.perf_counter()
+    compiled.predict_with_proba(batch)
+    t2 = time.perf_counter()
+    print(f"{args.rows} rows:  sklearn {t1 - t0:.2f} s   compiled {t2 - t1:.2f} s")
+
+
+if __name__ == "__main__":
+    main()
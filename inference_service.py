@@ -0,0 +1,331 @@
+import argparse
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FutureTimeout
+
+import numpy as np
+
+# -----------------------------------------------------------------------
+# Headless HTTP inference with micro-batching
+#
+# The Streamlit pages rerun a whole script per interaction, which is
+# the wrong shape for other services that want predictions at high QPS.
+# This is a small Flask app over the same artifact registry (hot reload
+# included) and the same scoring path as batch_scoring.score_chunk.
+#
+# Concurrent single-row requests are not scored one by one: each request
+# thread puts its row on a queue and waits on a Future.  One batcher
+# thread takes the first row, keeps collecting until `max_batch` rows or
+# `max_wait_ms` after that first row, builds one frame and scores it in
+# one call, then resolves every waiting request.  Under load the fixed
+# per-call cost (frame construction, encoding, the table gather or the
+# kernel) is paid once per batch instead of once per request; when idle a
+# request waits at most `max_wait_ms`.
+#
+#   POST /predict   {"Soil.Texture": "Clay", ...}           one row
+#                   {"rows": [{...}, {...}]}                 many rows,
+#                                                            scored as one batch
+#   GET  /healthz   model version, batching settings and counters
+#                   (including the prediction memo's, prediction_cache.py)
+#   GET  /metrics   per-stage timing histograms, Prometheus text format
+#                   (see telemetry.py)
+#
+# Rows with a level the model was not trained on get status 422 (single
+# row) or an "error" entry (rows).  Missing predictors are filled with
+# the schema defaults, like the app does.  A body that is not an object
+# of scalar values is rejected with 400 before it reaches the batcher,
+# and if a batch still fails its rows are rescored one at a time, so one
+# bad request cannot fail the others batched with it.  A request whose
+# row is not scored within the batcher timeout gets 503; a scoring failure
+# that is not about the row itself (no model loaded, a broken artifact)
+# gets 500.  Both come back as a JSON {"error": ...} body.
+#
+#     python inference_service.py --port 8000
+#     python inference_service.py bench --clients 32 --seconds 10
+# -----------------------------------------------------------------------
+
+DEFAULT_MAX_BATCH = 256
+DEFAULT_MAX_WAIT_MS = 2.0
+
+
+def score_rows(artifacts, rows):
+    """Score a list of predictor dicts; one result dict per row."""
+    import pandas as pd
+
+    from batch_scoring import PREDICTION_COLUMN, PROBABILITY_COLUMN, score_chunk
+    from prediction import LABELS, complete_frame
+
+    # Per row: a key one row omits would otherwise be NaN when another
+    # row in the batch has it
+    defaults = {col: artifacts.default_values.get(col, "") for col in artifacts.full_features}
+    rows = [{**defaults, **row} for row in rows]
+    frame = complete_frame(artifacts, pd.DataFrame.from_records(rows))
+    scored, _ = score_chunk(artifacts, frame)
+    labels = scored[PREDICTION_COLUMN].to_numpy()
+    high = scored[PROBABILITY_COLUMN].to_numpy()
+
+    results = []
+    for label, p in zip(labels, high):
+        if pd.isna(label):
+            results.append({"error": "input contains a value the model was not trained on"})
+            continue
+        results.append({
+            "label": label,
+            "prediction": 1 if label == LABELS[1] else 0,
+            "probability": {LABELS[1]: float(p), LABELS[0]: float(1.0 - p)},
+            "model_version": artifacts.version,
+        })
+    return results
+
+
+def validate_row(row):
+    """(row with str values, None) or (None, error message).  null values
+    are dropped so the schema default applies."""
+    if not isinstance(row, dict):
+        return None, "expected a JSON object"
+    clean = {}
+    for key, value in row.items():
+        if value is None:
+            continue
+        if isinstance(value, (dict, list)):
+            return None, f"value for {key!r} must be a string or number"
+        clean[key] = str(value)
+    return clean, None
+
+
+class MicroBatcher:
+    def __init__(self, score, max_batch=DEFAULT_MAX_BATCH, max_wait_ms=DEFAULT_MAX_WAIT_MS):
+        self.score = score
+        self.max_batch = max(int(max_batch), 1)
+        self.max_wait = max_wait_ms / 1000.0
+        self.batches = 0
+        self.rows = 0
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="micro-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, row):
+        future = Future()
+        self._queue.put((row, future))
+        return future
+
+    def predict(self, row, timeout=30.0):
+        return self.submit(row).result(timeout)
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0
+                             else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            rows = [row for row, _ in batch]
+            try:
+                results = self.score(rows)
+            except Exception as e:
+                if len(batch) == 1:
+                    batch[0][1].set_exception(e)
+                    continue
+                # Find the row(s) at fault; the rest still get answers
+                for row, future in batch:
+                    try:
+                        future.set_result(self.score([row])[0])
+                    except Exception as row_error:
+                        future.set_exception(row_error)
+                self.batches += len(batch)
+                self.rows += len(batch)
+                continue
+            self.batches += 1
+            self.rows += len(batch)
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
+
+
+def create_app(max_batch=DEFAULT_MAX_BATCH, max_wait_ms=DEFAULT_MAX_WAIT_MS, registry=None):
+    from flask import Flask, jsonify, request
+
+    from artifacts import get_registry
+
+    registry = registry or get_registry()
+    batcher = MicroBatcher(lambda rows: score_rows(registry.current(), rows),
+                           max_batch=max_batch, max_wait_ms=max_wait_ms)
+    app = Flask(__name__)
+    app.config["batcher"] = batcher
+
+    @app.post("/predict")
+    def predict():
+        body = request.get_json(silent=True)
+        if not isinstance(body, dict):
+            return jsonify(error="expected a JSON object"), 400
+        if "rows" in body:
+            rows = body["rows"]
+            if not isinstance(rows, list):
+                return jsonify(error="'rows' must be a list of objects"), 400
+            clean = []
+            for i, row in enumerate(rows):
+                row, error = validate_row(row)
+                if error:
+                    return jsonify(error=f"rows[{i}]: {error}"), 400
+                clean.append(row)
+            if not clean:
+                return jsonify(results=[])
+            try:
+                return jsonify(results=score_rows(registry.current(), clean))
+            except Exception as e:
+                return jsonify(error=f"scoring failed: {e.__class__.__name__}: {e}"), 500
+
+        row, error = validate_row(body)
+        if error:
+            return jsonify(error=error), 400
+        try:
+            result = batcher.predict(row)
+        except FutureTimeout:
+            return jsonify(error="timed out waiting for the batcher"), 503
+        except Exception as e:
+            return jsonify(error=f"scoring failed: {e.__class__.__name__}: {e}"), 500
+        return jsonify(result), (422 if "error" in result else 200)
+
+    @app.get("/healthz")
+    def healthz():
+        from prediction_cache import get_prediction_memo
+
+        artifacts = registry.current()
+        return jsonify(
+            ok=artifacts.ok and artifacts.has_model,
+            model_version=artifacts.version,
+            max_batch=batcher.max_batch,
+            max_wait_ms=batcher.max_wait * 1000.0,
+            batches=batcher.batches,
+            rows=batcher.rows,
+            prediction_cache=get_prediction_memo().stats(),
+        )
+
+    @app.get("/metrics")
+    def metrics():
+        from telemetry import get_telemetry
+
+        return get_telemetry().prometheus_text(), 200, {"Content-Type": "text/plain; version=0.0.4"}
+
+    return app
+
+
+# ===============================
+# Load generator
+# ===============================
+def _serve_in_thread(app):
+    import logging
+
+    from werkzeug.serving import make_server
+
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)  # no per-request log lines
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+
+def generate_load(url, rows, clients, seconds):
+    """`clients` threads, each posting one row at a time in a loop with a
+    keep-alive session; returns throughput and latency percentiles."""
+    import requests
+
+    latencies = [[] for _ in range(clients)]
+    errors = [0] * clients
+    stop = time.monotonic() + seconds
+
+    def _client(i):
+        session = requests.Session()
+        rng = np.random.default_rng(i)
+        while time.monotonic() < stop:
+            row = rows[rng.integers(len(rows))]
+            t0 = time.perf_counter()
+            resp = session.post(f"{url}/predict", json=row)
+            latencies[i].append(time.perf_counter() - t0)
+            if resp.status_code != 200:
+                errors[i] += 1
+
+    threads = [threading.Thread(target=_client, args=(i,)) for i in range(clients)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+
+    lat = np.concatenate([np.asarray(x) for x in latencies]) * 1e3
+    return {
+        "requests": int(lat.size),
+        "errors": int(sum(errors)),
+        "qps": lat.size / elapsed,
+        "p50_ms": float(np.percentile(lat, 50)),
+        "p99_ms": float(np.percentile(lat, 99)),
+    }
+
+
+def bench(clients, seconds, max_batch, max_wait_ms):
+    from artifacts import get_registry
+
+    artifacts = get_registry().current()
+    levels = artifacts.schema.levels
+    rng = np.random.default_rng(0)
+    rows = [
+        {f: levels[f][rng.integers(len(levels[f]))] for f in artifacts.selected_features}
+        for _ in range(1000)
+    ]
+
+    results = {}
+    for label, batch, wait in (("one request, one predict", 1, 0.0),
+                               ("micro-batched", max_batch, max_wait_ms)):
+        app = create_app(max_batch=batch, max_wait_ms=wait)
+        server, url = _serve_in_thread(app)
+        try:
+            generate_load(url, rows, clients, min(seconds, 1.0))  # warm-up
+            batcher = app.config["batcher"]
+            b0, r0 = batcher.batches, batcher.rows
+            stats = generate_load(url, rows, clients, seconds)
+            stats["mean_batch"] = (batcher.rows - r0) / max(batcher.batches - b0, 1)
+            results[label] = stats
+        finally:
+            server.shutdown()
+
+    for label, s in results.items():
+        print(f"{label:26s} {s['qps']:8.0f} req/s   p50 {s['p50_ms']:6.2f} ms   "
+              f"p99 {s['p99_ms']:6.2f} ms   mean batch {s['mean_batch']:6.1f}   "
+              f"errors {s['errors']}")
+    base, batched = results.values()
+    print(f"throughput gain: {batched['qps'] / max(base['qps'], 1e-9):.2f}x "
+          f"with {clients} concurrent clients")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-batching HTTP inference service.")
+    parser.add_argument("command", nargs="?", choices=["serve", "bench"], default="serve")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--max-batch", type=int, default=DEFAULT_MAX_BATCH)
+    parser.add_argument("--max-wait-ms", type=float, default=DEFAULT_MAX_WAIT_MS)
+    parser.add_argument("--clients", type=int, default=32, help="bench: concurrent clients")
+    parser.add_argument("--seconds", type=float, default=5.0, help="bench: duration per mode")
+    args = parser.parse_args()
+
+    if args.command == "bench":
+        bench(args.clients, args.seconds, args.max_batch, args.max_wait_ms)
+        return
+
+    app = create_app(max_batch=args.max_batch, max_wait_ms=args.max_wait_ms)
+    app.run(host=args.host, port=args.port, threaded=True)
+
+
+if __name__ == "__main__":
+    main()
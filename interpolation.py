@@ -0,0 +1,502 @@
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from raster_mapping import iter_tiles
+from spatial_index import KM_PER_DEG
+
+# -----------------------------------------------------------------------
+# Continuous potential surface by spatial interpolation
+#
+# Scored points (a P(High) from predict_proba, or a surveyed 0/1 outcome)
+# are scattered markers; planning wants a surface.  interpolate() fills a
+# regular lat/lon grid from the points with
+#
+#   idw      inverse-distance weighting over the k nearest points
+#   kriging  ordinary kriging over the k nearest points (a moving
+#            neighbourhood) with a spherical / exponential / gaussian
+#            variogram fitted to the points; also returns the kriging
+#            variance
+#
+# Distances are in km on a local equirectangular projection about the
+# grid's centre latitude - accurate for the regional grids this is meant
+# for.
+#
+# The grid is cut into tiles (raster_mapping.iter_tiles).  For each tile
+# the cell centres are queried against one cKDTree of the points in a
+# single vectorized call, giving a (cells, k) block of neighbours; IDW is
+# then a weighted row average and kriging one batched np.linalg.solve of
+# the (k+1) x (k+1) systems of every cell.  Nothing loops over points x
+# cells, and memory is bounded by the tile, not the grid.
+#
+# Tiles run on a thread pool.  Unlike raster_mapping the work is in
+# cKDTree.query and LAPACK, which release the GIL, so threads scale
+# without spawning processes and the result is written straight into the
+# output arrays.
+#
+# surface_image() colours a surface (NaN transparent) and add_overlay()
+# puts it on a Folium map as an ImageOverlay.  The Predict page draws
+# local_surface() - the points of the spatial index (spatial_index.py)
+# around the detected location, less the session's own predictions and
+# with at least three distinct locations - when "Potential surface" is
+# on.
+#
+#     python interpolation.py scored_points.csv surface/ --method kriging --cells 512 --html surface.html
+#     python interpolation.py --bench --points 100000 --cells 1024
+# -----------------------------------------------------------------------
+
+DEFAULT_TILE = 128
+DEFAULT_NEIGHBOURS = 12
+DEFAULT_POWER = 2.0
+METHODS = ("idw", "kriging")
+VARIOGRAM_MODELS = ("spherical", "exponential", "gaussian")
+
+SURFACE_FILE = "surface.npy"
+VARIANCE_FILE = "variance.npy"
+
+# P(High) 0 -> 0.5 -> 1: red, amber, green (the app's Low / High colours)
+COLOUR_STOPS = np.array([[198, 40, 40], [255, 179, 0], [46, 125, 50]], dtype=np.float64)
+
+
+# ===============================
+# Grid
+# ===============================
+class Grid:
+    """rows x cols cells over [south, north] x [west, east]; row 0 is the
+    northern edge, so a surface is an image the right way up."""
+
+    def __init__(self, south, west, north, east, rows, cols):
+        if not (north > south and east > west and rows > 0 and cols > 0):
+            raise ValueError("Empty grid")
+        self.south, self.west, self.north, self.east = map(float, (south, west, north, east))
+        self.rows, self.cols = int(rows), int(cols)
+
+    @property
+    def shape(self):
+        return self.rows, self.cols
+
+    @property
+    def bounds(self):
+        """[[south, west], [north, east]], as folium wants it."""
+        return [[self.south, self.west], [self.north, self.east]]
+
+    def centres(self, r0, r1, c0, c1):
+        """(lats, lons) of the cell centres of a window, row-major."""
+        dlat = (self.north - self.south) / self.rows
+        dlon = (self.east - self.west) / self.cols
+        lats = self.north - (np.arange(r0, r1) + 0.5) * dlat
+        lons = self.west + (np.arange(c0, c1) + 0.5) * dlon
+        return np.repeat(lats, c1 - c0), np.tile(lons, r1 - r0)
+
+    @classmethod
+    def around(cls, lat, lon, radius_km, cells=128):
+        dlat = radius_km / KM_PER_DEG
+        dlon = radius_km / (KM_PER_DEG * max(np.cos(np.radians(lat)), 1e-6))
+        return cls(lat - dlat, lon - dlon, lat + dlat, lon + dlon, cells, cells)
+
+    @classmethod
+    def covering(cls, lats, lons, cells=512, pad=0.05):
+        """A grid over the points' bounding box (padded by `pad` of its
+        size), `cells` along the longer side."""
+        south, north = float(np.min(lats)), float(np.max(lats))
+        west, east = float(np.min(lons)), float(np.max(lons))
+        dy = max(north - south, 1e-3) * pad
+        dx = max(east - west, 1e-3) * pad
+        south, north, west, east = south - dy, north + dy, west - dx, east + dx
+        coslat = np.cos(np.radians((south + north) / 2.0))
+        height, width = north - south, (east - west) * coslat
+        rows = max(1, int(round(cells * min(height / width, 1.0))))
+        cols = max(1, int(round(cells * min(width / height, 1.0))))
+        return cls(south, west, north, east, rows, cols)
+
+    def manifest(self):
+        return {"south": self.south, "west": self.west, "north": self.north,
+                "east": self.east, "rows": self.rows, "cols": self.cols}
+
+
+class _Projection:
+    # Equirectangular km about a reference latitude
+    def __init__(self, lat0):
+        self.kx = KM_PER_DEG * np.cos(np.radians(lat0))
+
+    def __call__(self, lats, lons):
+        return np.column_stack([np.asarray(lons, dtype=np.float64) * self.kx,
+                                np.asarray(lats, dtype=np.float64) * KM_PER_DEG])
+
+
+# ===============================
+# Variogram
+# ===============================
+class Variogram:
+    def __init__(self, model="spherical", nugget=0.0, sill=1.0, range_km=10.0):
+        if model not in VARIOGRAM_MODELS:
+            raise ValueError(f"Unknown variogram model: {model}")
+        self.model = model
+        self.nugget = float(nugget)
+        self.sill = float(sill)  # partial sill
+        self.range_km = max(float(range_km), 1e-9)
+
+    def __call__(self, h):
+        h = np.asarray(h, dtype=np.float64)
+        r = h / self.range_km
+        if self.model == "spherical":
+            g = np.where(r < 1.0, 1.5 * r - 0.5 * r ** 3, 1.0)
+        elif self.model == "exponential":
+            g = 1.0 - np.exp(-3.0 * r)
+        else:
+            g = 1.0 - np.exp(-3.0 * r ** 2)
+        return np.where(h > 0, self.nugget + self.sill * g, 0.0)
+
+    def __repr__(self):
+        return (f"Variogram({self.model!r}, nugget={self.nugget:.4g}, "
+                f"sill={self.sill:.4g}, range_km={self.range_km:.4g})")
+
+    @classmethod
+    def fit(cls, xy, values, model="spherical", lags=15, max_points=2000, seed=0):
+        """Weighted least-squares fit to the empirical semivariogram of
+        (a random sample of) the points."""
+        from scipy.optimize import curve_fit
+        from scipy.spatial.distance import pdist
+
+        n = len(values)
+        variance = float(np.var(values)) or 1e-6
+        if n > max_points:
+            pick = np.random.default_rng(seed).choice(n, max_points, replace=False)
+            xy, values = xy[pick], values[pick]
+        if len(values) < 4:
+            return cls(model, 0.0, variance, 1.0)
+
+        d = pdist(xy)
+        g = 0.5 * pdist(values[:, None], "sqeuclidean")
+        cutoff = d.max() / 2.0 or 1.0
+        edges = np.linspace(0.0, cutoff, lags + 1)
+        which = np.digitize(d, edges) - 1
+        inside = (which >= 0) & (which < lags)
+        counts = np.bincount(which[inside], minlength=lags)
+        sums = np.bincount(which[inside], weights=g[inside], minlength=lags)
+        h_sum = np.bincount(which[inside], weights=d[inside], minlength=lags)
+        ok = counts > 0
+        h, gamma, w = h_sum[ok] / counts[ok], sums[ok] / counts[ok], counts[ok]
+
+        default = cls(model, 0.0, variance, cutoff / 2.0)
+        if len(h) < 3:
+            return default
+
+        def _model(h, nugget, sill, range_km):
+            return cls(model, nugget, sill, range_km)(h)
+
+        try:
+            params, _ = curve_fit(
+                _model, h, gamma, p0=[0.0, variance, cutoff / 2.0],
+                bounds=([0.0, 1e-9, cutoff / (10.0 * lags)], [2.0 * variance, 4.0 * variance, 2.0 * cutoff]),
+                sigma=1.0 / np.sqrt(w), maxfev=5000,
+            )
+        except (RuntimeError, ValueError):
+            return default
+        return cls(model, *params)
+
+
+# ===============================
+# Interpolation
+# ===============================
+class Surface:
+    def __init__(self, grid, values, variance=None, method="idw", points=0, variogram=None,
+                 seconds=None):
+        self.grid = grid
+        self.values = values
+        self.variance = variance
+        self.method = method
+        self.points = points
+        self.variogram = variogram
+        self.seconds = seconds
+
+
+def _merge_duplicates(xy, values):
+    # Coincident points make the kriging system singular; average them.
+    uniq, inverse, counts = np.unique(xy, axis=0, return_inverse=True, return_counts=True)
+    if len(uniq) == len(xy):
+        return xy, values
+    sums = np.bincount(inverse.ravel(), weights=values, minlength=len(uniq))
+    return uniq, sums / counts
+
+
+def _idw(dist, z, power):
+    exact = dist[:, 0] <= 1e-9
+    with np.errstate(divide="ignore"):
+        w = 1.0 / dist ** power
+    w[exact] = 0.0
+    w[exact, 0] = 1.0
+    return (w * z).sum(axis=1) / w.sum(axis=1)
+
+
+def _kriging(dist, idx, z, xy, variogram):
+    n, k = idx.shape
+    p = xy[idx]                                             # (n, k, 2)
+    between = np.linalg.norm(p[:, :, None, :] - p[:, None, :, :], axis=-1)
+    A = np.ones((n, k + 1, k + 1))
+    A[:, :k, :k] = variogram(between)
+    A[:, k, k] = 0.0
+    # Tiny diagonal term against near-singular systems (points far
+    # closer together than the variogram range)
+    A[:, np.arange(k), np.arange(k)] -= 1e-10 * (variogram.sill + variogram.nugget)
+    b = np.ones((n, k + 1))
+    b[:, :k] = variogram(dist)
+    sol = np.linalg.solve(A, b[:, :, None])[:, :, 0]
+    weights, mu = sol[:, :k], sol[:, k]
+    estimate = (weights * z).sum(axis=1)
+    variance = np.maximum((weights * b[:, :k]).sum(axis=1) + mu, 0.0)
+    return estimate, variance
+
+
+def interpolate(lats, lons, values, grid, method="idw", k=DEFAULT_NEIGHBOURS, power=DEFAULT_POWER,
+                max_km=None, variogram=None, variogram_model="spherical", tile=DEFAULT_TILE,
+                workers=None, clip=(0.0, 1.0), progress=None):
+    """Surface over `grid` from point `values` at (lats, lons).
+
+    Cells further than `max_km` from every point are NaN.  For kriging,
+    `variogram` defaults to one fitted to the points.  Estimates are
+    clipped to `clip` (probabilities by default; None to leave them).
+    workers=0 runs the tiles in this thread.
+    """
+    from scipy.spatial import cKDTree
+
+    if method not in METHODS:
+        raise ValueError(f"Unknown interpolation method: {method}")
+    values = np.asarray(values, dtype=np.float64)
+    keep = np.isfinite(values) & np.isfinite(lats) & np.isfinite(lons)
+    if not keep.any():
+        raise ValueError("No points with a value to interpolate")
+    project = _Projection((grid.south + grid.north) / 2.0)
+    xy, z = _merge_duplicates(project(np.asarray(lats)[keep], np.asarray(lons)[keep]), values[keep])
+    k = max(1, min(int(k), len(z)))
+    tree = cKDTree(xy)
+    if method == "kriging" and variogram is None:
+        variogram = Variogram.fit(xy, z, model=variogram_model)
+
+    out = np.full(grid.shape, np.nan, dtype=np.float32)
+    var = np.full(grid.shape, np.nan, dtype=np.float32) if method == "kriging" else None
+
+    def _tile(r0, r1, c0, c1):
+        cells = project(*grid.centres(r0, r1, c0, c1))
+        dist, idx = tree.query(cells, k=k)
+        if k == 1:
+            dist, idx = dist[:, None], idx[:, None]
+        reach = np.ones(len(cells), dtype=bool) if max_km is None else dist[:, 0] <= max_km
+        est = np.full(len(cells), np.nan)
+        if reach.any():
+            d, i = dist[reach], idx[reach]
+            if method == "idw":
+                est[reach] = _idw(d, z[i], power)
+            else:
+                e, v = _kriging(d, i, z[i], xy, variogram)
+                est[reach] = e
+                vv = np.full(len(cells), np.nan)
+                vv[reach] = v
+                var[r0:r1, c0:c1] = vv.reshape(r1 - r0, c1 - c0)
+        if clip is not None:
+            est = np.clip(est, *clip)
+        out[r0:r1, c0:c1] = est.reshape(r1 - r0, c1 - c0)
+
+    tiles = list(iter_tiles(grid.shape, tile))
+    start = time.perf_counter()
+    if workers == 0 or len(tiles) == 1:
+        for done, t in enumerate(tiles, 1):
+            _tile(*t)
+            if progress is not None:
+                progress(done, len(tiles))
+    else:
+        with ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1) as pool:
+            for done, _ in enumerate(pool.map(lambda t: _tile(*t), tiles), 1):
+                if progress is not None:
+                    progress(done, len(tiles))
+    return Surface(grid, out, var, method=method, points=len(z), variogram=variogram,
+                   seconds=time.perf_counter() - start)
+
+
+# ===============================
+# Rendering
+# ===============================
+def surface_image(values, vmin=0.0, vmax=1.0, alpha=200):
+    """RGBA uint8 image of a surface on the red-amber-green ramp; NaN
+    cells are transparent."""
+    t = np.clip((np.asarray(values, dtype=np.float64) - vmin) / max(vmax - vmin, 1e-12), 0.0, 1.0)
+    pos = np.nan_to_num(t) * (len(COLOUR_STOPS) - 1)
+    lo = np.minimum(pos.astype(np.int64), len(COLOUR_STOPS) - 2)
+    frac = (pos - lo)[..., None]
+    rgb = COLOUR_STOPS[lo] * (1.0 - frac) + COLOUR_STOPS[lo + 1] * frac
+    image = np.empty(t.shape + (4,), dtype=np.uint8)
+    image[..., :3] = np.round(rgb).astype(np.uint8)
+    image[..., 3] = np.where(np.isnan(t), 0, alpha)
+    return image
+
+
+def add_overlay(m, surface, opacity=0.6, name=None):
+    """Add `surface` to folium map `m` as an ImageOverlay, with a legend."""
+    import branca.colormap as cm
+    import folium
+
+    folium.raster_layers.ImageOverlay(
+        image=surface_image(surface.values),
+        bounds=surface.grid.bounds,
+        opacity=opacity,
+        mercator_project=True,
+        name=name or f"P(High) surface ({surface.method})",
+    ).add_to(m)
+    legend = cm.LinearColormap([tuple(int(c) for c in s) for s in COLOUR_STOPS],
+                               vmin=0.0, vmax=1.0, caption="P(High Potential)")
+    legend.add_to(m)
+    return m
+
+
+def surface_points(index, lat, lon, radius_km, exclude=()):
+    """(lats, lons, values) of the spatial_index points within `radius_km`,
+    one per distinct location (coincident points averaged): earlier
+    predictions contribute their P(High), surveyed points their 0/1
+    outcome.  Predictions whose time is in `exclude` (the caller's own)
+    are left out."""
+    from spatial_index import OBSERVATION, PREDICTION, exclude_own
+
+    obs, _ = index.within(lat, lon, radius_km, kind=OBSERVATION)
+    preds, _ = exclude_own(*index.within(lat, lon, radius_km, kind=PREDICTION), exclude)
+    obs = obs[obs["label"] >= 0]
+    preds = preds[np.isfinite(preds["prob"])]
+    latlon = np.column_stack([np.concatenate([obs["lat"], preds["lat"]]),
+                              np.concatenate([obs["lon"], preds["lon"]])])
+    values = np.concatenate([obs["label"].astype(np.float64), preds["prob"].astype(np.float64)])
+    latlon, values = _merge_duplicates(latlon, values)
+    return latlon[:, 0], latlon[:, 1], values
+
+
+def local_surface(index, lat, lon, radius_km=10.0, cells=128, method="idw", min_points=3,
+                  exclude=()):
+    """Surface over the square of half-width `radius_km` around (lat, lon)
+    from the indexed points in it, other than the caller's own
+    predictions (`exclude`), or None with fewer than `min_points` distinct
+    locations."""
+    lats, lons, values = surface_points(index, lat, lon, radius_km * np.sqrt(2.0), exclude)
+    if len(values) < min_points:
+        return None
+    return interpolate(lats, lons, values, Grid.around(lat, lon, radius_km, cells),
+                       method=method, workers=0)
+
+
+# ===============================
+# CLI
+# ===============================
+def _bench(args):
+    rng = np.random.default_rng(0)
+    lats = rng.uniform(-22.4, -15.6, args.points)
+    lons = rng.uniform(25.2, 33.1, args.points)
+    values = 0.5 + 0.4 * np.sin(lats * 2.0) * np.cos(lons * 1.5) + rng.normal(0, 0.05, args.points)
+    grid = Grid.covering(lats, lons, cells=args.cells)
+    print(f"{args.points:,} points -> {grid.rows} x {grid.cols} grid")
+
+    # The O(points x cells) baseline, on a slice small enough to finish
+    small = Grid(grid.south, grid.west, grid.north, grid.east, 32, 32)
+    project = _Projection((grid.south + grid.north) / 2.0)
+    xy = project(lats, lons)
+    t0 = time.perf_counter()
+    cells = project(*small.centres(0, 32, 0, 32))
+    brute = np.empty(len(cells))
+    for i, c in enumerate(cells):
+        d = np.hypot(*(xy - c).T)
+        nn = np.argsort(d)[:args.k]
+        brute[i] = _idw(d[nn][None, :], values[nn][None, :], DEFAULT_POWER)[0]
+    per_cell = (time.perf_counter() - t0) / len(cells)
+    tiled = interpolate(lats, lons, values, small, k=args.k, clip=None, workers=0)
+    print(f"brute force idw          {per_cell * grid.rows * grid.cols:8.2f} s (extrapolated), "
+          f"matches tiled: {np.allclose(tiled.values.ravel(), brute, atol=1e-5)}")
+
+    for method in METHODS:
+        for workers in (0, None):
+            s = interpolate(lats, lons, values, grid, method=method, k=args.k, workers=workers)
+            label = "1 thread" if workers == 0 else f"{os.cpu_count()} threads"
+            print(f"{method:8s} tiled, {label:10s} {s.seconds:8.2f} s")
+        if method == "kriging":
+            print(f"  {s.variogram}")
+
+
+def main():
+    import pandas as pd
+
+    parser = argparse.ArgumentParser(description="Interpolate scored points into a P(High) surface.")
+    parser.add_argument("input", nargs="?", help="CSV with latitude, longitude and a value column")
+    parser.add_argument("out_dir", nargs="?")
+    parser.add_argument("--value", default=None,
+                        help="value column (default: the High.Potential.Probability column)")
+    parser.add_argument("--method", choices=METHODS, default="idw")
+    parser.add_argument("--variogram", choices=VARIOGRAM_MODELS, default="spherical")
+    parser.add_argument("--cells", type=int, default=512, help="cells along the longer side")
+    parser.add_argument("--k", type=int, default=DEFAULT_NEIGHBOURS, help="neighbours per cell")
+    parser.add_argument("--power", type=float, default=DEFAULT_POWER, help="IDW power")
+    parser.add_argument("--max-km", type=float, default=None, help="leave cells further than this empty")
+    parser.add_argument("--tile", type=int, default=DEFAULT_TILE)
+    parser.add_argument("--workers", type=int, default=None, help="0 = run in this thread")
+    parser.add_argument("--html", help="also write a Folium map with the surface overlay")
+    parser.add_argument("--bench", action="store_true")
+    parser.add_argument("--points", type=int, default=100_000, help="--bench: synthetic points")
+    args = parser.parse_args()
+
+    if args.bench:
+        _bench(args)
+        return
+    if not args.input or not args.out_dir:
+        parser.error("input and out_dir are required")
+
+    from batch_scoring import PROBABILITY_COLUMN
+    from bulk_scoring import coordinate_columns
+
+    frame = pd.read_csv(args.input)
+    lat_col, lon_col = coordinate_columns(frame)
+    value_col = args.value or PROBABILITY_COLUMN
+    lats = frame[lat_col].to_numpy(dtype=float)
+    lons = frame[lon_col].to_numpy(dtype=float)
+    grid = Grid.covering(lats, lons, cells=args.cells)
+
+    def _progress(done, total):
+        sys.stderr.write(f"\r[surface] tile {done}/{total}")
+        sys.stderr.flush()
+
+    surface = interpolate(lats, lons, frame[value_col].to_numpy(dtype=float), grid,
+                          method=args.method, k=args.k, power=args.power, max_km=args.max_km,
+                          variogram_model=args.variogram, tile=args.tile, workers=args.workers,
+                          progress=_progress)
+    sys.stderr.write("\n")
+
+    os.makedirs(args.out_dir, exist_ok=True)
+    np.save(os.path.join(args.out_dir, SURFACE_FILE), surface.values)
+    if surface.variance is not None:
+        np.save(os.path.join(args.out_dir, VARIANCE_FILE), surface.variance)
+    with open(os.path.join(args.out_dir, "surface.json"), "w") as fh:
+        json.dump({
+            "grid": grid.manifest(),
+            "method": surface.method,
+            "points": surface.points,
+            "value": value_col,
+            "surface": SURFACE_FILE,
+            "variance": VARIANCE_FILE if surface.variance is not None else None,
+            "variogram": repr(surface.variogram) if surface.variogram is not None else None,
+            "seconds": surface.seconds,
+        }, fh, indent=2)
+    if args.html:
+        import folium
+
+        from tile_cache import tile_layer
+
+        # Not the local tile server: it exits with this command
+        tiles, attr = tile_layer(serve=False)
+        m = folium.Map(tiles=tiles, attr=attr)
+        add_overlay(m, surface)
+        m.fit_bounds(grid.bounds)
+        m.save(args.html)
+    print(f"{surface.method} surface {grid.rows} x {grid.cols} from {surface.points:,} points "
+          f"in {surface.seconds:.2f}s -> {args.out_dir}")
+
+
+if __name__ == "__main__":
+    main()
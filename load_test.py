@@ -0,0 +1,524 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+# -----------------------------------------------------------------------
+# Concurrent-session load harness for app.py
+#
+# Starts one real `streamlit run app.py` worker and connects N
+# stand-in browser clients to it over the websocket the frontend uses
+# (/_stcore/stream, BackMsg / ForwardMsg protobufs, tornado's client).
+# Every session gets its own script thread in the worker, so the N of
+# them share its GIL, the ArtifactRegistry generation, the geocoder and
+# its cache, the spatial index and the telemetry histograms, just as N
+# visitors would.  AppTest is not used here: it swaps the process-wide
+# Runtime instance in and out around each run, so two AppTests cannot
+# run at the same time in one process.
+#
+# Each client walks the Predict page the way a visitor does:
+#
+#   start    first run of the script (Home)
+#   page     sidebar -> Predict
+#   detect   "Detect My Location" (the component is now prompting)
+#   fix      the geolocation component reports a fix, as the browser
+#            does once location access is allowed: a random point in
+#            BBOX, seeded per session
+#   select   one predictor selectbox changed            (x --changes)
+#   predict  "Predict Potential"                        (x --iterations,
+#                                                        each after its
+#                                                        selects)
+#   fragment the address_pending poll, sent like the browser's
+#            auto-rerun while it is on the page and due
+#
+# Reverse geocoding uses the offline backend over a grid of generated
+# boundary rectangles (see geocoding.py), with the geocode cache and the
+# spatial index in a temporary directory: nothing leaves the machine
+# and the repo's files are untouched.
+#
+# Each N gets a fresh worker.  By default one untimed session warms it
+# first, so the numbers are a worker already serving; --cold starts all
+# N together instead, racing the imports and the artifact load.
+# Reported per N:
+#
+#   latency      BackMsg sent -> script_finished received, p50/p95/p99/
+#                max, overall and per step
+#   throughput   reruns/s and predictions/s over the timed window
+#   memory       worker RSS growth / N with every session still
+#                connected (Linux; relative to after the warm-up, so
+#                with --cold it includes the shared artifact load)
+#   stages       the worker's own telemetry spans (telemetry.py, scraped
+#                from GWP_METRICS_PORT) for the timed window, showing
+#                which shared stage degrades
+#
+#     python load_test.py                          # N = 1 2 4 8
+#     python load_test.py --sessions 1 4 16 --iterations 5 --think-ms 500
+#     python load_test.py --index spatial_index.bin --stages --json
+#
+# Exits 1 if any session saw an exception or a System Error, or if
+# --p95-budget-ms is given and the smallest N is already over it.
+# -----------------------------------------------------------------------
+
+APP = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+
+DEFAULT_SESSIONS = [1, 2, 4, 8]
+
+# Zimbabwe, roughly; fixes are drawn inside and the offline boundaries
+# tile it
+BBOX = (-22.4, 25.3, -15.7, 33.0)  # south, west, north, east
+BOUNDARY_GRID = 4
+
+STEPS = ["start", "page", "detect", "fix", "select", "predict", "fragment"]
+
+# ScriptFinishedStatus values that end a rerun (FINISHED_EARLY_FOR_RERUN
+# is followed by the run that replaced it)
+FINISHED = {0, 1, 3}
+
+STARTUP_TIMEOUT = 120
+
+
+def write_boundaries(path, bbox=BBOX, grid=BOUNDARY_GRID):
+    """GeoJSON of grid x grid rectangles over bbox for the offline geocoder."""
+    south, west, north, east = bbox
+    dlat, dlon = (north - south) / grid, (east - west) / grid
+    features = []
+    for r in range(grid):
+        for c in range(grid):
+            s, w = south + r * dlat, west + c * dlon
+            ring = [[w, s], [w + dlon, s], [w + dlon, s + dlat], [w, s + dlat], [w, s]]
+            features.append({
+                "type": "Feature",
+                "properties": {"country": "Zimbabwe", "state": f"Region {r}", "city": f"District {r}-{c}"},
+                "geometry": {"type": "Polygon", "coordinates": [ring]},
+            })
+    with open(path, "w") as fh:
+        json.dump({"type": "FeatureCollection", "features": features}, fh)
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _rss_mb(pid):
+    try:
+        with open(f"/proc/{pid}/statm") as fh:
+            return int(fh.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def _percentiles(values):
+    import numpy as np
+
+    if not values:
+        return {"count": 0}
+    ms = np.asarray(values) * 1e3
+    return {"count": len(values), "p50_ms": float(np.percentile(ms, 50)),
+            "p95_ms": float(np.percentile(ms, 95)), "p99_ms": float(np.percentile(ms, 99)),
+            "max_ms": float(ms.max())}
+
+
+# ===============================
+# Worker
+# ===============================
+class Worker:
+    """A `streamlit run app.py` subprocess with the offline geocoder and
+    its own temporary geocode cache, spatial index and metrics port."""
+
+    def __init__(self, index=None):
+        self.workdir = tempfile.mkdtemp(prefix="gwp_load_")
+        boundaries = os.path.join(self.workdir, "boundaries.geojson")
+        write_boundaries(boundaries)
+        index_path = os.path.join(self.workdir, "spatial_index.bin")
+        if index:
+            shutil.copyfile(index, index_path)
+        self.port, self.metrics_port = _free_port(), _free_port()
+        env = dict(os.environ,
+                   GWP_GEOCODER="offline",
+                   GWP_GEOCODER_BOUNDARIES=boundaries,
+                   GWP_GEOCODE_CACHE=os.path.join(self.workdir, "geocode_cache.sqlite"),
+                   GWP_SPATIAL_INDEX=index_path,
+                   GWP_METRICS_PORT=str(self.metrics_port))
+        self.log_path = os.path.join(self.workdir, "worker.log")
+        self._log = open(self.log_path, "w")
+        self.proc = subprocess.Popen(
+            [sys.executable, "-m", "streamlit", "run", APP,
+             "--server.headless", "true", "--server.address", "127.0.0.1",
+             "--server.port", str(self.port), "--server.fileWatcherType", "none",
+             "--browser.gatherUsageStats", "false"],
+            env=env, stdout=self._log, stderr=subprocess.STDOUT,
+            cwd=os.path.dirname(APP),
+        )
+        self.url = f"ws://127.0.0.1:{self.port}/_stcore/stream"
+        deadline = time.perf_counter() + STARTUP_TIMEOUT
+        while True:
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{self.port}/_stcore/health", timeout=2):
+                    break
+            except OSError:
+                if self.proc.poll() is not None or time.perf_counter() > deadline:
+                    log = self.log()
+                    self.close()
+                    raise RuntimeError(f"streamlit did not start:\n{log}")
+                time.sleep(0.2)
+
+    @property
+    def rss_mb(self):
+        return _rss_mb(self.proc.pid)
+
+    def log(self, tail=2000):
+        with open(self.log_path) as fh:
+            return fh.read()[-tail:]
+
+    def metrics(self):
+        """{stage: (count, sum seconds, [(le, cumulative count)])} from /metrics.
+        The side port starts with the first script run, so it can be empty."""
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{self.metrics_port}/metrics", timeout=5) as r:
+                text = r.read().decode()
+        except OSError:
+            return {}
+        stages = {}
+        pattern = re.compile(r'gwp_stage_duration_seconds_(bucket|sum|count)\{stage="([^"]+)"(?:,le="([^"]+)")?\} (\S+)')
+        for kind, stage, le, value in pattern.findall(text):
+            entry = stages.setdefault(stage, [0, 0.0, []])
+            if kind == "bucket":
+                entry[2].append((float(le), float(value)))
+            elif kind == "sum":
+                entry[1] = float(value)
+            else:
+                entry[0] = int(value)
+        return {k: tuple(v) for k, v in stages.items()}
+
+    def close(self):
+        if self.proc.poll() is None:
+            self.proc.terminate()
+            try:
+                self.proc.wait(10)
+            except subprocess.TimeoutExpired:
+                self.proc.kill()
+                self.proc.wait()
+        self._log.close()
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+
+def stage_summary(before, after):
+    """Per-stage count, mean and p95 (bucket upper bound) between two scrapes."""
+    out = {}
+    for stage, (n, total, buckets) in sorted(after.items()):
+        n0, total0, buckets0 = before.get(stage, (0, 0.0, []))
+        n -= n0
+        if n <= 0:
+            continue
+        prior = dict(buckets0)
+        p95 = None
+        for le, c in buckets:
+            if c - prior.get(le, 0) >= 0.95 * n:
+                p95 = le
+                break
+        out[stage] = {"count": n, "mean_ms": (total - total0) / n * 1e3,
+                      "p95_le_ms": None if p95 is None or p95 == float("inf") else p95 * 1e3}
+    return out
+
+
+# ===============================
+# Client
+# ===============================
+class Session:
+    """One stand-in browser tab: sends reruns with its widget states and
+    keeps the elements of the last run, keyed by delta path."""
+
+    def __init__(self, number, seed, changes=2, iterations=3, think_ms=0.0, timeout=300):
+        self.number = number
+        self.rng = random.Random(f"{seed}-{number}")
+        self.changes = changes
+        self.iterations = iterations
+        self.think_ms = think_ms
+        self.timeout = timeout
+        south, west, north, east = BBOX
+        self.fix = (self.rng.uniform(south, north), self.rng.uniform(west, east))
+        self.elements = {}
+        self.widgets = {}  # id -> WidgetState, resent on every rerun like the frontend
+        self.auto_rerun = {}  # fragment id -> (interval, next due)
+        self.timings = []  # (step, seconds)
+        self.errors = []
+        self.predictions = 0
+        self.ws = None
+
+    async def connect(self, url):
+        from tornado.httpclient import HTTPRequest
+        from tornado.websocket import websocket_connect
+
+        self.ws = await websocket_connect(HTTPRequest(url), subprotocols=["streamlit"],
+                                          max_message_size=1 << 30)
+
+    def close(self):
+        if self.ws is not None:
+            self.ws.close()
+
+    async def _receive(self):
+        from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+
+        while True:
+            raw = await asyncio.wait_for(self.ws.read_message(), self.timeout)
+            if raw is None:
+                raise ConnectionError("worker closed the websocket")
+            msg = ForwardMsg()
+            msg.ParseFromString(raw)
+            kind = msg.WhichOneof("type")
+            if kind == "new_session":
+                # A full run: fragments it still renders re-register their
+                # auto-rerun, and the worker ignores reruns of the others
+                self.elements = {}
+                self.auto_rerun = {}
+            elif kind == "delta" and msg.delta.WhichOneof("type") == "new_element":
+                self.elements[tuple(msg.metadata.delta_path)] = msg.delta.new_element
+            elif kind == "auto_rerun":
+                interval = msg.auto_rerun.interval
+                self.auto_rerun[msg.auto_rerun.fragment_id] = (interval, time.perf_counter() + interval)
+            elif kind == "stop_auto_rerun":
+                for fragment_id in msg.stop_auto_rerun.fragment_ids:
+                    self.auto_rerun.pop(fragment_id, None)
+            elif kind == "script_finished" and msg.script_finished in FINISHED:
+                return msg.script_finished
+
+    async def rerun(self, step, trigger=None, fragment_id=None):
+        from streamlit.proto.BackMsg_pb2 import BackMsg
+
+        back = BackMsg()
+        state = back.rerun_script
+        state.query_string = ""
+        for ws in self.widgets.values():
+            state.widget_states.widgets.append(ws)
+        if trigger is not None:
+            state.widget_states.widgets.append(trigger)
+        if fragment_id:
+            state.fragment_id = fragment_id
+            state.is_auto_rerun = True
+        t = time.perf_counter()
+        await self.ws.write_message(back.SerializeToString(), binary=True)
+        status = await self._receive()
+        self.timings.append((step, time.perf_counter() - t))
+        if status == 0:
+            # The frontend drops the state of widgets no longer rendered
+            live = {self._widget_id(e) for e in self.elements.values()}
+            self.widgets = {k: v for k, v in self.widgets.items() if k in live}
+        for e in self.elements.values():
+            kind = e.WhichOneof("type")
+            if kind == "exception":
+                self.errors.append(f"{e.exception.type}: {e.exception.message}")
+            elif kind == "alert" and e.alert.body.startswith("System Error"):
+                self.errors.append(e.alert.body)
+
+    @staticmethod
+    def _widget_id(element):
+        return getattr(getattr(element, element.WhichOneof("type")), "id", None)
+
+    def _find(self, kind, match):
+        for e in self.elements.values():
+            if e.WhichOneof("type") == kind and match(getattr(e, kind)):
+                return getattr(e, kind)
+        raise LookupError(f"no {kind} on the page")
+
+    def _set(self, widget_id, field, value):
+        from streamlit.proto.WidgetStates_pb2 import WidgetState
+
+        ws = WidgetState(id=widget_id)
+        setattr(ws, field, value)
+        return ws
+
+    async def _act(self, step, trigger=None):
+        await self._poll_fragments()
+        if self.think_ms:
+            await asyncio.sleep(self.rng.expovariate(1e3 / self.think_ms))
+        await self.rerun(step, trigger)
+
+    async def _poll_fragments(self):
+        now = time.perf_counter()
+        for fragment_id, (interval, due) in list(self.auto_rerun.items()):
+            if now >= due and fragment_id in self.auto_rerun:
+                self.auto_rerun[fragment_id] = (interval, now + interval)
+                await self.rerun("fragment", fragment_id=fragment_id)
+
+    def alerts(self, fmt):
+        return [e.alert.body for e in self.elements.values()
+                if e.WhichOneof("type") == "alert" and e.alert.format == fmt]
+
+    async def walk(self):
+        from streamlit.proto.Alert_pb2 import Alert
+
+        await self.rerun("start")
+        nav = self._find("radio", lambda w: w.label == "Navigation")
+        self.widgets[nav.id] = self._set(nav.id, "string_value", "Predict")
+        await self._act("page")
+
+        detect = self._find("button", lambda w: "Detect My Location" in w.label)
+        await self._act("detect", self._set(detect.id, "trigger_value", True))
+        geo = self._find("component_instance", lambda w: "streamlit_js_eval" in w.component_name)
+        coords = {"coords": {"latitude": self.fix[0], "longitude": self.fix[1], "accuracy": 10.0},
+                  "timestamp": time.time() * 1e3}
+        self.widgets[geo.id] = self._set(geo.id, "json_value", json.dumps(coords))
+        await self._act("fix")
+
+        chosen = {}
+        for _ in range(self.iterations):
+            boxes = [e.selectbox for e in self.elements.values()
+                     if e.WhichOneof("type") == "selectbox" and "-feat_" in e.selectbox.id]
+            for box in self.rng.sample(boxes, min(self.changes, len(boxes))):
+                current = chosen.get(box.id, box.options[box.default[0]] if box.default else None)
+                options = [o for o in box.options if o != current] or list(box.options)
+                chosen[box.id] = self.rng.choice(options)
+                self.widgets[box.id] = self._set(box.id, "string_value", chosen[box.id])
+                await self._act("select")
+            button = self._find("button", lambda w: "Predict Potential" in w.label)
+            await self._act("predict", self._set(button.id, "trigger_value", True))
+            outcome = self.alerts(Alert.SUCCESS) + self.alerts(Alert.ERROR)
+            self.predictions += any("Potential Area" in body for body in outcome)
+        await self._poll_fragments()
+
+    @property
+    def address(self):
+        from streamlit.proto.Alert_pb2 import Alert
+
+        return any("Zimbabwe" in body for body in self.alerts(Alert.SUCCESS))
+
+
+async def _run_sessions(url, sessions):
+    async def one(session):
+        try:
+            await session.connect(url)
+            await session.walk()
+        except Exception as e:  # a harness failure: widget missing, timeout, ...
+            session.errors.append(f"{type(e).__name__}: {e}")
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(one(s) for s in sessions))
+    return time.perf_counter() - t0
+
+
+async def _close_sessions(sessions):
+    for s in sessions:
+        s.close()
+    await asyncio.sleep(0.5)  # let the worker see the disconnects
+
+
+# ===============================
+# Measurement
+# ===============================
+def measure(n, args):
+    make = dict(seed=args.seed, changes=args.changes, iterations=args.iterations,
+                think_ms=args.think_ms, timeout=args.timeout)
+    sessions = [Session(i, **make) for i in range(n)]
+
+    async def run(worker):
+        warmup_s = None
+        if not args.cold:
+            warm = [Session(-1, **make)]
+            warmup_s = await _run_sessions(worker.url, warm)
+            await _close_sessions(warm)
+            if warm[0].errors:
+                raise RuntimeError(f"warm-up session failed: {warm[0].errors[0]}")
+        rss_before, metrics_before = worker.rss_mb, worker.metrics()
+        wall = await _run_sessions(worker.url, sessions)
+        # Still connected: their session state is what is measured
+        rss_after = worker.rss_mb
+        await _close_sessions(sessions)
+        return warmup_s, wall, rss_before, rss_after, stage_summary(metrics_before, worker.metrics())
+
+    worker = Worker(args.index)
+    try:
+        warmup_s, wall, rss_before, rss_after, stages = asyncio.run(run(worker))
+    finally:
+        worker.close()
+
+    timings = [t for s in sessions for t in s.timings]
+    predictions = sum(s.predictions for s in sessions)
+    return {
+        "sessions": n,
+        "cold": args.cold,
+        "warmup_s": warmup_s,
+        "wall_s": wall,
+        "reruns": len(timings),
+        "reruns_per_s": len(timings) / wall,
+        "predictions": predictions,
+        "predictions_per_s": predictions / wall,
+        "latency": _percentiles([d for _, d in timings]),
+        "steps": {step: _percentiles([d for name, d in timings if name == step]) for step in STEPS},
+        "rss_before_mb": rss_before,
+        "rss_after_mb": rss_after,
+        "mb_per_session": None if rss_before is None or rss_after is None else (rss_after - rss_before) / n,
+        "addresses": sum(s.address for s in sessions),
+        "errors": [e for s in sessions for e in s.errors][:20],
+        "stages": stages,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent Predict-page sessions against one app.py worker.")
+    parser.add_argument("--sessions", type=int, nargs="+", default=DEFAULT_SESSIONS,
+                        help="concurrent session counts to measure (a fresh worker each)")
+    parser.add_argument("--iterations", type=int, default=3, help="predictions per session")
+    parser.add_argument("--changes", type=int, default=2, help="selectbox changes before each prediction")
+    parser.add_argument("--think-ms", type=float, default=0.0,
+                        help="mean think time before each action (exponential; 0 = back to back)")
+    parser.add_argument("--cold", action="store_true", help="no warm-up session; N sessions race the cold start")
+    parser.add_argument("--index", help="spatial index to copy in (default: start empty)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--timeout", type=float, default=300, help="seconds allowed per rerun")
+    parser.add_argument("--p95-budget-ms", type=float, help="report the largest N with p95 rerun latency under this")
+    parser.add_argument("--stages", action="store_true", help="also print the worker's telemetry stages per N")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    results = []
+    for n in args.sessions:
+        r = measure(n, args)
+        results.append(r)
+        if args.json:
+            continue
+        lat = r["latency"]
+        mem = "-" if r["mb_per_session"] is None else f"{r['mb_per_session']:.1f}"
+        print(f"N={n:<3d} {r['reruns']:5d} reruns  {r['reruns_per_s']:6.1f} reruns/s  "
+              f"{r['predictions_per_s']:5.2f} predictions/s  "
+              f"p50 {lat.get('p50_ms', 0):6.0f}  p95 {lat.get('p95_ms', 0):6.0f}  "
+              f"p99 {lat.get('p99_ms', 0):6.0f}  max {lat.get('max_ms', 0):6.0f} ms  "
+              f"{mem} MB/session  errors {len(r['errors'])}", flush=True)
+        steps = "  ".join(f"{step} {s['p95_ms']:.0f}" for step, s in r["steps"].items() if s["count"])
+        print(f"       p95 by step (ms): {steps}")
+        if args.stages:
+            for stage, s in r["stages"].items():
+                p95 = "-" if s["p95_le_ms"] is None else f"<= {s['p95_le_ms']:g}"
+                print(f"       {stage:16s} {s['count']:6d}  mean {s['mean_ms']:8.2f} ms  p95 {p95} ms")
+        for e in r["errors"]:
+            print(f"       error: {e}")
+
+    within = None
+    if args.p95_budget_ms is not None:
+        ok = [r["sessions"] for r in results if r["latency"].get("p95_ms", float("inf")) <= args.p95_budget_ms]
+        within = max(ok) if ok else None
+    errors = any(r["errors"] for r in results)
+
+    if args.json:
+        print(json.dumps({"p95_budget_ms": args.p95_budget_ms, "max_sessions_within_budget": within,
+                          "results": results}, indent=2))
+    elif args.p95_budget_ms is not None:
+        if within is None:
+            print(f"p95 over {args.p95_budget_ms:g} ms already at N={min(args.sessions)}")
+        else:
+            print(f"largest N with p95 under {args.p95_budget_ms:g} ms: {within}")
+    sys.exit(1 if errors or (args.p95_budget_ms is not None and within is None) else 0)
+
+
+if __name__ == "__main__":
+    main()
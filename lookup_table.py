@@ -0,0 +1,251 @@
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from prediction import pipeline_predict
+
+# -----------------------------------------------------------------------
+# Precomputed prediction table over the whole categorical input space
+#
+# Every predictor is a low-cardinality categorical, so the model's whole
+# input space is the Cartesian product of the encoder's levels for the
+# selected features (a few hundred cells for the shipped model).  We push
+# every cell through encoder -> scaler -> SVC once (via the compiled
+# kernel in inference.py when it is available), keep the label and the
+# class probabilities in flat arrays, and address a cell by its
+# mixed-radix code:
+#
+#     code = sum(level_index[f] * stride[f])
+#
+# A prediction is then one integer computation and an array index.
+#
+# The table hangs off the ArtifactSet (artifacts.cached), so a retrain that
+# swaps in new pickles gets a freshly built and re-verified table on the
+# next request.
+#
+# Verification compares the table with scoring that did not build it.
+# A table built from the pickles is checked against the sklearn pipeline.
+# A table built from a bundle comes from the bundle's own kernel, so
+# re-scoring through that kernel would prove nothing; it is checked
+# against the estimators' outputs recorded in the bundle when it was
+# written (model_bundle.py), else against pickles next to the bundle
+# that hash to the same version.  With neither, it is served unverified
+# and the log says so.
+# -----------------------------------------------------------------------
+
+# Refuse to enumerate spaces that would not comfortably fit in memory;
+# callers fall back to the pipeline in that case.
+MAX_CELLS = 2_000_000
+
+
+class LookupTable:
+    def __init__(self, features, levels, classes, labels, probs, version=None):
+        self.features = list(features)
+        self.levels = [np.asarray(lv, dtype=object) for lv in levels]
+        self.classes = np.asarray(classes)
+        self.labels = labels
+        self.probs = probs
+        self.version = version
+
+        self.radix = np.array([len(lv) for lv in self.levels], dtype=np.int64)
+        # Last feature varies fastest, like np.ravel_multi_index
+        self.strides = np.ones(len(self.radix), dtype=np.int64)
+        for i in range(len(self.radix) - 2, -1, -1):
+            self.strides[i] = self.strides[i + 1] * self.radix[i + 1]
+        self._index = [{v: i for i, v in enumerate(lv)} for lv in self.levels]
+
+    def __len__(self):
+        return int(self.labels.shape[0])
+
+    @property
+    def nbytes(self):
+        return self.labels.nbytes + self.probs.nbytes
+
+    def code(self, inputs):
+        code = 0
+        for f, index, stride in zip(self.features, self._index, self.strides):
+            code += index[inputs[f]] * int(stride)  # KeyError if unknown
+        return code
+
+    def lookup(self, inputs):
+        code = self.code(inputs)
+        return self.labels[code], self.probs[code]
+
+    def encode(self, frame):
+        """Mixed-radix codes for every row of `frame`; -1 marks rows with a
+        missing column or a level the table does not know."""
+        codes = np.zeros(len(frame), dtype=np.int64)
+        bad = np.zeros(len(frame), dtype=bool)
+        for f, levels, stride in zip(self.features, self.levels, self.strides):
+            if f not in frame.columns:
+                return np.full(len(frame), -1, dtype=np.int64)
+            idx = pd.Categorical(frame[f], categories=levels).codes.astype(np.int64)
+            bad |= idx < 0
+            codes += idx * stride
+        codes[bad] = -1
+        return codes
+
+    def decode(self, codes):
+        """Inverse of encode(): DataFrame of level strings for `codes`."""
+        idx = np.unravel_index(np.asarray(codes), tuple(self.radix))
+        return pd.DataFrame(
+            {f: lv[i] for f, lv, i in zip(self.features, self.levels, idx)}
+        )
+
+
+def feature_levels(artifacts):
+    if artifacts.bundle is not None:
+        return artifacts.bundle.selected_levels()
+    encoder_features = list(artifacts.encoder.feature_names_in_)
+    return [
+        artifacts.encoder.categories_[encoder_features.index(f)]
+        for f in artifacts.selected_features
+    ]
+
+
+def build_lookup_table(artifacts, max_cells=MAX_CELLS):
+    levels = feature_levels(artifacts)
+    n_cells = int(np.prod([len(lv) for lv in levels], dtype=np.int64))
+    if n_cells > max_cells:
+        raise ValueError(
+            f"Feature space has {n_cells} combinations (limit {max_cells})"
+        )
+
+    from inference import get_compiled_pipeline
+
+    compiled = get_compiled_pipeline(artifacts)
+    table = LookupTable(
+        artifacts.selected_features,
+        levels,
+        compiled.classes if compiled is not None else artifacts.model.classes_,
+        labels=None,
+        probs=None,
+        version=artifacts.version,
+    )
+    grid = table.decode(np.arange(n_cells))
+
+    # Score the grid with the compiled kernel when it is available; the
+    # result is verified against the sklearn pipeline either way.
+    if compiled is not None:
+        preds, probs = compiled.predict_with_proba(grid)
+    else:
+        preds, probs = pipeline_predict(artifacts, grid)
+
+    table.labels = preds.astype(np.int8 if preds.dtype.kind in "iub" else preds.dtype)
+    table.probs = probs.astype(np.float32)
+    return table
+
+
+def _matching_pickles(artifacts):
+    """The pickled estimators next to the bundle, if they are the ones it
+    was written from; else None."""
+    import os
+
+    import joblib
+
+    from artifacts import ARTIFACT_FILES
+    from model_bundle import content_version
+
+    base_dir = os.path.dirname(artifacts.paths["bundle"])
+    paths = {name: os.path.join(base_dir, f) for name, f in ARTIFACT_FILES.items()}
+    if not all(os.path.exists(p) for p in paths.values()):
+        return None
+    try:
+        loaded = {name: joblib.load(p) for name, p in paths.items()}
+        version = content_version(loaded["encoder"], loaded["scaler"], loaded["model"],
+                                  loaded["selected_features"])
+    except Exception:
+        return None
+    return loaded if version == artifacts.bundle.version else None
+
+
+def verify_lookup_table(table, artifacts, sample=512, seed=0, atol=1e-5):
+    """Check a random sample of cells against an independent reference
+    (see the header) and raise AssertionError if the table disagrees.
+    Returns (cells checked, reference name); (0, None) when a bundle has
+    no reference to check against."""
+    rng = np.random.default_rng(seed)
+    n = min(sample, len(table))
+    codes = rng.choice(len(table), size=n, replace=False)
+    if artifacts.bundle is None:
+        source = "sklearn pipeline"
+        preds, probs = pipeline_predict(artifacts, table.decode(codes))
+    elif artifacts.bundle.reference() is not None:
+        source = "bundle reference"
+        ref_codes, preds, probs = artifacts.bundle.reference()
+        if len(ref_codes) > sample:
+            keep = np.sort(rng.choice(len(ref_codes), size=sample, replace=False))
+            ref_codes, preds = ref_codes[keep], preds[keep]
+            probs = None if probs is None else probs[keep]
+        codes = ref_codes.astype(np.int64) @ table.strides
+    else:
+        from model_bundle import estimator_outputs
+
+        loaded = _matching_pickles(artifacts)
+        if loaded is None:
+            return 0, None
+        source = "pickled pipeline"
+        cells = np.stack(np.unravel_index(codes, tuple(table.radix)), axis=1)
+        preds, probs = estimator_outputs(loaded["encoder"], loaded["scaler"], loaded["model"],
+                                         loaded["selected_features"], cells)
+
+    if not np.array_equal(table.labels[codes], preds):
+        raise AssertionError(f"lookup table labels disagree with the {source}")
+    if probs is not None and not np.allclose(table.probs[codes], probs, atol=atol):
+        raise AssertionError(f"lookup table probabilities disagree with the {source}")
+    return len(codes), source
+
+
+def get_lookup_table(artifacts):
+    """Verified table for this artifact generation, or None if it cannot
+    be built (artifacts missing, space too large, verification failed)."""
+
+    def _build(artifacts):
+        if not artifacts.ok:
+            return None
+        try:
+            table = build_lookup_table(artifacts)
+            checked, _ = verify_lookup_table(table, artifacts)
+            if not checked:
+                print(f"[lookup_table] {artifacts.version}: not verified (the bundle has no "
+                      "reference outputs and no matching pickles)", flush=True)
+            return table
+        except Exception as e:
+            print(f"[lookup_table] disabled for {artifacts.version}: {e}", flush=True)
+            return None
+
+    return artifacts.cached("lookup_table", _build)
+
+
+def main():
+    import time
+
+    from artifacts import ArtifactRegistry, BASE_DIR
+
+    parser = argparse.ArgumentParser(description="Build and verify the prediction lookup table.")
+    parser.add_argument("--artifact-dir", default=BASE_DIR)
+    parser.add_argument("--sample", type=int, default=0, help="cells to verify (0 = all)")
+    args = parser.parse_args()
+
+    artifacts = ArtifactRegistry(base_dir=args.artifact_dir).current()
+    t0 = time.perf_counter()
+    table = build_lookup_table(artifacts)
+    t1 = time.perf_counter()
+    checked, source = verify_lookup_table(table, artifacts, sample=args.sample or len(table))
+    t2 = time.perf_counter()
+
+    print(f"version:   {table.version}")
+    print(f"features:  {', '.join(table.features)}")
+    print(f"radix:     {' x '.join(str(r) for r in table.radix)} = {len(table)} cells")
+    print(f"size:      {table.nbytes} bytes")
+    print(f"build:     {(t1 - t0) * 1000:.1f} ms")
+    if source is None:
+        print("verified:  skipped - the bundle has no reference outputs and no matching "
+              "pickles (rebuild it with model_bundle.py build or training.py)")
+    else:
+        print(f"verified:  {checked} cells against the {source} in {(t2 - t1) * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
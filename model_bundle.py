@@ -0,0 +1,367 @@
+import argparse
+import hashlib
+import json
+import mmap
+import os
+import struct
+import time
+
+import numpy as np
+
+# -----------------------------------------------------------------------
+# Single-file, pickle-free model bundle
+#
+# The deployment used to ship four joblib pickles, and unpickling them
+# imports sklearn and materialises the estimators in every process that
+# loads them (each batch/raster worker included).  Serving only needs the
+# fitted numbers, which is what the compiled kernel (inference.py) runs
+# on, so the bundle stores exactly those:
+#
+#   header     8-byte magic, format version, manifest length
+#   manifest   JSON: features, selected features, kernel parameters,
+#              classes, content version, training metadata, and the
+#              dtype / shape / offset of every array
+#   arrays     category tables (fixed-width unicode), scaler mean and
+#              scale, support vectors, dual coefficients, intercept,
+#              Platt parameters; each 64-byte aligned
+#   reference  optional: the sklearn estimators' own labels and
+#              probabilities for the distinct training cells, so what is
+#              scored from the bundle later (the lookup table) can be
+#              checked against something the bundle's kernel did not
+#              compute.  Not part of the content version.
+#
+# load_bundle() maps the file read-only and wraps each array with
+# np.frombuffer, so nothing is copied or parsed beyond the manifest:
+# every process that loads the same bundle shares the same page-cache
+# pages, and no sklearn import is needed.
+#
+# write_bundle() is called by training.py, so the file the trainer
+# writes is the file the app loads.  Writes go to a temporary file and
+# are moved into place, which the artifact registry sees as one change.
+#
+#     python model_bundle.py build            # bundle the shipped pickles
+#     python model_bundle.py info model.gwpb
+#     python model_bundle.py bench            # cold start: pickles vs bundle
+# -----------------------------------------------------------------------
+
+BUNDLE_FILE = "model.gwpb"
+MAGIC = b"GWPBNDL\x00"
+FORMAT_VERSION = 1
+ALIGN = 64
+_HEADER = struct.Struct("<8sIQ")  # magic, format version, manifest length
+
+
+class BundleError(ValueError):
+    pass
+
+
+class ModelBundle:
+    def __init__(self, manifest, arrays, path=None):
+        self.manifest = manifest
+        self.arrays = arrays
+        self.path = path
+        self.version = manifest["version"]
+        self.features = list(manifest["features"])
+        self.selected_features = list(manifest["selected_features"])
+        self.classes = arrays["classes"]
+        self.levels = {
+            f: arrays[f"levels/{f}"].astype(object) for f in self.features
+        }
+
+    @property
+    def nbytes(self):
+        return sum(a.nbytes for a in self.arrays.values())
+
+    def selected_levels(self):
+        return [self.levels[f] for f in self.selected_features]
+
+    def reference(self):
+        """(codes, labels, probs) recorded from the estimators when the
+        bundle was written, or None.  codes index selected_levels();
+        probs is None for a model without probabilities."""
+        if "reference/codes" not in self.arrays:
+            return None
+        return (self.arrays["reference/codes"], self.arrays["reference/labels"],
+                self.arrays.get("reference/probs"))
+
+    def compiled(self, **kwargs):
+        from inference import CompiledPipeline
+
+        model = self.manifest["model"]
+        return CompiledPipeline(
+            self.selected_features,
+            self.selected_levels(),
+            self.arrays["mean"],
+            self.arrays["scale"],
+            self.arrays["support_vectors"],
+            self.arrays["dual_coef"],
+            self.arrays["intercept"],
+            self.classes,
+            kernel=model["kernel"],
+            gamma=model["gamma"],
+            coef0=model["coef0"],
+            degree=model["degree"],
+            prob_a=self.arrays.get("prob_a"),
+            prob_b=self.arrays.get("prob_b"),
+            **kwargs,
+        )
+
+
+# ===============================
+# Writing
+# ===============================
+def bundle_arrays(encoder, scaler, model, selected_features):
+    """Fitted numbers of the encoder -> scaler -> SVC pipeline, keyed by
+    bundle array name, plus the scalar model parameters."""
+    from inference import CompiledPipeline
+
+    compiled = CompiledPipeline.from_estimators(encoder, scaler, model, selected_features)
+    features = [str(f) for f in encoder.feature_names_in_]
+    arrays = {
+        f"levels/{f}": np.asarray([str(v) for v in cats], dtype=str)
+        for f, cats in zip(features, encoder.categories_)
+    }
+    arrays.update({
+        "mean": compiled.mean,
+        "scale": compiled.scale,
+        "support_vectors": compiled.support_vectors,
+        "dual_coef": compiled.dual_coef,
+        "intercept": np.array([compiled.intercept]),
+        "classes": np.asarray(compiled.classes),
+    })
+    if compiled.has_proba:
+        arrays["prob_a"] = np.array([compiled.prob_a])
+        arrays["prob_b"] = np.array([compiled.prob_b])
+    params = {
+        "kernel": compiled.kernel,
+        "gamma": compiled.gamma,
+        "coef0": compiled.coef0,
+        "degree": compiled.degree,
+    }
+    return features, arrays, params
+
+
+def _pad(n):
+    return (-n) % ALIGN
+
+
+def content_version(encoder, scaler, model, selected_features):
+    """The version a bundle written from these estimators gets."""
+    return _digest(*bundle_arrays(encoder, scaler, model, selected_features), selected_features)
+
+
+def _digest(features, arrays, params, selected_features):
+    digest = hashlib.sha256()
+    digest.update(json.dumps([features, list(selected_features), params]).encode())
+    for name in sorted(arrays):
+        digest.update(name.encode())
+        digest.update(np.ascontiguousarray(arrays[name]).tobytes())
+    return digest.hexdigest()[:12]
+
+
+def estimator_outputs(encoder, scaler, model, selected_features, codes):
+    """sklearn's labels and probabilities (None without them) for rows of
+    ordinal codes over the selected features - no bundle or compiled
+    kernel involved."""
+    import pandas as pd
+
+    scaled = scaler.transform(pd.DataFrame(np.asarray(codes, dtype=np.float64),
+                                           columns=list(selected_features)))
+    preds = np.asarray(model.predict(scaled))
+    try:
+        probs = np.asarray(model.predict_proba(scaled))
+    except AttributeError:
+        probs = None
+    return preds, probs
+
+
+def reference_arrays(encoder, scaler, model, selected_features, frame):
+    """Bundle arrays holding the estimators' outputs on the distinct
+    selected-feature cells of `frame` (see ModelBundle.reference)."""
+    import pandas as pd
+
+    features = list(encoder.feature_names_in_)
+    encoded = pd.DataFrame(encoder.transform(frame[features]), columns=features)
+    codes = encoded[list(selected_features)].to_numpy()
+    codes = np.unique(codes[~np.isnan(codes).any(axis=1)].astype(np.int32), axis=0)
+    preds, probs = estimator_outputs(encoder, scaler, model, selected_features, codes)
+    arrays = {"reference/codes": codes,
+              "reference/labels": preds.astype(np.asarray(model.classes_).dtype)}
+    if probs is not None:
+        arrays["reference/probs"] = probs
+    return arrays
+
+
+def write_bundle(path, encoder, scaler, model, selected_features, metadata=None,
+                 reference=None):
+    """Write the bundle for a fitted pipeline; returns the loaded bundle.
+    reference: a frame of training rows to record the estimators' outputs
+    on (see ModelBundle.reference)."""
+    features, arrays, params = bundle_arrays(encoder, scaler, model, selected_features)
+    version = _digest(features, arrays, params, selected_features)
+    if reference is not None:
+        arrays.update(reference_arrays(encoder, scaler, model, selected_features, reference))
+
+    layout = {}
+    offset = 0
+    for name, arr in arrays.items():
+        layout[name] = {"dtype": arr.dtype.str, "shape": list(arr.shape), "offset": offset}
+        offset += arr.nbytes + _pad(arr.nbytes)
+
+    manifest = {
+        "format": "gwp-model-bundle",
+        "format_version": FORMAT_VERSION,
+        "version": version,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "features": features,
+        "selected_features": list(selected_features),
+        "model": params,
+        "metadata": metadata or {},
+        "arrays": layout,
+    }
+    blob = json.dumps(manifest, indent=1, default=str).encode()
+    blob += b" " * _pad(_HEADER.size + len(blob))
+
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as fh:
+        fh.write(_HEADER.pack(MAGIC, FORMAT_VERSION, len(blob)))
+        fh.write(blob)
+        for arr in arrays.values():
+            fh.write(np.ascontiguousarray(arr).tobytes())
+            fh.write(b"\0" * _pad(arr.nbytes))
+    os.replace(tmp, path)
+    return load_bundle(path)
+
+
+# ===============================
+# Loading
+# ===============================
+def load_bundle(path):
+    with open(path, "rb") as fh:
+        head = fh.read(_HEADER.size)
+        if len(head) < _HEADER.size:
+            raise BundleError(f"{path} is not a model bundle (truncated header)")
+        magic, version, length = _HEADER.unpack(head)
+        if magic != MAGIC:
+            raise BundleError(f"{path} is not a model bundle")
+        if version > FORMAT_VERSION:
+            raise BundleError(f"{path} has bundle format {version}; this code reads up to {FORMAT_VERSION}")
+        manifest = json.loads(fh.read(length))
+        buf = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+
+    base = _HEADER.size + length
+    arrays = {}
+    for name, spec in manifest["arrays"].items():
+        dtype = np.dtype(spec["dtype"])
+        shape = tuple(spec["shape"])
+        count = int(np.prod(shape, dtype=np.int64))
+        start = base + spec["offset"]
+        if start + count * dtype.itemsize > len(buf):
+            raise BundleError(f"{path}: array {name!r} runs past the end of the file")
+        arrays[name] = np.frombuffer(buf, dtype=dtype, count=count, offset=start).reshape(shape)
+    return ModelBundle(manifest, arrays, path=path)
+
+
+def verify_bundle(bundle, encoder, scaler, model, selected_features, frame, atol=1e-6):
+    """Raise AssertionError unless the bundle reproduces the estimators'
+    labels and probabilities on every row of `frame`."""
+    import pandas as pd
+
+    features = list(encoder.feature_names_in_)
+    encoded = pd.DataFrame(encoder.transform(frame[features]), columns=features)
+    scaled = scaler.transform(encoded[list(selected_features)])
+    preds = model.predict(scaled)
+    labels, probs = bundle.compiled().predict_with_proba(frame)
+    if not np.array_equal(labels, preds):
+        raise AssertionError("bundle labels disagree with the model")
+    if probs is not None and not np.allclose(probs, model.predict_proba(scaled), atol=atol):
+        raise AssertionError("bundle probabilities disagree with the model")
+    return len(frame)
+
+
+# ===============================
+# CLI
+# ===============================
+_BENCH_PICKLES = """
+import time, resource
+t = time.perf_counter()
+import joblib
+for f in ("svm_model.pkl", "scaler.pkl", "encoder.pkl", "selected_features.pkl"):
+    joblib.load(f)
+print(time.perf_counter() - t, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+"""
+
+_BENCH_BUNDLE = """
+import time, resource
+t = time.perf_counter()
+from model_bundle import load_bundle
+load_bundle({path!r}).compiled()
+print(time.perf_counter() - t, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+"""
+
+
+def _bench(base_dir, path, runs):
+    import subprocess
+    import sys
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ, PYTHONPATH=here + os.pathsep + os.environ.get("PYTHONPATH", ""))
+    for label, code in (("pickles", _BENCH_PICKLES), ("bundle", _BENCH_BUNDLE.format(path=path))):
+        times, rss = [], []
+        for _ in range(runs):
+            out = subprocess.run([sys.executable, "-W", "ignore", "-c", code], cwd=base_dir,
+                                 env=env, capture_output=True, text=True, check=True)
+            t, r = out.stdout.split()
+            times.append(float(t))
+            rss.append(int(r) / 1024)
+        print(f"{label:8s} import+load {np.median(times) * 1e3:8.1f} ms   "
+              f"peak RSS {np.median(rss):6.1f} MB   (median of {runs} fresh processes)")
+
+
+def main():
+    from artifacts import BASE_DIR
+
+    parser = argparse.ArgumentParser(description="Build, inspect and time the model bundle.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    build = sub.add_parser("build", help="bundle the joblib pickles in --artifact-dir")
+    build.add_argument("--artifact-dir", default=BASE_DIR)
+    build.add_argument("--output", default=None)
+    info = sub.add_parser("info", help="print a bundle's manifest summary")
+    info.add_argument("path", nargs="?", default=os.path.join(BASE_DIR, BUNDLE_FILE))
+    bench = sub.add_parser("bench", help="cold-start time and memory, pickles vs bundle")
+    bench.add_argument("--artifact-dir", default=BASE_DIR)
+    bench.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    if args.command == "build":
+        import joblib
+
+        from artifacts import ARTIFACT_FILES, DATA_FILE, load_dataset
+
+        loaded = {name: joblib.load(os.path.join(args.artifact_dir, f))
+                  for name, f in ARTIFACT_FILES.items()}
+        output = args.output or os.path.join(args.artifact_dir, BUNDLE_FILE)
+        data, _, _ = load_dataset(os.path.join(args.artifact_dir, DATA_FILE))
+        bundle = write_bundle(output, loaded["encoder"], loaded["scaler"], loaded["model"],
+                              loaded["selected_features"],
+                              metadata={"source": "pickles", "files": ARTIFACT_FILES},
+                              reference=data)
+        rows = verify_bundle(bundle, loaded["encoder"], loaded["scaler"], loaded["model"],
+                             loaded["selected_features"], data)
+        print(f"wrote {output} ({os.path.getsize(output)} bytes, version {bundle.version}); "
+              f"verified on {rows} rows")
+    elif args.command == "info":
+        bundle = load_bundle(args.path)
+        m = bundle.manifest
+        print(f"version:   {bundle.version} (format {m['format_version']}, created {m['created']})")
+        print(f"model:     {m['model']}")
+        print(f"selected:  {', '.join(bundle.selected_features)}")
+        for name, spec in m["arrays"].items():
+            print(f"  {name:45s} {spec['dtype']:6s} {tuple(spec['shape'])}")
+        print(f"arrays:    {bundle.nbytes} bytes")
+    else:
+        _bench(args.artifact_dir, os.path.join(args.artifact_dir, BUNDLE_FILE), args.runs)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+# -----------------------------------------------------------------------
+# Cold-start and per-page first-render budget for app.py
+#
+# Each page is measured in a fresh Python process, since that is what a
+# cold Streamlit Cloud container or a new autoscaled replica sees: the
+# first run of the script (Home, the default page) is the cold start,
+# then the sidebar is switched to the page under test and that rerun is
+# its first render, including whatever the page imports and loads for
+# the first time.  Both are compared with the budgets below and the
+# heavy modules present after the render are listed.
+#
+# Runs headless with Streamlit's AppTest; no browser or server needed.
+#
+#     python page_budget.py                   # all pages, exit 1 if over
+#     python page_budget.py --page Predict --runs 5 --json
+# -----------------------------------------------------------------------
+
+APP = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+
+PAGES = ["Home", "Predict", "Bulk Predict", "Model Info", "Feature Guide", "About"]
+
+# Milliseconds.  COLD_START covers importing streamlit, running app.py
+# once and rendering Home; the page budgets cover only the switch.
+COLD_START_BUDGET_MS = 1500
+PAGE_BUDGETS_MS = {
+    "Home": 150,
+    "Predict": 2500,
+    "Bulk Predict": 300,
+    "Model Info": 1500,
+    "Feature Guide": 1500,
+    "About": 150,
+}
+
+HEAVY_MODULES = ["pandas", "sklearn", "joblib", "geopy", "folium",
+                 "streamlit_folium", "streamlit_js_eval", "pyarrow"]
+
+
+def _child(page):
+    t0 = time.perf_counter()
+    from streamlit.testing.v1 import AppTest
+
+    at = AppTest.from_file(APP, default_timeout=120)
+    at.run()
+    t1 = time.perf_counter()
+    before = [m for m in HEAVY_MODULES if m in sys.modules]
+    if page != "Home":
+        at.sidebar.radio[0].set_value(page).run()
+    else:
+        at.run()
+    t2 = time.perf_counter()
+    print(json.dumps({
+        "page": page,
+        "cold_start_ms": (t1 - t0) * 1e3,
+        "first_render_ms": (t2 - t1) * 1e3,
+        "heavy_at_start": before,
+        "heavy_after_page": [m for m in HEAVY_MODULES if m in sys.modules],
+        "exceptions": [str(e.value) for e in at.exception],
+    }))
+
+
+def measure(page, runs=3):
+    samples = []
+    for _ in range(runs):
+        out = subprocess.run(
+            [sys.executable, "-W", "ignore", os.path.abspath(__file__), "--child", page],
+            capture_output=True, text=True, check=True,
+        )
+        samples.append(json.loads(out.stdout.strip().splitlines()[-1]))
+    result = dict(samples[-1])
+    for key in ("cold_start_ms", "first_render_ms"):
+        result[key] = sorted(s[key] for s in samples)[len(samples) // 2]
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure app.py cold start and first render per page.")
+    parser.add_argument("--page", action="append", choices=PAGES, help="page(s) to measure (default: all)")
+    parser.add_argument("--runs", type=int, default=3, help="fresh processes per page (median)")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        _child(args.child)
+        return
+
+    results = [measure(page, args.runs) for page in (args.page or PAGES)]
+    over = []
+    for r in results:
+        r["budget_ms"] = PAGE_BUDGETS_MS[r["page"]]
+        r["over_budget"] = r["first_render_ms"] > r["budget_ms"] or bool(r["exceptions"])
+        if r["over_budget"]:
+            over.append(r["page"])
+    cold = sorted(r["cold_start_ms"] for r in results)[len(results) // 2]
+    if cold > COLD_START_BUDGET_MS:
+        over.append("cold start")
+
+    if args.json:
+        print(json.dumps({"cold_start_ms": cold, "cold_start_budget_ms": COLD_START_BUDGET_MS,
+                          "pages": results, "over_budget": over}, indent=2))
+    else:
+        flag = "OVER" if cold > COLD_START_BUDGET_MS else "ok"
+        print(f"cold start (Home, fresh process): {cold:7.0f} ms  budget {COLD_START_BUDGET_MS:5d}  {flag}")
+        for r in results:
+            flag = "OVER" if r["over_budget"] else "ok"
+            loaded = ", ".join(r["heavy_after_page"]) or "-"
+            print(f"{r['page']:14s} first render {r['first_render_ms']:7.0f} ms  "
+                  f"budget {r['budget_ms']:5d}  {flag:4s}  imports: {loaded}")
+            for e in r["exceptions"]:
+                print(f"    exception: {e}")
+    sys.exit(1 if over else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+import argparse
+import hashlib
+from collections import OrderedDict
+
+# -----------------------------------------------------------------------
+# Stable Folium maps
+#
+# The Predict page builds its folium.Map, CircleMarker and DivIcon on
+# every rerun.  Folium gives every element a random id (branca draws 16
+# bytes from os.urandom), so the serialized map differed on every rerun
+# even when only a predictor selectbox had changed: st_folium sent the
+# whole payload again and the browser remounted the map.
+#
+# stable_ids(m, seed) replaces the ids of a finished map's elements with
+# ones derived from the seed and each element's place in the tree (the
+# `_id` attribute branca reads them from, which folium's own deep_copy
+# sets the same way); nothing in branca is patched.  The Predict map is seeded with
+# its location and tile source, so the same location always serializes
+# to the same bytes.  Streamlit sends a large element that is identical
+# to one the browser already has as a short reference to the cached
+# copy, and the component sees unchanged arguments and keeps the map it
+# has; only a new location (or tile source) ships and draws a new map.
+#
+# The objects themselves are not cached: folium appends an element's
+# scripts to the figure each time it is rendered, so a reused Map grows
+# with every rerun.  Building one is cheap; shipping and remounting it
+# was the cost.
+#
+# Maps are also rendered with returned_objects=[]: the page does not read
+# clicks or bounds, and without it every pan or zoom reran the page.
+#
+# Tiles come from tile_cache.tile_layer(): OpenStreetMap or a local tile
+# cache (see tile_cache.py).
+#
+# With a spatial-index context (spatial_index.context()) the map also
+# shows the nearby surveyed points and earlier predictions; they are part
+# of the seed, so the map is re-sent only when that neighbourhood changes.
+# Likewise an interpolated P(High) surface (interpolation.py), drawn as
+# an image overlay.
+# -----------------------------------------------------------------------
+
+DEFAULT_LOCATION = (-19.0, 29.0)  # Zimbabwe-ish fallback if GPS missing
+DEFAULT_ZOOM = 14
+LOCATION_DECIMALS = 6
+
+def _elements(element, seen):
+    from branca.element import Element
+
+    if id(element) in seen:
+        return
+    seen.add(id(element))
+    yield element
+    # A Figure (and a Popup) keeps header / html / script parts outside
+    # its children
+    for part in ("header", "html", "script"):
+        child = getattr(element, part, None)
+        if isinstance(child, Element):
+            yield from _elements(child, seen)
+    for child in list(element._children.values()):
+        yield from _elements(child, seen)
+
+
+def stable_ids(m, seed):
+    """Give every element of the finished map `m` (its figure included)
+    an id derived from `seed` and its place in the tree; returns `m`.
+    Elements without branca's `_id` keep their random ids."""
+    elements = list(_elements(m.get_root(), set()))
+    if not all(hasattr(el, "_id") for el in elements):
+        return m
+    renamed = {}
+    for i, el in enumerate(elements):
+        old = el.get_name()
+        el._id = hashlib.blake2b(f"{seed}:{i}".encode(), digest_size=16).hexdigest()
+        renamed[old] = el.get_name()
+    # Children are keyed by name, and a few folium elements copy a name
+    # when they are built (Layer.layer_name, TileLayer.tile_name, ...)
+    for el in elements:
+        el._children = OrderedDict((renamed.get(k, k), c) for k, c in el._children.items())
+        for attr, value in list(vars(el).items()):
+            if isinstance(value, str) and value in renamed:
+                setattr(el, attr, renamed[value])
+    return m
+
+
+def _context_digest(nearby):
+    if nearby is None:
+        return None
+    digest = hashlib.blake2b(digest_size=8)
+    for key in ("observations", "predictions"):
+        recs = nearby[key]
+        digest.update(recs["lat"].tobytes() + recs["lon"].tobytes() + recs["label"].tobytes())
+    return digest.hexdigest()
+
+
+def _surface_digest(surface):
+    if surface is None:
+        return None
+    return (surface.method, hashlib.blake2b(surface.values.tobytes(), digest_size=8).hexdigest())
+
+
+def build_predict_map(latlon=None, nearby=None, surface=None):
+    """The Predict-page map for `latlon` (None: no fix yet), with the
+    points of `nearby` (spatial_index.context()) and an interpolation
+    `surface` drawn on it; identical bytes for the same location,
+    neighbourhood, surface and tile source."""
+    import folium
+
+    from tile_cache import tile_layer
+
+    tiles, attr = tile_layer()
+    if latlon:
+        latlon = (round(float(latlon[0]), LOCATION_DECIMALS),
+                  round(float(latlon[1]), LOCATION_DECIMALS))
+
+    m = folium.Map(location=latlon or DEFAULT_LOCATION, zoom_start=DEFAULT_ZOOM,
+                   tiles=tiles, attr=attr)
+
+    if latlon:
+        lat, lon = latlon
+
+        # Big circle marker (high visibility)
+        folium.CircleMarker(
+            location=[lat, lon],
+            radius=16,
+            color="#00ffea",
+            fill=True,
+            fill_color="#00ffea",
+            fill_opacity=0.95,
+            popup="You are here",
+        ).add_to(m)
+
+        # Text label marker using DivIcon
+        folium.map.Marker(
+            [lat, lon],
+            icon=folium.DivIcon(
+                html="""
+                <div style="
+                    font-size:14px;
+                    font-weight:900;
+                    color:#000;
+                    background:#00ffea;
+                    padding:6px 10px;
+                    border-radius:10px;
+                    box-shadow: 0 0 14px rgba(0,255,234,0.6);
+                    border:2px solid #ffffff;
+                ">
+                YOU
+                </div>
+                """
+            ),
+        ).add_to(m)
+
+    if surface is not None:
+        from interpolation import add_overlay
+
+        add_overlay(m, surface)
+    if nearby is not None:
+        from spatial_index import overlay
+
+        overlay(m, nearby)
+    return stable_ids(m, ("predict", latlon, tiles, _context_digest(nearby), _surface_digest(surface)))
+
+
+def show_predict_map(st_folium, latlon=None, nearby=None, surface=None, width=700, height=380):
+    st_folium(build_predict_map(latlon, nearby, surface), key="predict_map", width=width, height=height,
+              returned_objects=[])
+
+
+def main():
+    import time
+
+    import folium
+    from streamlit_folium import _get_header, _get_html, _get_map_string
+
+    parser = argparse.ArgumentParser(description="Check that reruns of the Predict map serialize identically.")
+    parser.add_argument("--reruns", type=int, default=50)
+    args = parser.parse_args()
+
+    def _payload(m):
+        # What st_folium serializes and sends for a map
+        m.get_root().render()
+        m.render()
+        return _get_html(m) + _get_header(m) + _get_map_string(m)
+
+    def _random_ids_map(latlon):
+        m = folium.Map(location=latlon, zoom_start=DEFAULT_ZOOM, tiles="OpenStreetMap")
+        folium.CircleMarker(location=list(latlon), radius=16, popup="You are here").add_to(m)
+        folium.map.Marker(list(latlon), icon=folium.DivIcon(html="<div>YOU</div>")).add_to(m)
+        return m
+
+    latlon = (-17.8292, 31.0522)
+    for label, build in (("random ids", lambda: _random_ids_map(latlon)),
+                         ("stable ids", lambda: build_predict_map(latlon))):
+        payloads = []
+        t0 = time.perf_counter()
+        for _ in range(args.reruns):
+            payloads.append(_payload(build()))
+        elapsed = (time.perf_counter() - t0) / args.reruns
+        changed = sum(a != b for a, b in zip(payloads, payloads[1:]))
+        print(f"{label:11s} build + serialize {elapsed * 1e3:6.2f} ms   payload {len(payloads[-1]):,} bytes, "
+              f"re-sent on {changed}/{args.reruns - 1} reruns")
+    other = _payload(build_predict_map((-17.83, 31.05)))
+    print(f"moving the location changes the payload: {other != payloads[-1]}")
+
+
+if __name__ == "__main__":
+    main()
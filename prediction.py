@@ -0,0 +1,136 @@
+import numpy as np
+import pandas as pd
+
+from telemetry import span
+
+# -----------------------------------------------------------------------
+# Prediction entry points shared by app.py and script2.py
+#
+# pipeline_predict() is the reference path exactly as trained in
+# GWPOTERTIAL MAPPING.py: OrdinalEncoder over all predictors, keep the
+# Boruta-selected columns, StandardScaler, SVC.  Everything faster in
+# this repo is checked against it.
+#
+# predict_one() first asks the process-wide memo (prediction_cache.py).
+# predict_one() / predict_frame() then try, in order: the precomputed lookup
+# table (lookup_table.py), the compiled NumPy kernel (inference.py) and
+# finally the sklearn pipeline.  When the artifacts come from a model
+# bundle there are no estimators and the compiled kernel is the last step.
+# -----------------------------------------------------------------------
+
+LABELS = {1: "High Potential", 0: "Low Potential"}
+
+
+def complete_inputs(artifacts, inputs):
+    # Build full input for ALL features used by the pipeline
+    full_input = dict(artifacts.default_values)
+    full_input.update(inputs)
+
+    # Ensure all full_features exist
+    for col in artifacts.full_features:
+        if col not in full_input:
+            full_input[col] = artifacts.default_values.get(col, "")
+    return full_input
+
+
+def complete_frame(artifacts, frame):
+    # Fill predictors the caller did not provide with the dataset mode
+    frame = frame.copy()
+    for col in artifacts.full_features:
+        if col not in frame.columns:
+            frame[col] = artifacts.default_values.get(col, "")
+    return frame
+
+
+def pipeline_predict(artifacts, frame):
+    full_features = artifacts.full_features
+    frame = complete_frame(artifacts, frame)
+
+    # Order columns exactly
+    input_df = frame[full_features]
+
+    # Encode + scale + select
+    with span("encode"):
+        encoded = artifacts.encoder.transform(input_df)
+        encoded_df = pd.DataFrame(encoded, columns=full_features)
+
+    selected_df = encoded_df[artifacts.selected_features]
+    with span("scale"):
+        scaled = artifacts.scaler.transform(selected_df)
+
+    # Predict
+    with span("predict"):
+        preds = artifacts.model.predict(scaled)
+    with span("predict_proba"):
+        probs = artifacts.model.predict_proba(scaled)
+    return np.asarray(preds), np.asarray(probs)
+
+
+def predict_one(artifacts, inputs, memo=None):
+    """Return (label, probabilities) for one dict of predictor values.
+
+    Answers from the process-wide memo (prediction_cache.py) when it can;
+    pass a PredictionMemo to use another one, or memo=False for none.
+    """
+    from prediction_cache import get_prediction_memo
+
+    if memo is None:
+        memo = get_prediction_memo()
+    key = memo.key(artifacts, inputs) if memo is not False else None
+    if key is not None:
+        hit = memo.get(key)
+        if hit is not None:
+            return hit
+
+    label, probs = _predict_one(artifacts, inputs)
+    if key is not None:
+        memo.put(key, label, probs)
+    return label, probs
+
+
+def _predict_one(artifacts, inputs):
+    from inference import get_compiled_pipeline
+    from lookup_table import get_lookup_table
+
+    table = get_lookup_table(artifacts)
+    if table is not None:
+        try:
+            with span("table_lookup"):
+                return table.lookup(inputs)
+        except KeyError:
+            # A value the table was not built for; let the pipeline decide
+            # (it raises the usual "unknown category" error).
+            pass
+
+    full_input = complete_inputs(artifacts, inputs)
+    if table is None or artifacts.bundle is not None:
+        compiled = get_compiled_pipeline(artifacts)
+        if compiled is not None:
+            return compiled.predict_one(full_input)
+
+    preds, probs = pipeline_predict(artifacts, pd.DataFrame([full_input]))
+    return preds[0], probs[0]
+
+
+def predict_frame(artifacts, frame):
+    """Return (labels, probabilities) arrays for every row of `frame`."""
+    from inference import get_compiled_pipeline
+    from lookup_table import get_lookup_table
+
+    table = get_lookup_table(artifacts)
+    if table is not None:
+        codes = table.encode(frame)
+        if (codes >= 0).all():
+            return table.labels[codes], table.probs[codes]
+
+    compiled = get_compiled_pipeline(artifacts)
+    if compiled is not None:
+        codes = compiled.encode(frame)
+        if (codes >= 0).all():
+            return compiled.predict_with_proba_codes(codes)
+        if artifacts.bundle is not None:
+            # No sklearn pipeline behind a bundle; raises the same
+            # "unknown category" error the encoder would.
+            return compiled.predict_with_proba(complete_frame(artifacts, frame))
+
+    return pipeline_predict(artifacts, frame)
@@ -0,0 +1,162 @@
+import argparse
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+# -----------------------------------------------------------------------
+# Process-wide prediction memo
+#
+# Many users submit the same combinations of categorical values, and the
+# result of "✨ Predict Potential" used to live only in that session's
+# state.  PredictionMemo is one size-bounded LRU shared by every session
+# of the process:
+#
+#     key    (model version, value of each selected feature in
+#             selected_features order)
+#     value  (label, read-only probability array)
+#
+# so a repeated query from any session is one dictionary lookup.  The
+# model version in the key means a set from another generation can never
+# be answered from a stale entry; on top of that the memo is cleared
+# when the artifact registry swaps in a new generation, so the old
+# entries do not linger until they age out.
+#
+# predict_one() consults the memo first, but only when the inputs name
+# nothing but selected features (what the app sends): a value for an
+# unselected predictor still goes through the encoder, which may reject
+# it.  Inputs that fail are never memoised.
+#
+# GWP_PREDICTION_CACHE_SIZE sets the bound (default 65536 entries, about
+# 20 MB; 0 disables the memo).
+# -----------------------------------------------------------------------
+
+DEFAULT_MAX_ENTRIES = 65536
+
+
+class PredictionMemo:
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES):
+        self.max_entries = int(max_entries)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def key(artifacts, inputs):
+        """Memo key for `inputs`, or None if they cannot be memoised."""
+        features = artifacts.selected_features
+        if not features or len(inputs) > len(features):
+            return None
+        try:
+            values = tuple(inputs[f] for f in features)
+            hash(values)
+        except (KeyError, TypeError):
+            return None
+        return (artifacts.version, values)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, label, probs):
+        if self.max_entries <= 0:
+            return
+        probs = np.array(probs, copy=True)
+        probs.setflags(write=False)
+        with self._lock:
+            self._entries[key] = (label, probs)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.invalidations += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else None,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+
+_memo = None
+_memo_lock = threading.Lock()
+
+
+def get_prediction_memo():
+    """The process-wide memo; cleared on every artifact reload."""
+    global _memo
+    if _memo is None:
+        with _memo_lock:
+            if _memo is None:
+                from artifacts import get_registry
+
+                memo = PredictionMemo(
+                    int(os.environ.get("GWP_PREDICTION_CACHE_SIZE", DEFAULT_MAX_ENTRIES))
+                )
+                get_registry().on_reload(lambda new_set, old_set: memo.clear())
+                _memo = memo
+    return _memo
+
+
+def main():
+    import time
+
+    from artifacts import ArtifactRegistry, BASE_DIR
+    from inference import get_compiled_pipeline
+    from lookup_table import feature_levels
+    from prediction import predict_one
+
+    parser = argparse.ArgumentParser(description="Time predict_one with and without the memo.")
+    parser.add_argument("--artifact-dir", default=BASE_DIR)
+    parser.add_argument("--calls", type=int, default=50000)
+    args = parser.parse_args()
+
+    artifacts = ArtifactRegistry(base_dir=args.artifact_dir).current()
+    levels = feature_levels(artifacts)
+    rng = np.random.default_rng(0)
+    rows = [
+        {f: lv[rng.integers(len(lv))] for f, lv in zip(artifacts.selected_features, levels)}
+        for _ in range(256)
+    ]
+    compiled = get_compiled_pipeline(artifacts)
+
+    def _time(fn):
+        fn(rows[0])
+        t0 = time.perf_counter()
+        for i in range(args.calls):
+            fn(rows[i % len(rows)])
+        return (time.perf_counter() - t0) / args.calls * 1e6
+
+    memo = PredictionMemo()
+    print(f"compiled kernel      {_time(lambda r: compiled.predict_one(dict(artifacts.default_values, **r))):8.2f} us")
+    print(f"predict_one, no memo {_time(lambda r: predict_one(artifacts, r, memo=False)):8.2f} us")
+    print(f"predict_one, memo    {_time(lambda r: predict_one(artifacts, r, memo=memo)):8.2f} us")
+    print(memo.stats())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,255 @@
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from artifacts import ArtifactRegistry, BASE_DIR
+
+# -----------------------------------------------------------------------
+# Gridded groundwater-potential mapping
+#
+# Input is a set of co-registered categorical rasters, one per predictor,
+# each a .npy file of integer class codes described by a JSON manifest:
+#
+#   {
+#     "shape": [rows, cols],
+#     "nodata": 255,
+#     "transform": [x0, dx, 0, y0, 0, -dy],      (optional, copied to output)
+#     "crs": "EPSG:4326",                         (optional, copied to output)
+#     "layers": {
+#       "Geological.Features": {"path": "geology.npy",
+#                               "levels": ["Granite", "Limestone"]},
+#       ...
+#     }
+#   }
+#
+# "levels" maps raster code i to a category string; if omitted, codes are
+# taken to be the encoder's level indices.  Layer paths are relative to
+# the manifest.
+#
+# Layers are opened with np.load(mmap_mode="r") and the grid is cut into
+# tiles; each pool worker reads only its tile window from every layer,
+# maps raster codes to level indices through a small lookup array and
+# scores the pixels with the verified prediction table (or the compiled
+# kernel if the table is unavailable).  Results go straight into two
+# memory-mapped .npy outputs:
+#
+#   potential_class.npy   uint8   1 = High, 0 = Low, 255 = nodata
+#   potential_prob.npy    float32 P(High), NaN = nodata
+#
+# No step holds more than one tile per layer in memory, so grid size is
+# bounded by disk, not RAM.
+# -----------------------------------------------------------------------
+
+DEFAULT_TILE = 1024
+CLASS_NODATA = 255
+CLASS_FILE = "potential_class.npy"
+PROB_FILE = "potential_prob.npy"
+
+
+def load_manifest(path):
+    with open(path) as fh:
+        manifest = json.load(fh)
+    base = os.path.dirname(os.path.abspath(path))
+    for layer in manifest["layers"].values():
+        layer["path"] = os.path.join(base, layer["path"])
+    return manifest
+
+
+def layer_luts(manifest, features, feature_levels):
+    """Per feature, an int array mapping raster code -> level index (-1
+    for nodata or a category the model does not know)."""
+    nodata = manifest.get("nodata")
+    luts = []
+    for feature, levels in zip(features, feature_levels):
+        if feature not in manifest["layers"]:
+            raise KeyError(f"No raster layer for predictor '{feature}'")
+        layer = manifest["layers"][feature]
+        index = {v: i for i, v in enumerate(levels)}
+        names = layer.get("levels", list(levels))
+        lut = np.array([index.get(name, -1) for name in names], dtype=np.int64)
+        if nodata is not None and 0 <= nodata < len(lut):
+            lut[nodata] = -1
+        luts.append(lut)
+    return luts
+
+
+def iter_tiles(shape, tile):
+    rows, cols = shape
+    for r0 in range(0, rows, tile):
+        for c0 in range(0, cols, tile):
+            yield r0, min(r0 + tile, rows), c0, min(c0 + tile, cols)
+
+
+# ===============================
+# Worker side
+# ===============================
+_worker = {}
+
+
+def _init_worker(layer_paths, luts, scorer, out_dir):
+    _worker["layers"] = [np.load(p, mmap_mode="r") for p in layer_paths]
+    _worker["luts"] = luts
+    _worker["scorer"] = scorer
+    _worker["classes"] = np.load(os.path.join(out_dir, CLASS_FILE), mmap_mode="r+")
+    _worker["probs"] = np.load(os.path.join(out_dir, PROB_FILE), mmap_mode="r+")
+
+
+def score_level_codes(scorer, idx):
+    """idx: (n_pixels, n_features) level indices, all valid.
+    Returns (labels, P(High))."""
+    from lookup_table import LookupTable
+
+    if isinstance(scorer, LookupTable):
+        flat = idx @ scorer.strides
+        return scorer.labels[flat], scorer.probs[flat, 1]
+    labels, probs = scorer.predict_with_proba_codes(idx)
+    return labels, probs[:, 1]
+
+
+def _score_tile(r0, r1, c0, c1):
+    w = _worker
+    n = (r1 - r0) * (c1 - c0)
+    idx = np.empty((n, len(w["layers"])), dtype=np.int64)
+    valid = np.ones(n, dtype=bool)
+
+    for i, (layer, lut) in enumerate(zip(w["layers"], w["luts"])):
+        raw = np.asarray(layer[r0:r1, c0:c1]).ravel().astype(np.int64)
+        inside = (raw >= 0) & (raw < len(lut))
+        col = np.full(n, -1, dtype=np.int64)
+        col[inside] = lut[raw[inside]]
+        idx[:, i] = col
+        valid &= col >= 0
+
+    classes = np.full(n, CLASS_NODATA, dtype=np.uint8)
+    probs = np.full(n, np.nan, dtype=np.float32)
+    if valid.any():
+        labels, high = score_level_codes(w["scorer"], idx[valid])
+        classes[valid] = (labels == 1).astype(np.uint8)
+        probs[valid] = high
+
+    w["classes"][r0:r1, c0:c1] = classes.reshape(r1 - r0, c1 - c0)
+    w["probs"][r0:r1, c0:c1] = probs.reshape(r1 - r0, c1 - c0)
+    high_count = int((classes == 1).sum())
+    return n, high_count, int(valid.sum()) - high_count, n - int(valid.sum())
+
+
+# ===============================
+# Driver
+# ===============================
+def build_scorer(artifacts):
+    from inference import get_compiled_pipeline
+    from lookup_table import feature_levels, get_lookup_table
+
+    table = get_lookup_table(artifacts)
+    if table is not None:
+        return table, table.levels
+    compiled = get_compiled_pipeline(artifacts)
+    if compiled is None:
+        raise RuntimeError("Model artifacts are not loaded; cannot map.")
+    return compiled, feature_levels(artifacts)
+
+
+def map_potential(manifest_path, out_dir, tile=DEFAULT_TILE, workers=None,
+                  artifact_dir=BASE_DIR, progress=None):
+    manifest = load_manifest(manifest_path)
+    artifacts = ArtifactRegistry(base_dir=artifact_dir).current()
+    scorer, levels = build_scorer(artifacts)
+    features = list(artifacts.selected_features)
+    luts = layer_luts(manifest, features, levels)
+    layer_paths = [manifest["layers"][f]["path"] for f in features]
+
+    shape = tuple(manifest["shape"])
+    for path in layer_paths:
+        arr = np.load(path, mmap_mode="r")
+        if arr.shape != shape:
+            raise ValueError(f"{path} has shape {arr.shape}, expected {shape}")
+
+    os.makedirs(out_dir, exist_ok=True)
+    classes = np.lib.format.open_memmap(
+        os.path.join(out_dir, CLASS_FILE), mode="w+", dtype=np.uint8, shape=shape)
+    classes[:] = CLASS_NODATA
+    classes.flush()
+    probs = np.lib.format.open_memmap(
+        os.path.join(out_dir, PROB_FILE), mode="w+", dtype=np.float32, shape=shape)
+    probs[:] = np.nan
+    probs.flush()
+    del classes, probs
+
+    tiles = list(iter_tiles(shape, tile))
+    totals = {"pixels": 0, "high": 0, "low": 0, "nodata": 0, "tiles": len(tiles)}
+    start = time.perf_counter()
+    initargs = (layer_paths, luts, scorer, out_dir)
+
+    def _add(result, done):
+        for key, value in zip(("pixels", "high", "low", "nodata"), result):
+            totals[key] += value
+        if progress is not None:
+            progress(done, len(tiles))
+
+    if workers == 0:
+        _init_worker(*initargs)
+        for done, t in enumerate(tiles, 1):
+            _add(_score_tile(*t), done)
+        _worker.clear()
+    else:
+        workers = workers or os.cpu_count() or 1
+        with ProcessPoolExecutor(max_workers=workers,
+                                 mp_context=multiprocessing.get_context("spawn"),
+                                 initializer=_init_worker,
+                                 initargs=initargs) as pool:
+            # chunksize keeps task overhead low for grids with many tiles
+            results = pool.map(_score_tile, *zip(*tiles),
+                               chunksize=max(1, len(tiles) // (workers * 8)))
+            for done, result in enumerate(results, 1):
+                _add(result, done)
+
+    totals["seconds"] = time.perf_counter() - start
+    out_manifest = {
+        "shape": list(shape),
+        "model_version": artifacts.version,
+        "class_raster": CLASS_FILE,
+        "class_nodata": CLASS_NODATA,
+        "class_values": {"1": "High Potential", "0": "Low Potential"},
+        "probability_raster": PROB_FILE,
+        "transform": manifest.get("transform"),
+        "crs": manifest.get("crs"),
+        "summary": totals,
+    }
+    with open(os.path.join(out_dir, "potential.json"), "w") as fh:
+        json.dump(out_manifest, fh, indent=2)
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Map groundwater potential over gridded predictor layers.")
+    parser.add_argument("manifest", help="JSON layer manifest")
+    parser.add_argument("out_dir")
+    parser.add_argument("--tile", type=int, default=DEFAULT_TILE)
+    parser.add_argument("--workers", type=int, default=None, help="0 = run in-process")
+    parser.add_argument("--artifact-dir", default=BASE_DIR)
+    args = parser.parse_args()
+
+    def _progress(done, total):
+        sys.stderr.write(f"\r[map] tile {done}/{total}")
+        sys.stderr.flush()
+
+    totals = map_potential(args.manifest, args.out_dir, tile=args.tile,
+                           workers=args.workers, artifact_dir=args.artifact_dir,
+                           progress=_progress)
+    sys.stderr.write("\n")
+    mpix = totals["pixels"] / 1e6
+    print(
+        f"{mpix:.1f} Mpx in {totals['tiles']} tiles, {totals['seconds']:.1f} s "
+        f"({mpix / max(totals['seconds'], 1e-9):.1f} Mpx/s): "
+        f"{totals['high']:,} high, {totals['low']:,} low, {totals['nodata']:,} nodata"
+    )
+
+
+if __name__ == "__main__":
+    main()
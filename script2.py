@@ -1,21 +1,18 @@
+import os
+import tempfile
+
 import streamlit as st
 import pandas as pd
-import numpy as np
-import joblib
 
-# Load model, scaler, and encoder
-model = joblib.load("svm_model_boruta.pkl")
-scaler = joblib.load("scaler_boruta.pkl")
-encoder = joblib.load("ordinal_encoder.pkl")
+from artifacts import get_artifacts
+from batch_scoring import score_file
+from prediction import predict_one
 
-# Boruta-selected features (variable-level)
-important_features = [
-    'Geological.Features',
-    'Elevation',
-    'Natural.vegitation..tree..vigour',
-    'Natural.vegitation..tree..height',
-    'Drainage.Density'
-]
+# Load model, scaler, and encoder (shared, hot-reloading registry; the
+# Boruta-selected features come from selected_features.pkl)
+artifacts = get_artifacts()
+for name, path, err in artifacts.errors:
+    st.error(f"Could not load {name} from {path}: {err}")
 
 # Full original feature list
 original_features = [
@@ -32,28 +29,33 @@ st.title("🌍Groundwater  Potential Mapping (SVM + Boruta)")
 st.markdown("Predict **High vs Low Potential** using Boruta-selected features and an SVM model trained with ordinal encoding.")
 
 # --- Upload CSV for batch predictions ---
-uploaded_file = st.file_uploader("Upload a CSV file with predictors", type=["csv"])
-if uploaded_file is not None:
-    df_new = pd.read_csv(uploaded_file)
-    st.write("Uploaded data preview:", df_new.head())
-
-    # Apply encoder
-    df_encoded = pd.DataFrame(
-        encoder.transform(df_new),
-        columns=original_features
-    )
-
-    # Select Boruta features
-    df_selected = df_encoded[important_features]
+# Streamed in chunks (see batch_scoring.py) so large survey exports do not
+# have to fit in memory; results go to a file offered for download.
+# Arrow / Parquet files from columnar.py are scored from their dictionary
+# codes without parsing strings.
+uploaded_file = st.file_uploader("Upload a CSV file with predictors",
+                                 type=["csv", "arrow", "feather", "parquet"])
+use_pool = st.checkbox("Use all CPU cores (large files)", value=False)
+if uploaded_file is not None and st.button("Score uploaded file"):
+    bar = st.progress(0.0, text="Scoring…")
 
-    # Scale
-    df_scaled = scaler.transform(df_selected)
+    def _progress(rows, fraction):
+        bar.progress(fraction or 0.0, text=f"Scored {rows:,} rows")
 
-    # Predict
-    preds = model.predict(df_scaled)
-    df_new["Prediction"] = np.where(preds == 1, "High Potential", "Low Potential")
+    # The output only lives until its bytes are read for the download
+    with tempfile.TemporaryDirectory() as tmp:
+        out_path = os.path.join(tmp, "predictions.csv")
+        stats = score_file(uploaded_file, out_path, workers=None if use_pool else 0,
+                           progress=_progress)
+        preview = pd.read_csv(out_path, nrows=50)
+        with open(out_path, "rb") as fh:
+            scored = fh.read()
+    bar.progress(1.0, text=f"Scored {stats['rows']:,} rows in {stats['seconds']:.1f} s")
+    if stats["unknown_rows"]:
+        st.warning(f"{stats['unknown_rows']:,} rows contain values the model was not trained on; their prediction is left empty.")
 
-    st.write("Predictions:", df_new)
+    st.write("Predictions (first rows):", preview)
+    st.download_button("Download predictions", scored, file_name="predictions.csv", mime="text/csv")
 
 # --- Manual input for single prediction ---
 st.header("🔍 Try a single prediction")
@@ -62,18 +64,5 @@ for feat in original_features:
     inputs[feat] = st.text_input(f"{feat}")
 
 if st.button("Predict"):
-    X_input = pd.DataFrame([inputs])
-
-    # Apply encoder
-    X_encoded = pd.DataFrame(
-        encoder.transform(X_input),
-        columns=original_features
-    )
-
-    # Select Boruta features
-    X_selected = X_encoded[important_features]
-
-    # Scale and predict
-    X_scaled = scaler.transform(X_selected)
-    pred = model.predict(X_scaled)[0]
+    pred, _ = predict_one(artifacts, inputs)
     st.success(f"Prediction: {'High Potential' if pred == 1 else 'Low Potential'}")
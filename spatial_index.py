@@ -0,0 +1,447 @@
+import argparse
+import os
+import threading
+import time
+from itertools import chain
+
+import numpy as np
+
+# -----------------------------------------------------------------------
+# Spatial index of surveyed and predicted points
+#
+# Once a GPS fix lands in st.session_state["detected_latlon"], the Predict
+# page knew nothing about ground truth or earlier predictions around it.
+# SpatialIndex keeps every georeferenced point the app has seen:
+#
+#   observation   a surveyed point with its Decision (ground truth),
+#                 added from a Bulk Predict upload or `add`
+#   prediction    a Predict-page result at a detected location (the
+#                 page logs at most one per session and location)
+#
+# and answers k-nearest and radius queries around a location.  A
+# record's time doubles as its identity: add_prediction() returns it,
+# and context() leaves out the records passed as `exclude`, so a
+# session is not shown its own predictions as context.
+#
+# Points are bucketed on a regular lat/lon grid (DEFAULT_CELL_DEG, about
+# 5.5 km) with one bucket list per kind.  Adding points appends to
+# buckets and never rebuilds anything.  A radius query reads the cells
+# overlapping the query's bounding box and measures haversine distances
+# to their points only.  A k-nearest query widens a ring of cells until
+# it has k candidates, then runs the radius query at the k-th candidate's
+# distance, so the result is exact.  With a few hundred thousand points
+# either query touches a handful of cells and takes well under a
+# millisecond.  Longitudes are not wrapped at the antimeridian.
+#
+# The index is persistent: the points live in an append-only file of
+# fixed-size records (RECORD), and add() writes there first.  refresh()
+# indexes whatever was appended since the last call, from this process
+# or from another Streamlit worker, so every process sees new points
+# without reloading.  Opening an index reads the file once and buckets it
+# in bulk.
+#
+# GWP_SPATIAL_INDEX sets the file (default spatial_index.bin next to the
+# app).
+#
+#     python spatial_index.py add surveyed_points.csv     # needs Decision
+#     python spatial_index.py query -17.83 31.05 --k 5 --radius-km 10
+#     python spatial_index.py bench --points 300000
+# -----------------------------------------------------------------------
+
+OBSERVATION = 0
+PREDICTION = 1
+KINDS = {"observation": OBSERVATION, "prediction": PREDICTION}
+
+# 32 bytes per point; label is 1 (High), 0 (Low) or -1 (unknown),
+# prob is P(High) for predictions and NaN for observations.
+RECORD = np.dtype([("lat", "<f8"), ("lon", "<f8"), ("time", "<f8"),
+                   ("prob", "<f4"), ("kind", "u1"), ("label", "i1"), ("_pad", "V2")])
+
+DEFAULT_CELL_DEG = 0.05
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEG = EARTH_RADIUS_KM * np.pi / 180.0
+DEFAULT_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "spatial_index.bin")
+
+
+def haversine_km(lat, lon, lats, lons):
+    lat, lon = np.radians(lat), np.radians(lon)
+    lats, lons = np.radians(lats), np.radians(lons)
+    a = (np.sin((lats - lat) / 2.0) ** 2
+         + np.cos(lat) * np.cos(lats) * np.sin((lons - lon) / 2.0) ** 2)
+    return 2.0 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def records(lats, lons, kind, labels=None, probs=None, times=None):
+    """A RECORD array for parallel arrays of points."""
+    lats = np.atleast_1d(np.asarray(lats, dtype=np.float64))
+    out = np.zeros(len(lats), dtype=RECORD)
+    out["lat"] = lats
+    out["lon"] = np.atleast_1d(np.asarray(lons, dtype=np.float64))
+    out["kind"] = kind
+    out["label"] = -1 if labels is None else np.atleast_1d(labels)
+    out["prob"] = np.nan if probs is None else np.atleast_1d(probs)
+    out["time"] = time.time() if times is None else np.atleast_1d(times)
+    return out
+
+
+class SpatialIndex:
+    def __init__(self, path=None, cell_deg=DEFAULT_CELL_DEG):
+        self.path = path
+        self.cell_deg = float(cell_deg)
+        self._lock = threading.RLock()
+        self._reset()
+        if path is not None:
+            self.refresh()
+
+    def _reset(self):
+        self._data = np.zeros(1024, dtype=RECORD)
+        self._n = 0
+        self._offset = 0  # bytes of the file already indexed
+        self._cells = {OBSERVATION: {}, PREDICTION: {}}
+        self._bounds = {}  # kind -> (min i, max i, min j, max j) of occupied cells
+        self._observed = set()
+
+    def __len__(self):
+        return self._n
+
+    def counts(self):
+        with self._lock:
+            kinds = self._data["kind"][:self._n]
+            return {name: int((kinds == k).sum()) for name, k in KINDS.items()}
+
+    # -------------------------------------------------------------------
+    # Updates
+    # -------------------------------------------------------------------
+    def _cell(self, lats, lons):
+        return (np.floor(np.asarray(lats) / self.cell_deg).astype(np.int64),
+                np.floor(np.asarray(lons) / self.cell_deg).astype(np.int64))
+
+    def _index(self, recs):
+        # Caller holds the lock
+        n = len(recs)
+        if not n:
+            return
+        if self._n + n > len(self._data):
+            grown = np.zeros(max(2 * len(self._data), self._n + n), dtype=RECORD)
+            grown[:self._n] = self._data[:self._n]
+            self._data = grown
+        start = self._n
+        self._data[start:start + n] = recs
+        self._n += n
+
+        ci, cj = self._cell(recs["lat"], recs["lon"])
+        kind = recs["kind"].astype(np.int64)
+        order = np.lexsort((cj, ci, kind))
+        keys = np.stack([kind[order], ci[order], cj[order]], axis=1)
+        bounds = np.flatnonzero(np.any(keys[1:] != keys[:-1], axis=1)) + 1
+        rows = (order + start).tolist()
+        for lo, hi in zip(chain([0], bounds.tolist()), chain(bounds.tolist(), [n])):
+            k, i, j = keys[lo].tolist()
+            self._cells[k].setdefault((i, j), []).extend(rows[lo:hi])
+            b = self._bounds.get(k)
+            self._bounds[k] = (i, i, j, j) if b is None else (
+                min(b[0], i), max(b[1], i), min(b[2], j), max(b[3], j))
+
+        obs = recs[recs["kind"] == OBSERVATION]
+        self._observed.update(zip(obs["lat"].tolist(), obs["lon"].tolist(), obs["label"].tolist()))
+
+    def refresh(self):
+        """Index records appended to the file since the last refresh (by any
+        process); returns how many were added."""
+        if self.path is None:
+            return 0
+        with self._lock:
+            try:
+                size = os.path.getsize(self.path)
+            except FileNotFoundError:
+                size = 0
+            if size < self._offset:  # replaced or truncated: start over
+                self._reset()
+            # Whole records only; another process may be mid-append
+            end = size - size % RECORD.itemsize
+            if end <= self._offset:
+                return 0
+            with open(self.path, "rb") as fh:
+                fh.seek(self._offset)
+                recs = np.frombuffer(fh.read(end - self._offset), dtype=RECORD)
+            self._offset = end
+            self._index(recs)
+            return len(recs)
+
+    def add(self, recs):
+        """Append RECORD array `recs` (see records()).  Observations already
+        in the index (same position and label) are skipped.  Returns how
+        many points were added."""
+        recs = np.asarray(recs, dtype=RECORD)
+        with self._lock:
+            self.refresh()
+            keep = np.ones(len(recs), dtype=bool)
+            seen = set()
+            for i in np.flatnonzero(recs["kind"] == OBSERVATION).tolist():
+                key = (float(recs["lat"][i]), float(recs["lon"][i]), int(recs["label"][i]))
+                keep[i] = key not in self._observed and key not in seen
+                seen.add(key)
+            recs = recs[keep & np.isfinite(recs["lat"]) & np.isfinite(recs["lon"])]
+            if not len(recs):
+                return 0
+            if self.path is None:
+                self._index(recs)
+                return len(recs)
+            # One O_APPEND write of whole records; then index it like any
+            # other process's append.
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, recs.tobytes())
+            finally:
+                os.close(fd)
+            self.refresh()
+            return len(recs)
+
+    def add_prediction(self, lat, lon, label, prob_high):
+        """Log one prediction; returns its record time (see exclude_own)."""
+        rec = records(lat, lon, PREDICTION, labels=int(label), probs=float(prob_high))
+        self.add(rec)
+        return float(rec["time"][0])
+
+    # -------------------------------------------------------------------
+    # Queries
+    # -------------------------------------------------------------------
+    def _block_rows(self, cells, i0, i1, j0, j1, ring=None):
+        """Rows in the cells of the block [i0, i1] x [j0, j1] (only its
+        outer ring of cells when `ring` is given)."""
+        if (i1 - i0 + 1) * (j1 - j0 + 1) > len(cells):
+            # A large block over a sparse grid: walk the occupied cells
+            keys = [key for key in cells if i0 <= key[0] <= i1 and j0 <= key[1] <= j1]
+        else:
+            keys = [(i, j) for i in range(i0, i1 + 1) for j in range(j0, j1 + 1)]
+        if ring is not None and ring > 0:
+            keys = [key for key in keys if key[0] in (i0, i1) or key[1] in (j0, j1)]
+        lists = [cells[key] for key in keys if key in cells]
+        if not lists:
+            return np.empty(0, dtype=np.int64)
+        return np.fromiter(chain.from_iterable(lists), np.int64)
+
+    def _box_rows(self, cells, lat, lon, radius_km):
+        dlat = radius_km / KM_PER_DEG
+        coslat = max(np.cos(np.radians(min(abs(lat) + dlat, 90.0))), 1e-12)
+        dlon = min(radius_km / (KM_PER_DEG * coslat), 180.0)
+        (i0, i1), (j0, j1) = self._cell([lat - dlat, lat + dlat], [lon - dlon, lon + dlon])
+        return self._block_rows(cells, i0, i1, j0, j1)
+
+    def _result(self, rows, dist, order):
+        rows, dist = rows[order], dist[order]
+        out = self._data[rows].copy()
+        return out, dist
+
+    def within(self, lat, lon, radius_km, kind=OBSERVATION, limit=None):
+        """(RECORD array, distances in km) of the points of `kind` within
+        `radius_km`, nearest first (at most `limit`)."""
+        with self._lock:
+            cells = self._cells[kind]
+            rows = self._box_rows(cells, lat, lon, radius_km)
+            dist = haversine_km(lat, lon, self._data["lat"][rows], self._data["lon"][rows])
+            inside = np.flatnonzero(dist <= radius_km)
+            order = inside[np.argsort(dist[inside], kind="stable")][:limit]
+            return self._result(rows, dist, order)
+
+    def nearest(self, lat, lon, k=5, kind=OBSERVATION, max_km=None):
+        """(RECORD array, distances in km) of the `k` points of `kind`
+        nearest to (lat, lon), optionally no further than `max_km`."""
+        with self._lock:
+            cells = self._cells[kind]
+            if not cells or k <= 0:
+                return self._result(np.empty(0, np.int64), np.empty(0), slice(None))
+            ci, cj = (int(v) for v in self._cell(lat, lon))
+            i0, i1, j0, j1 = self._bounds[kind]
+            # Rings closer than the occupied cells are empty; rings past
+            # them add nothing.
+            r = max(i0 - ci, ci - i1, j0 - cj, cj - j1, 0)
+            last = max(abs(ci - i0), abs(ci - i1), abs(cj - j0), abs(cj - j1))
+            found = 0
+            while True:
+                found += len(self._block_rows(cells, ci - r, ci + r, cj - r, cj + r, ring=r))
+                if found >= k or r >= last:
+                    break
+                r += 1
+            rows = self._block_rows(cells, ci - r, ci + r, cj - r, cj + r)
+            dist = haversine_km(lat, lon, self._data["lat"][rows], self._data["lon"][rows])
+            kth = min(k, len(dist)) - 1
+            radius = float(np.partition(dist, kth)[kth])
+        if max_km is not None:
+            radius = min(radius, max_km)
+        return self.within(lat, lon, radius, kind=kind, limit=k)
+
+
+def exclude_own(recs, dists, exclude):
+    """Drop the records whose time is in `exclude` (times returned by
+    add_prediction() in the caller's session)."""
+    exclude = np.fromiter(exclude, np.float64)
+    if not len(exclude) or not len(recs):
+        return recs, dists
+    keep = ~np.isin(recs["time"], exclude)
+    return recs[keep], dists[keep]
+
+
+def context(index, lat, lon, k=5, radius_km=10.0, exclude=()):
+    """What the Predict page shows next to the SVC output: the `k`
+    nearest surveyed points and the earlier predictions within
+    `radius_km`, other than the caller's own (`exclude`)."""
+    obs, obs_km = index.nearest(lat, lon, k=k)
+    preds, pred_km = exclude_own(*index.within(lat, lon, radius_km, kind=PREDICTION), exclude)
+    labelled = obs["label"] >= 0
+    return {
+        "observations": obs,
+        "observation_km": obs_km,
+        "observed_high": int((obs["label"][labelled] == 1).sum()),
+        "observed_labelled": int(labelled.sum()),
+        "predictions": preds,
+        "prediction_km": pred_km,
+        "predicted_high": int((preds["label"] == 1).sum()),
+        "radius_km": radius_km,
+    }
+
+
+def overlay(m, ctx, limit=200):
+    """Draw the points of context() on folium map `m`: filled circles for
+    surveyed points, rings for earlier predictions; green High, red Low."""
+    import folium
+
+    colours = {1: "#2e7d32", 0: "#c62828", -1: "#757575"}
+    names = {1: "High Potential", 0: "Low Potential", -1: "unknown"}
+    layer = folium.FeatureGroup(name="Nearby points")
+    for recs, dists, filled, what in ((ctx["observations"], ctx["observation_km"], True, "Surveyed"),
+                                      (ctx["predictions"][:limit], ctx["prediction_km"][:limit],
+                                       False, "Predicted")):
+        for rec, km in zip(recs, dists):
+            label = int(rec["label"])
+            folium.CircleMarker(
+                location=[float(rec["lat"]), float(rec["lon"])],
+                radius=7 if filled else 6,
+                color=colours[label],
+                weight=2,
+                fill=filled,
+                fill_opacity=0.8,
+                popup=f"{what}: {names[label]} ({km:.2f} km)",
+            ).add_to(layer)
+    layer.add_to(m)
+    return m
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_spatial_index():
+    """The process-wide index over GWP_SPATIAL_INDEX (refreshed on each
+    call, which costs one stat() when nothing was appended)."""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = SpatialIndex(os.environ.get("GWP_SPATIAL_INDEX", DEFAULT_FILE))
+    _index.refresh()
+    return _index
+
+
+def observations_from_frame(frame):
+    """RECORD array of the labelled rows of a frame with coordinate and
+    Decision columns (unlabelled rows are skipped)."""
+    from bulk_scoring import coordinate_columns
+    from training import TARGET, TARGET_MAP
+
+    lat_col, lon_col = coordinate_columns(frame)
+    if TARGET not in frame.columns:
+        raise ValueError(f"Need a '{TARGET}' column with the surveyed outcome.")
+    labels = frame[TARGET].astype(str).str.strip().map(TARGET_MAP)
+    frame = frame[labels.notna()]
+    return records(frame[lat_col].to_numpy(dtype=float), frame[lon_col].to_numpy(dtype=float),
+                   OBSERVATION, labels=labels[labels.notna()].to_numpy(dtype=np.int8))
+
+
+def _bench(args):
+    import tempfile
+
+    rng = np.random.default_rng(0)
+    # Roughly Zimbabwe
+    lats = rng.uniform(-22.4, -15.6, args.points)
+    lons = rng.uniform(25.2, 33.1, args.points)
+    recs = records(lats, lons, OBSERVATION, labels=rng.integers(0, 2, args.points))
+    qlat = rng.uniform(-22.4, -15.6, args.queries)
+    qlon = rng.uniform(25.2, 33.1, args.queries)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "index.bin")
+        index = SpatialIndex(path)
+        t0 = time.perf_counter()
+        index.add(recs)
+        print(f"add {args.points:,} points        {time.perf_counter() - t0:8.3f} s")
+        t0 = time.perf_counter()
+        reopened = SpatialIndex(path)
+        print(f"open from disk             {time.perf_counter() - t0:8.3f} s  ({len(reopened):,} points)")
+
+        t0 = time.perf_counter()
+        for la, lo in zip(qlat, qlon):
+            index.nearest(la, lo, k=args.k)
+        print(f"nearest k={args.k:<3d}             {(time.perf_counter() - t0) / args.queries * 1e3:8.3f} ms/query")
+        t0 = time.perf_counter()
+        for la, lo in zip(qlat, qlon):
+            index.within(la, lo, args.radius_km)
+        print(f"within {args.radius_km:g} km            {(time.perf_counter() - t0) / args.queries * 1e3:8.3f} ms/query")
+        t0 = time.perf_counter()
+        for la, lo in zip(qlat[:100], qlon[:100]):
+            index.add_prediction(la, lo, 1, 0.9)
+        print(f"add one prediction         {(time.perf_counter() - t0) / 100 * 1e3:8.3f} ms")
+
+        # Exactness against brute force
+        for la, lo in zip(qlat[:200], qlon[:200]):
+            got, got_km = index.nearest(la, lo, k=args.k)
+            ref = np.sort(haversine_km(la, lo, lats, lons))[:args.k]
+            assert np.allclose(got_km, ref), (la, lo)
+        print("nearest matches brute force on 200 queries")
+
+
+def main():
+    import pandas as pd
+
+    parser = argparse.ArgumentParser(description="Spatial index of surveyed and predicted points.")
+    parser.add_argument("--path", default=os.environ.get("GWP_SPATIAL_INDEX", DEFAULT_FILE))
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("add", help="add surveyed points from a CSV with coordinates and Decision")
+    p.add_argument("input")
+
+    p = sub.add_parser("query", help="nearest surveyed points and earlier predictions")
+    p.add_argument("lat", type=float)
+    p.add_argument("lon", type=float)
+    p.add_argument("--k", type=int, default=5)
+    p.add_argument("--radius-km", type=float, default=10.0)
+
+    sub.add_parser("info", help="point counts")
+
+    p = sub.add_parser("bench", help="time queries on synthetic points")
+    p.add_argument("--points", type=int, default=300_000)
+    p.add_argument("--queries", type=int, default=2000)
+    p.add_argument("--k", type=int, default=5)
+    p.add_argument("--radius-km", type=float, default=10.0)
+    args = parser.parse_args()
+
+    if args.command == "bench":
+        _bench(args)
+        return
+
+    index = SpatialIndex(args.path)
+    if args.command == "add":
+        added = index.add(observations_from_frame(pd.read_csv(args.input)))
+        print(f"added {added:,} surveyed points -> {args.path} ({len(index):,} points)")
+    elif args.command == "info":
+        print(f"{args.path}: {len(index):,} points {index.counts()}")
+    else:
+        ctx = context(index, args.lat, args.lon, k=args.k, radius_km=args.radius_km)
+        for rec, km in zip(ctx["observations"], ctx["observation_km"]):
+            print(f"surveyed   {rec['lat']:.6f} {rec['lon']:.6f}  {km:7.3f} km  label {rec['label']}")
+        print(f"{len(ctx['predictions']):,} earlier predictions within {args.radius_km:g} km, "
+              f"{ctx['predicted_high']:,} High")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,353 @@
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+from artifacts import BASE_DIR, DATA_FILE
+
+# -----------------------------------------------------------------------
+# Synthetic survey generator
+#
+# augmented_data.csv has about 250 rows, far too few to test anything at
+# production volume.  SurveyModel learns from it
+#
+#   p(Decision)                 the class balance
+#   p(predictors | Decision)    the joint distribution of the predictor
+#                               levels within each class, smoothed towards
+#                               the product of the per-class marginals:
+#
+#       (1 - smoothing) * observed joint + smoothing * independent
+#
+# so combinations never surveyed still turn up (smoothing=0 replays only
+# observed combinations, 1 treats the predictors as independent given the
+# class).  The joint is a table over every combination of levels (about
+# 1.7k cells here); schemas whose cross product exceeds MAX_JOINT_CELLS
+# fall back to the independent model.
+#
+# Generation is vectorized: draw the class of every row, then one
+# searchsorted into that class's cumulative cell table, then unravel the
+# cell into level codes.  Rows are drawn in fixed blocks of BLOCK_ROWS,
+# block b from its own generator seeded with (seed, b), and written in
+# chunks cut from the blocks: the same seed gives the same rows whatever
+# the chunk size, a shorter file is a prefix of a longer one, and blocks
+# could be produced in any order.  Rows go out as Arrow
+# record batches whose predictors are dictionary columns with the
+# model's levels (columnar.py): CSV through pyarrow's writer, or an Arrow
+# IPC / Parquet file that batch scoring and training read without
+# parsing strings.
+#
+# With --coords every row gets a Latitude / Longitude.  Rows are spread
+# around survey sites scattered over a bounding box (Zimbabwe by
+# default), and each site shifts the log-odds of High by its own random
+# offset, so outcomes are spatially correlated the way field data is.
+# The intercept is recalibrated so the overall class balance still
+# matches the source.
+#
+#     python synthetic.py survey_100m.csv --rows 100000000 --unlabelled
+#     python synthetic.py train_1m.arrow --rows 1000000
+#     python synthetic.py points.csv --rows 500000 --coords --check
+#
+# The outputs feed training.py --data, batch_scoring.py / script2.py,
+# bulk_scoring.py, spatial_index.py and interpolation.py.
+# -----------------------------------------------------------------------
+
+DEFAULT_SMOOTHING = 0.2
+DEFAULT_CHUNK_ROWS = 1_000_000
+BLOCK_ROWS = 1 << 16
+MAX_JOINT_CELLS = 2_000_000
+
+LAT_COLUMN = "Latitude"
+LON_COLUMN = "Longitude"
+DEFAULT_BBOX = (-22.4, 25.2, -15.6, 33.1)  # south, west, north, east
+DEFAULT_SITES = 2000
+DEFAULT_SPREAD_KM = 3.0
+DEFAULT_SPATIAL_STRENGTH = 1.5
+
+
+class SurveyModel:
+    def __init__(self, features, levels, classes, class_prior, cell_probs=None,
+                 marginals=None, target="Decision"):
+        self.features = list(features)
+        self.levels = [np.asarray(lv, dtype=object) for lv in levels]
+        self.classes = list(classes)           # class index -> Decision label
+        self.class_prior = np.asarray(class_prior, dtype=np.float64)
+        self.radix = tuple(len(lv) for lv in self.levels)
+        self.target = target
+        # Either a joint table (classes, cells) or per-class marginals
+        # [class][feature] -> probabilities over that feature's levels
+        self.cell_probs = cell_probs
+        self.marginals = marginals
+        self._cdf = None if cell_probs is None else np.cumsum(cell_probs, axis=1)
+        if self._cdf is not None:
+            self._cdf[:, -1] = 1.0
+        self._marginal_cdf = None if marginals is None else [
+            [np.cumsum(p) for p in per_class] for per_class in marginals
+        ]
+
+    @property
+    def high(self):
+        """Class index of High Potential."""
+        return self.classes.index("High Potential")
+
+    @classmethod
+    def fit(cls, frame, target="Decision", smoothing=DEFAULT_SMOOTHING,
+            max_cells=MAX_JOINT_CELLS):
+        """Learn the model from a labelled survey frame."""
+        labels = frame[target].astype(str).str.strip()
+        classes = sorted(labels.unique())
+        y = np.searchsorted(classes, labels.to_numpy())
+        features = [c for c in frame.columns if c != target]
+        levels, codes = [], []
+        for f in features:
+            col = frame[f].astype(str)
+            lv = sorted(col.unique())
+            levels.append(lv)
+            codes.append(np.searchsorted(lv, col.to_numpy()))
+        codes = np.stack(codes, axis=1)
+        radix = tuple(len(lv) for lv in levels)
+        class_prior = np.bincount(y, minlength=len(classes)) / len(y)
+
+        marginals = [
+            [np.bincount(codes[y == c, i], minlength=r) / max((y == c).sum(), 1)
+             for i, r in enumerate(radix)]
+            for c in range(len(classes))
+        ]
+        n_cells = int(np.prod(radix, dtype=np.float64))
+        if n_cells > max_cells:
+            return cls(features, levels, classes, class_prior, marginals=marginals, target=target)
+
+        cells = np.ravel_multi_index(codes.T, radix)
+        cell_probs = np.empty((len(classes), n_cells))
+        for c in range(len(classes)):
+            observed = np.bincount(cells[y == c], minlength=n_cells) / max((y == c).sum(), 1)
+            independent = marginals[c][0]
+            for p in marginals[c][1:]:
+                independent = np.multiply.outer(independent, p)
+            cell_probs[c] = (1.0 - smoothing) * observed + smoothing * independent.ravel()
+        return cls(features, levels, classes, class_prior, cell_probs=cell_probs, target=target)
+
+    @classmethod
+    def from_csv(cls, path=None, **kwargs):
+        return cls.fit(read_source(path), **kwargs)
+
+    def sample_codes(self, rng, y):
+        """Level codes (rows, features) for rows of classes `y`."""
+        codes = np.empty((len(y), len(self.features)), dtype=np.int64)
+        for c in range(len(self.classes)):
+            rows = np.flatnonzero(y == c)
+            if not len(rows):
+                continue
+            if self._cdf is not None:
+                cells = np.searchsorted(self._cdf[c], rng.random(len(rows)), side="right")
+                codes[rows] = np.stack(np.unravel_index(cells, self.radix), axis=1)
+            else:
+                for i, cdf in enumerate(self._marginal_cdf[c]):
+                    codes[rows, i] = np.searchsorted(cdf, rng.random(len(rows)), side="right")
+        return np.minimum(codes, np.asarray(self.radix) - 1)
+
+
+def read_source(path=None):
+    import pandas as pd
+
+    from artifacts import DATA_COLUMNS
+
+    frame = pd.read_csv(path or os.path.join(BASE_DIR, DATA_FILE))
+    frame.columns = DATA_COLUMNS
+    return frame
+
+
+class Sites:
+    """Survey sites over a bounding box, each with a log-odds offset for
+    High Potential; rows are scattered around a random site."""
+
+    def __init__(self, seed, p_high, bbox=DEFAULT_BBOX, sites=DEFAULT_SITES,
+                 spread_km=DEFAULT_SPREAD_KM, strength=DEFAULT_SPATIAL_STRENGTH):
+        from spatial_index import KM_PER_DEG
+
+        rng = np.random.default_rng([seed, 1])
+        south, west, north, east = bbox
+        self.lat = rng.uniform(south, north, sites)
+        self.lon = rng.uniform(west, east, sites)
+        self.spread_lat = spread_km / KM_PER_DEG
+        self.spread_lon = spread_km / (KM_PER_DEG * np.maximum(np.cos(np.radians(self.lat)), 1e-6))
+        offset = rng.normal(0.0, strength, sites)
+        self.p_high = _sigmoid(_calibrate(offset, p_high) + offset)
+
+    def sample(self, rng, n):
+        site = rng.integers(0, len(self.lat), n)
+        lat = self.lat[site] + rng.normal(0.0, 1.0, n) * self.spread_lat
+        lon = self.lon[site] + rng.normal(0.0, 1.0, n) * self.spread_lon[site]
+        return site, lat, lon
+
+
+def _sigmoid(x):
+    return 1.0 / (1.0 + np.exp(-x))
+
+
+def _calibrate(offset, p_high):
+    # Intercept b with mean(sigmoid(b + offset)) == p_high (monotone in b)
+    lo, hi = -50.0, 50.0
+    for _ in range(100):
+        mid = (lo + hi) / 2.0
+        if _sigmoid(mid + offset).mean() < p_high:
+            lo = mid
+        else:
+            hi = mid
+    return (lo + hi) / 2.0
+
+
+def generate(model, rows, seed=0, chunk_rows=DEFAULT_CHUNK_ROWS, labelled=True, sites=None,
+             high_share=None):
+    """Yield pyarrow RecordBatches of `rows` synthetic rows.
+
+    high_share overrides the learned share of High Potential; `sites`
+    (a Sites) adds coordinates and spatially correlated outcomes.
+    """
+    import pyarrow as pa
+
+    from columnar import codes_column
+
+    if sites is not None and len(model.classes) != 2:
+        raise ValueError("Coordinates need a two-class Decision")
+    prior = model.class_prior.copy()
+    if high_share is not None:
+        prior[:] = (1.0 - high_share) / max(len(prior) - 1, 1)
+        prior[model.high] = high_share
+    high = model.high
+
+    def _block(b):
+        rng = np.random.default_rng([seed, 0, b])
+        n = BLOCK_ROWS
+        if sites is not None:
+            site, lat, lon = sites.sample(rng, n)
+            y = np.where(rng.random(n) < sites.p_high[site], high, 1 - high)
+        else:
+            y = rng.choice(len(prior), n, p=prior)
+            lat = lon = np.empty(n)
+        return y, model.sample_codes(rng, y), lat, lon
+
+    for start in range(0, rows, chunk_rows):
+        end = min(start + chunk_rows, rows)
+        parts = []
+        for b in range(start // BLOCK_ROWS, (end - 1) // BLOCK_ROWS + 1):
+            lo = max(start - b * BLOCK_ROWS, 0)
+            hi = min(end - b * BLOCK_ROWS, BLOCK_ROWS)
+            parts.append([a[lo:hi] for a in _block(b)])
+        y, codes, lat, lon = (np.concatenate(p) for p in zip(*parts))
+
+        arrays, names = [], []
+        if labelled:
+            arrays.append(codes_column(y, model.classes))
+            names.append(model.target)
+        for j, f in enumerate(model.features):
+            arrays.append(codes_column(codes[:, j], model.levels[j]))
+            names.append(f)
+        if sites is not None:
+            arrays += [pa.array(np.round(lat, 6)), pa.array(np.round(lon, 6))]
+            names += [LAT_COLUMN, LON_COLUMN]
+        yield pa.RecordBatch.from_arrays(arrays, names=names)
+
+
+def write(path, model, rows, progress=None, **kwargs):
+    """generate() into `path` (.csv, .arrow/.feather/.ipc or .parquet)."""
+    from columnar import DatasetWriter
+
+    metadata = {"synthetic": {"rows": rows, "seed": kwargs.get("seed", 0),
+                              "labelled": kwargs.get("labelled", True),
+                              "coordinates": kwargs.get("sites") is not None}}
+    with DatasetWriter(path, metadata) as writer:
+        for batch in generate(model, rows, **kwargs):
+            writer.write(batch)
+            if progress is not None:
+                progress(writer.rows, rows)
+    return writer.rows
+
+
+def compare(model, frame):
+    """Class share and total-variation distance between the model's and
+    `frame`'s per-class predictor joint (or marginals)."""
+    labels = frame[model.target].astype(str).str.strip().to_numpy()
+    y = np.searchsorted(model.classes, labels)
+    codes = np.stack([
+        np.searchsorted(lv.astype(str), frame[f].astype(str).to_numpy())
+        for f, lv in zip(model.features, model.levels)
+    ], axis=1)
+    out = {"high_share": float((y == model.high).mean()),
+           "model_high_share": float(model.class_prior[model.high])}
+    if model.cell_probs is not None:
+        cells = np.ravel_multi_index(codes.T, model.radix)
+        tv = []
+        for c in range(len(model.classes)):
+            seen = np.bincount(cells[y == c], minlength=model.cell_probs.shape[1])
+            tv.append(0.5 * np.abs(seen / max(seen.sum(), 1) - model.cell_probs[c]).sum())
+        out["joint_tv"] = [float(v) for v in tv]
+    return out
+
+
+def main():
+    import pandas as pd
+
+    parser = argparse.ArgumentParser(description="Generate synthetic surveys from augmented_data.csv.")
+    parser.add_argument("output", help=".csv, .arrow/.feather/.ipc or .parquet")
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--source", default=os.path.join(BASE_DIR, DATA_FILE),
+                        help="labelled survey to learn from")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--chunk-rows", type=int, default=DEFAULT_CHUNK_ROWS)
+    parser.add_argument("--smoothing", type=float, default=DEFAULT_SMOOTHING,
+                        help="weight of the independent model (0 = observed combinations only)")
+    parser.add_argument("--unlabelled", action="store_true", help="omit the Decision column")
+    parser.add_argument("--high-share", type=float, default=None,
+                        help="share of High Potential rows (default: as in the source)")
+    parser.add_argument("--coords", action="store_true", help="add Latitude / Longitude")
+    parser.add_argument("--bbox", type=float, nargs=4, default=DEFAULT_BBOX,
+                        metavar=("SOUTH", "WEST", "NORTH", "EAST"))
+    parser.add_argument("--sites", type=int, default=DEFAULT_SITES)
+    parser.add_argument("--spread-km", type=float, default=DEFAULT_SPREAD_KM)
+    parser.add_argument("--spatial-strength", type=float, default=DEFAULT_SPATIAL_STRENGTH,
+                        help="sd of the per-site log-odds offset (0 = no spatial pattern)")
+    parser.add_argument("--check", action="store_true",
+                        help="compare the written file with the model (reads it back)")
+    args = parser.parse_args()
+
+    model = SurveyModel.from_csv(args.source, smoothing=args.smoothing)
+    sites = None
+    if args.coords:
+        p_high = args.high_share if args.high_share is not None else model.class_prior[model.high]
+        sites = Sites(args.seed, p_high, bbox=args.bbox, sites=args.sites,
+                      spread_km=args.spread_km, strength=args.spatial_strength)
+
+    start = time.perf_counter()
+
+    def _progress(done, total):
+        rate = done / max(time.perf_counter() - start, 1e-9)
+        sys.stderr.write(f"\r[synthetic] {done:,}/{total:,} rows  {rate:,.0f} rows/s")
+        sys.stderr.flush()
+
+    rows = write(args.output, model, args.rows, progress=_progress, seed=args.seed,
+                 chunk_rows=args.chunk_rows, labelled=not args.unlabelled, sites=sites,
+                 high_share=args.high_share)
+    sys.stderr.write("\n")
+    seconds = time.perf_counter() - start
+    print(f"{rows:,} rows in {seconds:.1f}s ({rows / max(seconds, 1e-9):,.0f} rows/s, "
+          f"{os.path.getsize(args.output) / 2**20:,.0f} MB) -> {args.output}")
+
+    if args.check:
+        if args.unlabelled:
+            parser.error("--check needs the Decision column")
+        from columnar import is_columnar, open_dataset
+
+        if is_columnar(args.output):
+            with open_dataset(args.output) as ds:
+                frame = ds.read().to_pandas()
+        else:
+            frame = pd.read_csv(args.output)
+        frame = frame[[model.target] + model.features]
+        print(f"synthetic: {compare(model, frame)}")
+        print(f"source:    {compare(model, read_source(args.source))}")
+
+
+if __name__ == "__main__":
+    main()
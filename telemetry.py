@@ -0,0 +1,288 @@
+import argparse
+import bisect
+import contextvars
+import os
+import threading
+import time
+from collections import deque
+
+# -----------------------------------------------------------------------
+# Per-stage timing spans
+#
+# The only production signal from the Predict page used to be the
+# print(..., flush=True) in the GPS handler.  Code on the request path now
+# wraps its stages in span("<stage>"); each span is one observation in an
+# in-process histogram for that stage:
+#
+#   artifact_load    ArtifactRegistry loading a generation
+#   csv_parse        reading the training CSV / a Bulk Predict upload
+#   geolocation      "Detect My Location" click -> coordinates in Python
+#   reverse_geocode  ReverseGeocoder.reverse (cache hit or backend call)
+#   spatial_query    nearby surveyed points / predictions (spatial_index)
+#   interpolation    the Predict page's potential surface (interpolation)
+#   table_lookup     lookup-table answer for one row
+#   encode           strings -> level codes / OrdinalEncoder
+#   scale            StandardScaler (sklearn path; the compiled kernel
+#                    folds scaling into its gather, see inference.py)
+#   predict          compiled kernel, or SVC.predict on the sklearn path
+#   predict_proba    SVC.predict_proba on the sklearn path
+#   folium_render    building the Predict map and st_folium()
+#
+# Every observation is also tagged with the session id (and rerun number)
+# in effect when it was taken - set_session() at the top of each
+# app.py rerun, carried into background threads by submitting through
+# contextvars.copy_context() - and kept in a bounded ring of recent
+# spans, so one slow session can be told apart from a slow stage.
+#
+# Histograms are exported in the Prometheus text format by
+# prometheus_text(): GET /metrics on inference_service.py, or on a
+# side port of the Streamlit process when GWP_METRICS_PORT is set.
+# Session ids are deliberately not Prometheus labels (one series per
+# visitor); they are in the recent spans, which app.py shows in its
+# debug panel (?debug=1 or GWP_DEBUG_PANEL=1).
+# -----------------------------------------------------------------------
+
+METRIC = "gwp_stage_duration_seconds"
+
+# Seconds; from the ~10 us table lookup up to a slow browser GPS prompt
+DEFAULT_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005,
+                   0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0)
+
+DEFAULT_RECENT = 5000
+
+_session = contextvars.ContextVar("gwp_session", default=(None, None))
+
+
+def set_session(session_id, rerun=None):
+    """Tag spans taken in this context (a Streamlit script run) with the
+    session id and rerun number."""
+    _session.set((session_id, rerun))
+
+
+def current_session():
+    return _session.get()
+
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # last one is +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        """Estimate from the buckets, interpolating linearly inside one."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if seen + n >= rank and n:
+                lo = self.buckets[i - 1] if i > 0 else 0.0
+                if i == len(self.buckets):
+                    return lo
+                return lo + (self.buckets[i] - lo) * (rank - seen) / n
+            seen += n
+        return self.buckets[-1]
+
+
+class _Span:
+    # A plain context manager: about half the cost of @contextmanager,
+    # which matters around the few-microsecond table lookup.
+    __slots__ = ("telemetry", "stage", "t0")
+
+    def __init__(self, telemetry, stage):
+        self.telemetry = telemetry
+        self.stage = stage
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.telemetry.observe(self.stage, time.perf_counter() - self.t0)
+        return False
+
+
+class Telemetry:
+    def __init__(self, buckets=DEFAULT_BUCKETS, recent=DEFAULT_RECENT):
+        self.buckets = tuple(buckets)
+        self.histograms = {}
+        self.recent = deque(maxlen=recent)
+        self.started = time.time()
+        self._lock = threading.Lock()
+
+    def observe(self, stage, seconds):
+        session, rerun = _session.get()
+        with self._lock:
+            hist = self.histograms.get(stage)
+            if hist is None:
+                hist = self.histograms[stage] = Histogram(self.buckets)
+            hist.observe(seconds)
+            self.recent.append((time.time(), session, rerun, stage, seconds))
+
+    def span(self, stage):
+        return _Span(self, stage)
+
+    def reset(self):
+        with self._lock:
+            self.histograms.clear()
+            self.recent.clear()
+
+    def summary(self):
+        """{stage: {count, mean_ms, p50_ms, p95_ms, p99_ms}}."""
+        with self._lock:
+            hists = {k: (h.count, h.sum, h.quantile(0.5), h.quantile(0.95), h.quantile(0.99))
+                     for k, h in self.histograms.items()}
+        return {
+            stage: {"count": n, "mean_ms": total / n * 1e3, "p50_ms": p50 * 1e3,
+                    "p95_ms": p95 * 1e3, "p99_ms": p99 * 1e3}
+            for stage, (n, total, p50, p95, p99) in sorted(hists.items())
+        }
+
+    def spans(self, session=None, limit=200):
+        """Most recent spans, newest first, optionally for one session."""
+        with self._lock:
+            events = list(self.recent)
+        out = []
+        for ts, sid, rerun, stage, seconds in reversed(events):
+            if session is not None and sid != session:
+                continue
+            out.append({"time": ts, "session": sid, "rerun": rerun,
+                        "stage": stage, "ms": seconds * 1e3})
+            if len(out) >= limit:
+                break
+        return out
+
+    def prometheus_text(self):
+        with self._lock:
+            hists = {k: (list(h.counts), h.count, h.sum) for k, h in self.histograms.items()}
+            sessions = len({sid for _, sid, _, _, _ in self.recent if sid is not None})
+        lines = [
+            f"# HELP {METRIC} Time spent per request stage.",
+            f"# TYPE {METRIC} histogram",
+        ]
+        for stage, (counts, n, total) in sorted(hists.items()):
+            cumulative = 0
+            for le, c in zip(self.buckets, counts):
+                cumulative += c
+                lines.append(f'{METRIC}_bucket{{stage="{stage}",le="{le:g}"}} {cumulative}')
+            lines.append(f'{METRIC}_bucket{{stage="{stage}",le="+Inf"}} {n}')
+            lines.append(f'{METRIC}_sum{{stage="{stage}"}} {total:.9g}')
+            lines.append(f'{METRIC}_count{{stage="{stage}"}} {n}')
+        lines += [
+            "# HELP gwp_recent_sessions Distinct session ids among the recent spans.",
+            "# TYPE gwp_recent_sessions gauge",
+            f"gwp_recent_sessions {sessions}",
+            "# HELP gwp_telemetry_start_time_seconds When this process started recording.",
+            "# TYPE gwp_telemetry_start_time_seconds gauge",
+            f"gwp_telemetry_start_time_seconds {self.started:.3f}",
+        ]
+        return "\n".join(lines) + "\n"
+
+
+_telemetry = Telemetry()
+
+
+def get_telemetry():
+    return _telemetry
+
+
+def span(stage):
+    return _telemetry.span(stage)
+
+
+def observe(stage, seconds):
+    _telemetry.observe(stage, seconds)
+
+
+# ===============================
+# Export
+# ===============================
+_server = None
+_server_lock = threading.Lock()
+
+
+def serve_metrics(port, host="0.0.0.0"):
+    """Serve GET /metrics from a daemon thread (once per process)."""
+    global _server
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class _Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = _telemetry.prometheus_text().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    with _server_lock:
+        if _server is None:
+            _server = ThreadingHTTPServer((host, int(port)), _Handler)
+            threading.Thread(target=_server.serve_forever, name="metrics", daemon=True).start()
+    return _server
+
+
+_started = False
+
+
+def serve_metrics_from_env():
+    """Start the GWP_METRICS_PORT server; app.py calls this on every rerun,
+    so only the first call in a process does anything (a bind failure is
+    reported once, not retried)."""
+    global _started
+    with _server_lock:
+        if _started:
+            return
+        _started = True
+    port = os.environ.get("GWP_METRICS_PORT")
+    if port:
+        try:
+            serve_metrics(port)
+        except OSError as e:
+            # Another Streamlit worker on this host already owns the port
+            print(f"[telemetry] metrics port {port} unavailable: {e}", flush=True)
+
+
+def main():
+    from artifacts import ArtifactRegistry, BASE_DIR
+    from prediction import predict_one
+    # The instance the instrumented modules report to, not __main__'s copy
+    from telemetry import get_telemetry, set_session
+
+    parser = argparse.ArgumentParser(description="Time the app's prediction stages and print Prometheus text.")
+    parser.add_argument("--artifact-dir", default=BASE_DIR)
+    parser.add_argument("--calls", type=int, default=20000)
+    args = parser.parse_args()
+
+    artifacts = ArtifactRegistry(base_dir=args.artifact_dir).current()
+    inputs = dict(artifacts.default_values)
+    predict_one(artifacts, inputs)
+
+    telemetry = get_telemetry()
+    set_session("bench", 0)
+    t0 = time.perf_counter()
+    for _ in range(args.calls):
+        predict_one(artifacts, inputs)
+    per_call = (time.perf_counter() - t0) / args.calls
+    print(telemetry.prometheus_text())
+    for stage, s in telemetry.summary().items():
+        print(f"{stage:16s} n={s['count']:7d}  mean {s['mean_ms']:.4f} ms  p95 {s['p95_ms']:.4f} ms")
+    print(f"predict_one with spans: {per_call * 1e6:.2f} us per call")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,276 @@
+import argparse
+import math
+import os
+import threading
+import time
+
+# -----------------------------------------------------------------------
+# Local map tile cache
+#
+# Every map in the app pulls its base tiles from tile.openstreetmap.org,
+# which is slow from the field, unavailable offline, and not meant for
+# heavy use (OSM tile usage policy).  TileCache keeps z/x/y.png tiles in a
+# directory, fetching a missing tile from the upstream server once (with
+# a proper User-Agent and a client-side rate limit) unless it runs
+# offline.  serve_tiles() serves the directory over HTTP from a daemon
+# thread of the app process (started once per process; a port another
+# worker already holds is remembered, not retried every rerun).
+#
+# `seed` pre-fetches an area ahead of a field trip.  Bulk downloading is
+# forbidden by the OSM tile usage policy, so it needs an upstream the
+# operator has configured and is allowed to bulk-fetch from (their own
+# tile server or a commercial provider); tile.openstreetmap.org is
+# refused.  Tiles a visitor actually views may still be fetched from it
+# on demand and cached.
+#
+# Configuration (environment):
+#   GWP_TILE_CACHE_DIR   serve tiles from this directory instead of OSM
+#   GWP_TILE_CACHE_PORT  port of the tile server (default 8765)
+#   GWP_TILE_URL         URL template the *browser* uses for the tile
+#                        server.  The default, http://localhost:<port>/
+#                        {z}/{x}/{y}.png, only works when the browser runs
+#                        on the server host; for remote visitors set it to
+#                        an address they can reach (e.g. a path on the
+#                        same reverse proxy as the app)
+#   GWP_TILE_UPSTREAM    URL template missing tiles are fetched from
+#                        (default tile.openstreetmap.org; also the
+#                        default `seed --upstream`, which must not be OSM)
+#   GWP_TILE_OFFLINE=1   never contact the upstream; missing tiles 404
+#
+#     python tile_cache.py seed --bbox -22.5 25.2 -15.6 33.1 --zoom 6-12 \
+#         --upstream "https://tiles.example.org/{z}/{x}/{y}.png"
+#     python tile_cache.py serve --port 8765
+# -----------------------------------------------------------------------
+
+UPSTREAM = "https://tile.openstreetmap.org/{z}/{x}/{y}.png"
+# Hosts whose usage policy forbids bulk pre-fetching
+NO_BULK_HOSTS = ("tile.openstreetmap.org", "tile.osm.org")
+ATTRIBUTION = "&copy; OpenStreetMap contributors"
+USER_AGENT = "gwp-mapping-tile-cache/1.0"
+DEFAULT_PORT = 8765
+DEFAULT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".tile_cache")
+MAX_ZOOM = 19
+
+
+class TileCache:
+    def __init__(self, directory=DEFAULT_DIR, upstream=UPSTREAM, offline=False,
+                 min_interval=0.1, timeout=10.0):
+        self.directory = directory
+        self.upstream = upstream
+        self.offline = offline
+        self.min_interval = min_interval
+        self.timeout = timeout
+        self.hits = 0
+        self.misses = 0
+        self._session = None
+        self._fetch_lock = threading.Lock()
+        self._last_fetch = 0.0
+
+    def path(self, z, x, y):
+        return os.path.join(self.directory, str(z), str(x), f"{y}.png")
+
+    def _fetch(self, z, x, y):
+        import requests
+
+        with self._fetch_lock:
+            if self._session is None:
+                self._session = requests.Session()
+                self._session.headers["User-Agent"] = USER_AGENT
+            wait = self._last_fetch + self.min_interval - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            self._last_fetch = time.monotonic()
+            resp = self._session.get(self.upstream.format(z=z, x=x, y=y), timeout=self.timeout)
+        resp.raise_for_status()
+        return resp.content
+
+    def get(self, z, x, y):
+        """PNG bytes of tile z/x/y, or None if not cached and not fetchable."""
+        z, x, y = int(z), int(x), int(y)
+        if not (0 <= z <= MAX_ZOOM and 0 <= x < 2 ** z and 0 <= y < 2 ** z):
+            return None
+        path = self.path(z, x, y)
+        try:
+            with open(path, "rb") as fh:
+                self.hits += 1
+                return fh.read()
+        except FileNotFoundError:
+            pass
+        self.misses += 1
+        if self.offline or not self.upstream:
+            return None
+        data = self._fetch(z, x, y)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as fh:
+            fh.write(data)
+        os.replace(tmp, path)
+        return data
+
+
+def tiles_for_bbox(south, west, north, east, zoom):
+    """(x, y) of every tile at `zoom` covering the bounding box."""
+    def _xy(lat, lon):
+        lat = max(min(lat, 85.0511), -85.0511)
+        n = 2 ** zoom
+        x = int((lon + 180.0) / 360.0 * n)
+        y = int((1.0 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2.0 * n)
+        return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+    x0, y0 = _xy(north, west)
+    x1, y1 = _xy(south, east)
+    return [(x, y) for x in range(x0, x1 + 1) for y in range(y0, y1 + 1)]
+
+
+def allows_bulk(upstream):
+    from urllib.parse import urlsplit
+
+    host = (urlsplit(upstream or "").hostname or "").lower()
+    return bool(host) and not any(host == h or host.endswith("." + h) for h in NO_BULK_HOSTS)
+
+
+def seed(cache, bbox, zooms, progress=None):
+    if not allows_bulk(cache.upstream):
+        raise ValueError(
+            f"refusing to bulk-fetch from {cache.upstream!r}: the OSM tile usage policy "
+            "forbids it; pass --upstream (or GWP_TILE_UPSTREAM) for a tile server you may seed from"
+        )
+    tiles = [(z, x, y) for z in zooms for x, y in tiles_for_bbox(*bbox, z)]
+    for i, (z, x, y) in enumerate(tiles, 1):
+        cache.get(z, x, y)
+        if progress is not None:
+            progress(i, len(tiles))
+    return len(tiles)
+
+
+# ===============================
+# Serving
+# ===============================
+_server = None
+_server_lock = threading.Lock()
+
+
+def serve_tiles(cache, port=DEFAULT_PORT, host="0.0.0.0"):
+    """Serve GET /{z}/{x}/{y}.png from a daemon thread (once per process)."""
+    global _server
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class _Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            parts = self.path.split("?")[0].strip("/").split("/")
+            data = None
+            if len(parts) == 3 and parts[2].endswith(".png"):
+                try:
+                    data = cache.get(parts[0], parts[1], parts[2][:-4])
+                except ValueError:
+                    data = None
+                except Exception as e:
+                    self.send_error(502, str(e))
+                    return
+            if data is None:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "image/png")
+            self.send_header("Content-Length", str(len(data)))
+            self.send_header("Cache-Control", "public, max-age=604800")
+            self.send_header("Access-Control-Allow-Origin", "*")
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+
+    with _server_lock:
+        if _server is None:
+            _server = ThreadingHTTPServer((host, int(port)), _Handler)
+            threading.Thread(target=_server.serve_forever, name="tiles", daemon=True).start()
+    return _server
+
+
+_started = False
+
+
+def _serve_from_env(directory, port):
+    """Start the app's tile server on the first call in this process only;
+    a bind failure is reported once and remembered."""
+    global _started
+    with _server_lock:
+        if _started:
+            return
+        _started = True
+    cache = TileCache(directory, upstream=os.environ.get("GWP_TILE_UPSTREAM", UPSTREAM),
+                      offline=os.environ.get("GWP_TILE_OFFLINE") == "1")
+    try:
+        serve_tiles(cache, port)
+    except OSError as e:
+        # Another Streamlit worker on this host already serves it
+        print(f"[tile_cache] port {port} unavailable: {e}", flush=True)
+    if not os.environ.get("GWP_TILE_URL"):
+        print(f"[tile_cache] GWP_TILE_URL not set; maps load tiles from localhost:{port}, "
+              "which only works for a browser on this host", flush=True)
+
+
+def tile_layer(serve=True):
+    """(tiles, attr) for folium.Map: OpenStreetMap, or the local tile cache
+    when GWP_TILE_CACHE_DIR is set (its server is started on first use).
+    serve=False is for maps saved to a file, which outlive this process:
+    they use GWP_TILE_URL when set, otherwise OpenStreetMap."""
+    url = os.environ.get("GWP_TILE_URL")
+    directory = os.environ.get("GWP_TILE_CACHE_DIR")
+    if directory and serve:
+        port = int(os.environ.get("GWP_TILE_CACHE_PORT", DEFAULT_PORT))
+        _serve_from_env(directory, port)
+        url = url or f"http://localhost:{port}/{{z}}/{{x}}/{{y}}.png"
+    if url:
+        return url, ATTRIBUTION
+    return "OpenStreetMap", None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local map tile cache.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("seed", help="pre-fetch the tiles of an area")
+    p.add_argument("--bbox", type=float, nargs=4, required=True,
+                   metavar=("SOUTH", "WEST", "NORTH", "EAST"))
+    p.add_argument("--zoom", default="6-12", help="zoom level or range, e.g. 6-12")
+    p.add_argument("--dir", default=os.environ.get("GWP_TILE_CACHE_DIR", DEFAULT_DIR))
+    p.add_argument("--upstream", default=os.environ.get("GWP_TILE_UPSTREAM"),
+                   help="{z}/{x}/{y} URL template of a tile server you may bulk-fetch from "
+                        "(not tile.openstreetmap.org)")
+
+    p = sub.add_parser("serve", help="serve the cache over HTTP")
+    p.add_argument("--dir", default=os.environ.get("GWP_TILE_CACHE_DIR", DEFAULT_DIR))
+    p.add_argument("--port", type=int, default=DEFAULT_PORT)
+    p.add_argument("--offline", action="store_true", help="never contact the upstream")
+    p.add_argument("--upstream", default=os.environ.get("GWP_TILE_UPSTREAM", UPSTREAM),
+                   help="where tiles missing from the cache are fetched, as viewed")
+    args = parser.parse_args()
+
+    if args.command == "seed":
+        if not allows_bulk(args.upstream):
+            parser.error("seed needs --upstream (or GWP_TILE_UPSTREAM): a tile server you may "
+                         "bulk-fetch from; the OSM tile usage policy forbids seeding from "
+                         "tile.openstreetmap.org")
+        lo, _, hi = args.zoom.partition("-")
+        zooms = range(int(lo), int(hi or lo) + 1)
+        cache = TileCache(args.dir, upstream=args.upstream)
+        t0 = time.perf_counter()
+        n = seed(cache, args.bbox, zooms,
+                 progress=lambda i, total: print(f"\r{i:,}/{total:,} tiles", end="", flush=True))
+        print(f"\n{n:,} tiles ({cache.misses:,} fetched, {cache.hits:,} already cached) "
+              f"in {time.perf_counter() - t0:.1f}s -> {args.dir}")
+        return
+
+    serve_tiles(TileCache(args.dir, upstream=args.upstream, offline=args.offline), args.port)
+    print(f"serving {args.dir} on http://localhost:{args.port}/{{z}}/{{x}}/{{y}}.png", flush=True)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
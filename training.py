@@ -0,0 +1,418 @@
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+from contextlib import contextmanager
+
+import joblib
+import numpy as np
+import pandas as pd
+
+from artifacts import (ARTIFACT_FILES, BASE_DIR, BUNDLE_FILE, DATA_COLUMNS, DATA_FILE,
+                       SCHEMA_FILE)
+
+# -----------------------------------------------------------------------
+# Cached, parallel training driver
+#
+# GWPOTERTIAL MAPPING.py used to re-encode the CSV and re-run Boruta from
+# scratch on every invocation, then fit one hard-coded SVC(C=1,
+# gamma='scale').  Here the stages are split so each can be reused:
+#
+#   load     read the CSV, hash its bytes (the cache key for everything
+#            derived from the data)
+#   encode   OrdinalEncoder over all predictors       -> cached on disk
+#   select   Boruta over the encoded matrix            -> cached on disk
+#            (BorutaPy by default; --selector fast for FastBoruta from
+#            feature_selection.py, which is not yet consistently faster
+#            on this data - compare with `python feature_selection.py`)
+#   search   stratified-CV grid / random search over C, gamma and kernel,
+#            folds and candidates spread over all cores (n_jobs=-1)
+#   refit    best parameters with probability=True (the app needs
+#            predict_proba), evaluated on the held-out split
+#
+# Cache entries live in .train_cache/ and are keyed by the data hash plus
+# the parameters of the stage, so editing the CSV invalidates them and
+# changing only the search space reuses the encoding and the selection.
+# A run writes the model bundle the app loads (model.gwpb, see
+# model_bundle.py; checked against the fitted estimators on every
+# training row before it is moved into place) and training_report.json
+# with per-stage timings, cache hits, the CV table and the held-out
+# scores, plus feature_schema.json (feature_schema.py) with the levels,
+# defaults and level frequencies the app renders its inputs from.
+# --pickles also writes the joblib files under the names the
+# artifact registry falls back to.
+#
+#     python training.py                       # grid search
+#     python training.py --search random --n-iter 200
+#     python training.py --no-cache            # recompute everything
+# -----------------------------------------------------------------------
+
+DEFAULT_CACHE_DIR = os.path.join(BASE_DIR, ".train_cache")
+REPORT_FILE = "training_report.json"
+
+TARGET = "Decision"
+TARGET_MAP = {"High Potential": 1, "Low Potential": 0}
+
+
+RANDOM_STATE = 42
+TEST_SIZE = 0.2
+CV_FOLDS = 5
+
+PARAM_GRID = [
+    {
+        "svc__kernel": ["rbf", "sigmoid"],
+        "svc__C": [0.1, 0.3, 1, 3, 10, 30, 100],
+        "svc__gamma": ["scale", 0.01, 0.03, 0.1, 0.3, 1.0],
+    },
+    {
+        "svc__kernel": ["linear"],
+        "svc__C": [0.01, 0.1, 1, 10, 100],
+    },
+    {
+        "svc__kernel": ["poly"],
+        "svc__C": [0.1, 1, 10],
+        "svc__gamma": ["scale", 0.1],
+        "svc__degree": [2, 3],
+    },
+]
+
+
+def param_distributions():
+    from scipy.stats import loguniform
+
+    return {
+        "svc__kernel": ["rbf", "linear", "poly", "sigmoid"],
+        "svc__C": loguniform(1e-2, 1e3),
+        "svc__gamma": loguniform(1e-3, 1e1),
+        "svc__degree": [2, 3],
+    }
+
+
+# ===============================
+# Disk cache
+# ===============================
+class StageCache:
+    """joblib files named by stage and a hash of everything the stage
+    depends on.  hits/misses are recorded for the report."""
+
+    def __init__(self, path=DEFAULT_CACHE_DIR, enabled=True):
+        self.path = path
+        self.enabled = enabled
+        self.hits = []
+        self.misses = []
+
+    def key(self, *parts):
+        return hashlib.sha256(json.dumps(parts, default=str).encode()).hexdigest()[:16]
+
+    def get_or_build(self, stage, key, builder):
+        path = os.path.join(self.path, f"{stage}-{key}.joblib")
+        if self.enabled and os.path.exists(path):
+            try:
+                value = joblib.load(path)
+                self.hits.append(stage)
+                return value
+            except Exception as e:
+                print(f"[training] ignoring unreadable cache entry {path}: {e}", flush=True)
+        value = builder()
+        self.misses.append(stage)
+        if self.enabled:
+            os.makedirs(self.path, exist_ok=True)
+            tmp = f"{path}.{os.getpid()}.tmp"
+            joblib.dump(value, tmp)
+            os.replace(tmp, path)
+        return value
+
+
+class StageTimer:
+    def __init__(self):
+        self.seconds = {}
+
+    @contextmanager
+    def __call__(self, stage):
+        print(f"[training] {stage}…", flush=True)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds[stage] = time.perf_counter() - start
+
+
+# ===============================
+# Stages
+# ===============================
+def load_training_data(path):
+    from columnar import file_sha256, is_columnar, open_dataset
+
+    data_hash = file_sha256(path)
+    if is_columnar(path):
+        # Dictionary columns come back as Categoricals over the dictionary
+        # (see columnar.py); encode_predictors reads their codes directly.
+        with open_dataset(path) as dataset:
+            df = dataset.read().to_pandas()
+    else:
+        df = pd.read_csv(path)
+    df.columns = DATA_COLUMNS
+    df[TARGET] = df[TARGET].str.strip()
+    y = df[TARGET].map(TARGET_MAP)
+    if y.isna().any():
+        bad = sorted(df.loc[y.isna(), TARGET].unique())
+        raise ValueError(f"Unknown {TARGET} labels: {bad}")
+    X = df.drop(TARGET, axis=1)
+    return X, y.astype(np.int64).to_numpy(), data_hash
+
+
+def encode_predictors(X):
+    from sklearn.preprocessing import OrdinalEncoder
+
+    if len(X) and all(isinstance(X[c].dtype, pd.CategoricalDtype) for c in X.columns):
+        # Dictionary-encoded predictors (a columnar.py dataset): the
+        # categories are the dictionaries and the codes are the indices,
+        # so no string is hashed.  Same result as fitting on the strings
+        # when the dictionaries are the sorted levels (convert --levels data).
+        categories = [np.asarray(X[c].cat.categories, dtype=object) for c in X.columns]
+        X_encoded = np.column_stack([X[c].cat.codes.to_numpy() for c in X.columns])
+        if (X_encoded < 0).any():
+            col = X.columns[np.argwhere(X_encoded < 0)[0][1]]
+            raise ValueError(f"Missing values in column '{col}'")
+        encoder = OrdinalEncoder(categories=categories).fit(X.iloc[:1])
+        return {"encoder": encoder, "X": X_encoded.astype(np.float64), "columns": list(X.columns)}
+
+    encoder = OrdinalEncoder()
+    X_encoded = encoder.fit_transform(X)
+    return {"encoder": encoder, "X": X_encoded, "columns": list(X.columns)}
+
+
+def boruta_select(X_encoded, y, columns, random_state=RANDOM_STATE, selector="boruta"):
+    if selector == "fast":
+        from feature_selection import FastBoruta
+
+        engine = FastBoruta(class_weight="balanced", random_state=random_state)
+    elif selector == "boruta":
+        from boruta import BorutaPy
+        from sklearn.ensemble import RandomForestClassifier
+
+        rf = RandomForestClassifier(n_estimators=100, random_state=random_state,
+                                    n_jobs=-1, class_weight="balanced")
+        engine = BorutaPy(rf, n_estimators="auto", random_state=random_state)
+    else:
+        raise ValueError(f"Unknown feature selector: {selector}")
+    engine.fit(X_encoded, y)
+    return {
+        "features": [c for c, keep in zip(columns, engine.support_) if keep],
+        "ranking": dict(zip(columns, engine.ranking_.tolist())),
+    }
+
+
+def search_svc(X_train, y_train, search="grid", n_iter=60, folds=CV_FOLDS,
+               n_jobs=-1, random_state=RANDOM_STATE):
+    from sklearn.model_selection import GridSearchCV, RandomizedSearchCV, StratifiedKFold
+    from sklearn.pipeline import Pipeline
+    from sklearn.preprocessing import StandardScaler
+    from sklearn.svm import SVC
+
+    # Scaling is part of the searched pipeline so each fold is scaled
+    # with its own training statistics.  probability=False here: Platt
+    # scaling runs an inner 5-fold CV per fit and is only needed once, on
+    # the final model.
+    pipe = Pipeline([("scaler", StandardScaler()), ("svc", SVC())])
+    cv = StratifiedKFold(n_splits=folds, shuffle=True, random_state=random_state)
+    if search == "grid":
+        searcher = GridSearchCV(pipe, PARAM_GRID, cv=cv, scoring="accuracy",
+                                n_jobs=n_jobs, refit=False)
+    elif search == "random":
+        searcher = RandomizedSearchCV(pipe, param_distributions(), n_iter=n_iter, cv=cv,
+                                      scoring="accuracy", n_jobs=n_jobs, refit=False,
+                                      random_state=random_state)
+    else:
+        raise ValueError(f"Unknown search strategy: {search}")
+    searcher.fit(X_train, y_train)
+    return searcher
+
+
+def cv_table(searcher, top=10):
+    res = searcher.cv_results_
+    order = np.argsort(res["rank_test_score"], kind="stable")[:top]
+    return [
+        {
+            "params": {k.replace("svc__", ""): v for k, v in res["params"][i].items()},
+            "mean_accuracy": float(res["mean_test_score"][i]),
+            "std_accuracy": float(res["std_test_score"][i]),
+            "mean_fit_seconds": float(res["mean_fit_time"][i]),
+        }
+        for i in order
+    ]
+
+
+def fit_final(X_train, y_train, params, random_state=RANDOM_STATE):
+    from sklearn.preprocessing import StandardScaler
+    from sklearn.svm import SVC
+
+    scaler = StandardScaler()
+    X_scaled = scaler.fit_transform(X_train)
+    svc_params = {k.replace("svc__", ""): v for k, v in params.items()}
+    model = SVC(probability=True, random_state=random_state, **svc_params)
+    model.fit(X_scaled, y_train)
+    return scaler, model
+
+
+# ===============================
+# Driver
+# ===============================
+def train(data_path=None, output_dir=BASE_DIR, cache_dir=DEFAULT_CACHE_DIR,
+          use_cache=True, selector="boruta", search="grid", n_iter=60, folds=CV_FOLDS, n_jobs=-1,
+          random_state=RANDOM_STATE, pickles=False):
+    """Run the full pipeline and write the model bundle and report.
+    Returns the report dict."""
+    from sklearn.metrics import accuracy_score, classification_report, confusion_matrix
+    from sklearn.model_selection import train_test_split
+
+    data_path = data_path or os.path.join(BASE_DIR, DATA_FILE)
+    cache = StageCache(cache_dir, enabled=use_cache)
+    timer = StageTimer()
+    total_start = time.perf_counter()
+
+    # 1-3. Load dataset, rename columns, encode target
+    with timer("load"):
+        X, y, data_hash = load_training_data(data_path)
+
+    # 4. Encode predictors using OrdinalEncoder
+    with timer("encode"):
+        encoded = cache.get_or_build(
+            "encoded", cache.key(data_hash), lambda: encode_predictors(X)
+        )
+    X_encoded = pd.DataFrame(encoded["X"], columns=encoded["columns"])
+
+    # 5. Boruta feature selection
+    with timer("select"):
+        selection = cache.get_or_build(
+            "boruta", cache.key(data_hash, selector, random_state),
+            lambda: boruta_select(encoded["X"], y, encoded["columns"], random_state, selector),
+        )
+    important_features = selection["features"]
+    if not important_features:
+        raise RuntimeError("Boruta confirmed no predictors; nothing to train on")
+    print("Important predictors (variable-level):", important_features, flush=True)
+    X_selected = X_encoded[important_features]
+
+    # 6. Train-test split
+    X_train, X_test, y_train, y_test = train_test_split(
+        X_selected, y, test_size=TEST_SIZE, random_state=random_state, stratify=y
+    )
+
+    # 7-8. Hyperparameter search (scale + SVC, stratified CV, all cores)
+    with timer("search"):
+        searcher = search_svc(X_train, y_train, search=search, n_iter=n_iter,
+                              folds=folds, n_jobs=n_jobs, random_state=random_state)
+    best_params = searcher.best_params_
+
+    with timer("refit"):
+        scaler, model = fit_final(X_train, y_train, best_params, random_state)
+
+    # 9. Evaluate
+    y_pred = model.predict(scaler.transform(X_test))
+    accuracy = accuracy_score(y_test, y_pred)
+    print("Best parameters:", best_params)
+    print(f"CV accuracy: {searcher.best_score_:.4f}")
+    print("Accuracy:", accuracy)
+    print(classification_report(y_test, y_pred))
+    print(confusion_matrix(y_test, y_pred))
+
+    # 10. Save the bundle and schema (+ optionally the joblib pickles)
+    with timer("save"):
+        from feature_schema import build_schema, write_schema
+        from model_bundle import verify_bundle, write_bundle
+
+        os.makedirs(output_dir, exist_ok=True)
+        written = {}
+        bundle_path = os.path.join(output_dir, BUNDLE_FILE)
+        staged = write_bundle(
+            f"{bundle_path}.new", encoded["encoder"], scaler, model, important_features,
+            metadata={"data_sha256": data_hash, "selector": selector,
+                      "params": best_params, "holdout_accuracy": float(accuracy)},
+            reference=X,
+        )
+        verify_bundle(staged, encoded["encoder"], scaler, model, important_features, X)
+        os.replace(f"{bundle_path}.new", bundle_path)
+        written["bundle"] = bundle_path
+
+        # Levels, defaults and frequencies for the app's input pages
+        schema_path = os.path.join(output_dir, SCHEMA_FILE)
+        write_schema(schema_path, build_schema(X, encoded["columns"], important_features, data_hash))
+        written["schema"] = schema_path
+
+        if pickles:
+            outputs = {
+                "model": model,
+                "scaler": scaler,
+                "encoder": encoded["encoder"],
+                "selected_features": important_features,
+            }
+            for name, obj in outputs.items():
+                path = os.path.join(output_dir, ARTIFACT_FILES[name])
+                joblib.dump(obj, path)
+                written[name] = path
+
+    report = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "data": {"path": os.path.abspath(data_path), "sha256": data_hash,
+                 "rows": int(len(y)), "class_counts": np.bincount(y).tolist()},
+        "bundle_version": staged.version,
+        "selected_features": important_features,
+        "selector": selector,
+        "boruta_ranking": selection["ranking"],
+        "search": {
+            "strategy": search,
+            "folds": folds,
+            "candidates": len(searcher.cv_results_["params"]),
+            "best_params": {k.replace("svc__", ""): v for k, v in best_params.items()},
+            "best_cv_accuracy": float(searcher.best_score_),
+            "top": cv_table(searcher),
+        },
+        "holdout": {
+            "rows": int(len(y_test)),
+            "accuracy": float(accuracy),
+            "classification_report": classification_report(y_test, y_pred, output_dict=True),
+            "confusion_matrix": confusion_matrix(y_test, y_pred).tolist(),
+        },
+        "cache": {"dir": cache.path if use_cache else None,
+                  "hits": cache.hits, "misses": cache.misses},
+        "seconds": dict(timer.seconds, total=time.perf_counter() - total_start),
+        "outputs": written,
+    }
+    with open(os.path.join(output_dir, REPORT_FILE), "w") as fh:
+        json.dump(report, fh, indent=2, default=str)
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Train the Boruta + SVC model with cached stages and CV search.")
+    parser.add_argument("--data", default=None, help=f"training CSV or columnar dataset (default: {DATA_FILE})")
+    parser.add_argument("--output-dir", default=BASE_DIR)
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR)
+    parser.add_argument("--no-cache", action="store_true", help="recompute every stage")
+    parser.add_argument("--selector", choices=["fast", "boruta"], default="boruta",
+                        help="feature selection engine (fast = FastBoruta)")
+    parser.add_argument("--search", choices=["grid", "random"], default="grid")
+    parser.add_argument("--n-iter", type=int, default=60, help="candidates for --search random")
+    parser.add_argument("--folds", type=int, default=CV_FOLDS)
+    parser.add_argument("--jobs", type=int, default=-1, help="parallel CV fits (-1 = all cores)")
+    parser.add_argument("--seed", type=int, default=RANDOM_STATE)
+    parser.add_argument("--pickles", action="store_true",
+                        help="also write the joblib pickles next to the bundle")
+    args = parser.parse_args(argv)
+
+    report = train(
+        data_path=args.data, output_dir=args.output_dir, cache_dir=args.cache_dir,
+        use_cache=not args.no_cache, selector=args.selector, search=args.search, n_iter=args.n_iter,
+        folds=args.folds, n_jobs=args.jobs, random_state=args.seed,
+        pickles=args.pickles,
+    )
+    timings = "  ".join(f"{k} {v:.2f}s" for k, v in report["seconds"].items())
+    hits = ", ".join(report["cache"]["hits"]) or "none"
+    sys.stderr.write(f"[training] {timings}  (cache hits: {hits})\n")
+
+
+if __name__ == "__main__":
+    main()